@@ -0,0 +1,467 @@
+"""
+Asyncio server for the API gateway.
+
+Serves the same routes as gateway.py with aiohttp: requests to the masters
+and workers no longer hold a thread while they wait, and downloads are
+streamed to the client as their chunks arrive (fetching the next chunks
+ahead) instead of being reassembled in a temporary file first. Leader,
+ring and routing logic are shared with gateway.py.
+
+Usage (from the distributed_file_system directory):
+    python -m api_gateway.async_gateway
+"""
+import asyncio
+import os
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+from flask import render_template
+
+from api_gateway import gateway
+from api_gateway.gateway import (
+    MASTER_NODES,
+    GATEWAY_PORT,
+    RING_READ_CANDIDATES,
+    TRACE_COLLECT_TIMEOUT,
+    LEADER_LOOKUPS,
+    LEADER_LOOKUP_SECONDS,
+    MASTER_READ_SECONDS,
+    leader_cache,
+    worker_cache,
+    read_rotation,
+    get_master_url,
+    chunk_range_headers,
+    format_timestamp,
+    record_chunk_fetch,
+    ring_from_membership,
+    log,
+    chunk_log,
+)
+from database.connection import get_async_metadata_store
+from database.db_operations import update_worker
+from shared.admission import aiohttp_admission_required, rejection_headers, relay_headers
+from shared.quotas import OWNER_HEADER
+from shared.chunk_naming import is_chunk_id
+from shared.metrics import aiohttp_metrics_handler, aiohttp_metrics_middleware
+from shared.profiling import add_aiohttp_profiling_routes, aiohttp_profiling_middleware
+from shared.tracing import aiohttp_tracing_middleware, inject, recorder, response_headers, span
+from shared.partitioning import CLUSTER_PARTITION, partition_for
+from shared.placement import PLACEMENT_MODE, hash_placement
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 1024 ** 3))  # Largest request body accepted
+DOWNLOAD_PREFETCH = int(os.getenv("DOWNLOAD_PREFETCH", 2))  # Chunks fetched ahead of the one being sent
+CONNECTION_LIMIT = 1024  # Open connections to masters and workers across all requests
+MASTER_TIMEOUT = aiohttp.ClientTimeout(total=5)
+WORKER_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+
+class MasterUnavailable(Exception):
+    pass
+
+
+async def get_current_leader_url(session, partition=CLUSTER_PARTITION):
+    cached_url = leader_cache.get(('leader_url', partition))
+    if cached_url:
+        LEADER_LOOKUPS.labels('cached').inc()
+        return cached_url
+
+    with LEADER_LOOKUP_SECONDS.time(), span("leader.discover", partition=partition):
+        leader_url = await discover_leader_url(session, partition)
+    LEADER_LOOKUPS.labels('discovered' if leader_url else 'failed').inc()
+    if not leader_url:
+        raise MasterUnavailable(f"No leader of partition {partition} could be discovered among master nodes.")
+    return leader_url
+
+
+async def discover_leader_url(session, partition):
+    for master in MASTER_NODES:
+        try:
+            async with session.get(f"{get_master_url(master)}/current_leader", params={'partition': partition},
+                                   headers=inject(), timeout=aiohttp.ClientTimeout(total=2)) as response:
+                if response.status != 200:
+                    continue
+                leader = (await response.json()).get('leader')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning(f"Error querying {master}: {e}")
+            continue
+        if leader in MASTER_NODES:
+            leader_cache.set(('leader_url', partition), get_master_url(leader))
+            return get_master_url(leader)
+    return None
+
+
+async def send_to_leader(session, method, path, partition=CLUSTER_PARTITION, make_data=None, headers=None):
+    """
+    Send a mutating request to the leader of a metadata partition, retrying
+    once with a rediscovered leader (see gateway.send_to_leader). A request
+    body is built by `make_data` for every attempt, since aiohttp forms can
+    only be sent once.
+
+    Returns:
+        tuple: (status, JSON body)
+    """
+    for attempt in range(2):
+        leader_url = await get_current_leader_url(session, partition)
+        try:
+            with span("master.request", method=method, path=path, leader=leader_url):
+                async with session.request(method, f"{leader_url}{path}", data=make_data() if make_data else None,
+                                           headers=inject(dict(headers or {}))) as response:
+                    body = await response.json(content_type=None)
+                    status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            leader_cache.invalidate(('leader_url', partition))
+            if attempt:
+                raise
+            continue
+        if status == 403 and not attempt:
+            leader_cache.invalidate(('leader_url', partition))
+            continue
+        return status, body
+
+
+async def read_from_masters(session, path):
+    """
+    Send a read-only metadata request to any master, in round-robin order.
+
+    Returns:
+        tuple: (status, JSON body)
+    """
+    masters = list(MASTER_NODES)
+    start = next(read_rotation) % len(masters)
+    last_error = None
+    for i in range(len(masters)):
+        master = masters[(start + i) % len(masters)]
+        try:
+            with MASTER_READ_SECONDS.time(), span("master.read", path=path, master=master):
+                async with session.get(f"{get_master_url(master)}{path}", headers=inject(),
+                                       timeout=MASTER_TIMEOUT) as response:
+                    if response.status >= 500:
+                        last_error = f"{master} returned {response.status}"
+                        continue
+                    return response.status, await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_error = e
+    raise MasterUnavailable(f"No master could serve {path}: {last_error}")
+
+
+async def fetch_file_metadata(session, file_id):
+    status, body = await read_from_masters(session, f"/files/{file_id}")
+    return None if status == 404 else body
+
+
+async def fetch_worker_locations(session):
+    cached = worker_cache.get('active_workers')
+    if cached:
+        return cached
+    _, body = await read_from_masters(session, "/workers")
+    workers = [w for w in body.get('workers', []) if w.get('status') == 'active']
+    locations = {w['worker_id']: w['url'] for w in workers}, {w['worker_id']: w.get('phi') or 0 for w in workers}
+    worker_cache.set('active_workers', locations)
+    return locations
+
+
+async def fetch_worker_ring(session):
+    """
+    Fetch the placement ring membership from any master (see gateway.fetch_worker_ring).
+    """
+    membership = leader_cache.get('ring_membership')
+    if membership is None:
+        _, membership = await read_from_masters(session, "/ring")
+        leader_cache.set('ring_membership', membership)
+    return ring_from_membership(membership)
+
+
+async def fetch_chunk(session, chunk, worker_ids, active_workers):
+    """
+    Fetch a chunk entry's bytes from the first of its workers that answers.
+
+    Returns:
+        bytes: The chunk data, or None if no worker could serve it.
+    """
+    chunk_id = chunk['chunk_id']
+    for worker_id in worker_ids:
+        worker_url = active_workers.get(worker_id)
+        if not worker_url:
+            chunk_log.info("chunk.worker_inactive", "Worker %s is not active", worker_id,
+                           chunk_id=chunk_id, worker_id=worker_id)
+            continue
+        started = time.perf_counter()
+        try:
+            with span("chunk.fetch", chunk_id=chunk_id, worker=worker_id):
+                async with session.get(f"{worker_url}/chunks/{chunk_id}", headers=inject(chunk_range_headers(chunk)),
+                                       timeout=WORKER_TIMEOUT) as response:
+                    response.raise_for_status()
+                    chunk_data = await response.read()
+                    if 'offset' in chunk and response.status != 206:
+                        chunk_data = chunk_data[chunk['offset']:chunk['offset'] + chunk['size']]
+            if 'size' in chunk and len(chunk_data) != chunk['size']:
+                raise aiohttp.ClientPayloadError(f"expected {chunk['size']} bytes, got {len(chunk_data)}")
+            record_chunk_fetch(started, len(chunk_data))
+            return chunk_data
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_chunk_fetch(started)
+            chunk_log.warning("chunk.fetch_failed", "Failed to retrieve chunk %s from worker %s: %s", chunk_id,
+                              worker_id, e, chunk_id=chunk_id, worker_id=worker_id)
+    return None
+
+
+@aiohttp_admission_required
+async def create_file(request):
+    """
+    Upload file to the leader master node of the file's metadata partition.
+    """
+    form = await request.post()
+    file = form.get('file')
+    if not isinstance(file, web.FileField):
+        return web.json_response({'error': 'No file provided'}, status=400)
+
+    # The file ID decides the partition, so it is chosen here to route the upload
+    file_id = str(uuid.uuid4())
+    file_data = file.file.read()
+
+    def upload_form():
+        fields = aiohttp.FormData()
+        if form.get('chunk_size_mb'):
+            fields.add_field('chunk_size_mb', form['chunk_size_mb'])  # Optional chunk size hint
+        fields.add_field('file', file_data, filename=file.filename)
+        return fields
+
+    headers = relay_headers(request.headers, request.remote)  # Accounted to the same client
+    if request.headers.get(OWNER_HEADER):
+        headers[OWNER_HEADER] = request.headers[OWNER_HEADER]  # Stored for, and counted against the quota of, this owner
+    try:
+        status, body = await send_to_leader(
+            request.app['session'], 'POST', f"/upload_file?file_id={file_id}", partition=partition_for(file_id),
+            make_data=upload_form, headers=headers
+        )
+        return web.json_response(body, status=status, headers=rejection_headers(body))
+    except (aiohttp.ClientError, asyncio.TimeoutError, MasterUnavailable) as e:
+        return web.json_response({'error': f'Master node communication failed: {str(e)}'}, status=500)
+
+
+async def get_usage(request):
+    """
+    Return an owner's storage usage and quotas, from any master.
+    """
+    try:
+        status, body = await read_from_masters(request.app['session'], f"/usage/{request.match_info['owner']}")
+    except (aiohttp.ClientError, asyncio.TimeoutError, MasterUnavailable) as e:
+        return web.json_response({'error': f'Master node communication failed: {str(e)}'}, status=500)
+    return web.json_response(body, status=status)
+
+
+async def delete_file_post(request):
+    """
+    Soft delete a file by notifying the leader master node of its partition.
+    """
+    file_id = request.match_info['file_id']
+    try:
+        status, body = await send_to_leader(
+            request.app['session'], 'DELETE', f"/files/{file_id}", partition=partition_for(file_id)
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, MasterUnavailable) as e:
+        return web.json_response({'error': f'Master node communication failed: {str(e)}'}, status=500)
+    if status == 200:
+        raise web.HTTPFound('/')
+    return web.json_response({'error': (body or {}).get('error', 'Unknown error')}, status=status)
+
+
+async def download_file(request):
+    """
+    Download a file, streaming its chunks to the client in order while the
+    next DOWNLOAD_PREFETCH chunks are already being fetched.
+    """
+    session = request.app['session']
+    file_id = request.match_info['file_id']
+    try:
+        file_metadata, (active_workers, suspicion) = await asyncio.gather(
+            fetch_file_metadata(session, file_id), fetch_worker_locations(session)
+        )
+        ring = (await fetch_worker_ring(session))[0] if PLACEMENT_MODE == "hash" else None
+    except (aiohttp.ClientError, asyncio.TimeoutError, MasterUnavailable) as e:
+        return web.json_response({'error': f'Master node communication failed: {str(e)}'}, status=500)
+    if not file_metadata or file_metadata.get('status') == 'deleted':
+        return web.json_response({'error': 'File not found'}, status=404)
+
+    def start_fetch(chunk):
+        # Least suspected workers first
+        worker_ids = sorted(chunk['worker_ids'], key=lambda w: suspicion.get(w, 0))
+        if ring is not None:
+            # Fall back to the ring's preference list if no recorded replica answers
+            worker_ids += [w for w in hash_placement(ring, chunk['chunk_id'], RING_READ_CANDIDATES,
+                                                     eligible=active_workers) if w not in worker_ids]
+        return asyncio.ensure_future(fetch_chunk(session, chunk, worker_ids, active_workers))
+
+    chunks = file_metadata['chunks']
+    fetches = [start_fetch(chunk) for chunk in chunks[:DOWNLOAD_PREFETCH + 1]]
+    response = None
+    try:
+        for index, chunk in enumerate(chunks):
+            chunk_data = await fetches[index]
+            if index + DOWNLOAD_PREFETCH + 1 < len(chunks):
+                fetches.append(start_fetch(chunks[index + DOWNLOAD_PREFETCH + 1]))
+            if chunk_data is None:
+                if response is None:
+                    return web.json_response(
+                        {'error': f"Failed to retrieve chunk {chunk['chunk_id']} from any worker"}, status=500
+                    )
+                # Part of the file was already sent; cutting the connection is the only way to report it
+                raise ConnectionResetError(f"Failed to retrieve chunk {chunk['chunk_id']} from any worker")
+            if response is None:
+                response = web.StreamResponse(headers=response_headers({
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Disposition': f'attachment; filename="{file_metadata["file_name"]}"',
+                }))
+                response.content_length = file_metadata.get('size')
+                await response.prepare(request)
+            await response.write(chunk_data)
+    finally:
+        for fetch in fetches:
+            fetch.cancel()
+
+    if response is None:
+        # Empty file
+        return web.Response(body=b"", content_type='application/octet-stream', headers={
+            'Content-Disposition': f'attachment; filename="{file_metadata["file_name"]}"'
+        })
+    await response.write_eof()
+    return response
+
+
+async def read_chunk(request):
+    """
+    Read a chunk without a metadata lookup, from the workers that the
+    placement ring prefers for it (see gateway.read_chunk).
+    """
+    chunk_id = request.match_info['chunk_id']
+    if PLACEMENT_MODE != "hash":
+        return web.json_response({'error': 'Chunk reads by ID require PLACEMENT_MODE=hash'}, status=400)
+    if not is_chunk_id(chunk_id):
+        return web.json_response({'error': 'Invalid chunk ID'}, status=400)
+    session = request.app['session']
+    try:
+        ring, active_workers = await fetch_worker_ring(session)
+    except (aiohttp.ClientError, asyncio.TimeoutError, MasterUnavailable) as e:
+        return web.json_response({'error': f'Master node communication failed: {str(e)}'}, status=500)
+
+    headers = {'Range': request.headers['Range']} if 'Range' in request.headers else None
+    for worker_id in hash_placement(ring, chunk_id, RING_READ_CANDIDATES, eligible=active_workers):
+        started = time.perf_counter()
+        try:
+            with span("chunk.fetch", chunk_id=chunk_id, worker=worker_id):
+                async with session.get(f"{active_workers[worker_id]}/chunks/{chunk_id}", headers=inject(dict(headers or {})),
+                                       timeout=WORKER_TIMEOUT) as response:
+                    if response.status in (200, 206):
+                        chunk_data = await response.read()
+                        record_chunk_fetch(started, len(chunk_data))
+                        return web.Response(body=chunk_data, status=response.status,
+                                            content_type='application/octet-stream')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_chunk_fetch(started)
+            chunk_log.warning("chunk.fetch_failed", "Failed to retrieve chunk %s from worker %s: %s", chunk_id,
+                              worker_id, e, chunk_id=chunk_id, worker_id=worker_id)
+    return web.json_response({'error': f'Chunk {chunk_id} was not found on its ring workers'}, status=404)
+
+
+async def index(request):
+    """
+    Render the index page with a list of all files.
+    """
+    _, body = await read_from_masters(request.app['session'], "/files")
+    files = [
+        {
+            'file_id': file_doc.get('file_id'),
+            'file_name': file_doc.get('file_name'),
+            'created_at': format_timestamp(file_doc.get('created_at')),
+            'chunks': file_doc.get('chunks', []),
+            'status': file_doc.get('status', 'active'),  # Default to 'active' if not set
+            'deleted_at': format_timestamp(file_doc.get('deleted_at'))
+        }
+        for file_doc in body.get('files', [])
+    ]
+    # The template (and its url_for calls) is rendered with the Flask gateway's routes
+    with gateway.app.test_request_context('/'):
+        html = render_template('index.html', files=files)
+    return web.Response(text=html, content_type='text/html')
+
+
+async def worker_heartbeat(request):
+    worker_url = (await request.json()).get('url')  # Expect worker to send its full URL
+    if not worker_url:
+        return web.json_response({'error': 'Worker URL not provided'}, status=400)
+
+    worker_id = request.match_info['worker_id']
+    await get_async_metadata_store().run(update_worker, worker_id, worker_url)  # On the store's bounded pool
+    return web.json_response({'message': f'Heartbeat received from {worker_id}'})
+
+
+async def list_traces(request):
+    return web.json_response({'service': 'gateway', 'traces': recorder.recent_traces()})
+
+
+async def get_trace(request):
+    """
+    Return the spans of a trace from this gateway process and, unless
+    `local=1` is passed, from every master and active worker (see
+    gateway.collect_remote_spans).
+    """
+    trace_id = request.match_info['trace_id']
+    spans = recorder.spans(trace_id)
+    if request.query.get('local') != '1':
+        session = request.app['session']
+        node_urls = [get_master_url(master) for master in MASTER_NODES]
+        try:
+            node_urls += list((await fetch_worker_locations(session))[0].values())
+        except (aiohttp.ClientError, asyncio.TimeoutError, MasterUnavailable) as e:
+            log.warning(f"Could not list workers for trace {trace_id}: {e}")
+
+        async def collect(node_url):
+            try:
+                async with session.get(f"{node_url}/traces/{trace_id}", params={'local': 1},
+                                       timeout=aiohttp.ClientTimeout(total=TRACE_COLLECT_TIMEOUT)) as response:
+                    response.raise_for_status()
+                    return (await response.json()).get('spans', [])
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                log.warning(f"Could not collect spans of trace {trace_id} from {node_url}: {e}")
+                return []
+
+        for node_spans in await asyncio.gather(*(collect(node_url) for node_url in node_urls)):
+            spans += node_spans
+    spans.sort(key=lambda s: s['start'])
+    return web.json_response({'trace_id': trace_id, 'spans': spans})
+
+
+async def open_session(app):
+    app['session'] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONNECTION_LIMIT))
+
+
+async def close_session(app):
+    await app['session'].close()
+
+
+def create_app():
+    app = web.Application(client_max_size=MAX_UPLOAD_BYTES, middlewares=[
+        aiohttp_metrics_middleware(),
+        aiohttp_tracing_middleware(root=True),  # Client requests start traces here (sampled)
+        aiohttp_profiling_middleware(),
+    ])
+    app.router.add_post('/files', create_file)
+    app.router.add_post('/files/{file_id}/delete', delete_file_post)
+    app.router.add_get('/usage/{owner}', get_usage)
+    app.router.add_get('/files/{file_id}/download', download_file)
+    app.router.add_get('/chunks/{chunk_id}', read_chunk)
+    app.router.add_get('/', index)
+    app.router.add_post('/heartbeat/{worker_id}', worker_heartbeat)
+    app.router.add_get('/metrics', aiohttp_metrics_handler)
+    app.router.add_get('/traces', list_traces)
+    app.router.add_get('/traces/{trace_id}', get_trace)
+    add_aiohttp_profiling_routes(app)  # /admin/profile and /admin/memory
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=GATEWAY_PORT)
@@ -1,24 +1,37 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file
+from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file, Response
 import os
 import requests
 from datetime import datetime
 import hashlib
+import itertools
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables from .env
 load_dotenv()
 
-from database.db_operations import (
-    get_active_workers,
-    fetch_file_metadata,
-    update_worker,
-)
-from database.connection import get_database
+from database.db_operations import update_worker
+from shared.shared_cache import create_cache
+from shared.partitioning import CLUSTER_PARTITION, partition_for
+from shared.placement import PLACEMENT_MODE, build_worker_ring, hash_placement
+from shared.chunk_naming import is_chunk_id
+from shared.metrics import counter, histogram, instrument_flask_app
+from shared.tracing import inject, span, trace_flask_app
+from shared.profiling import profile_flask_app
+from shared.logs import RateLimitedLogger, configure_logging
+from shared.admission import admission_required, rejection_headers, relay_headers
+from shared.quotas import OWNER_HEADER
 
-app = Flask(__name__)
+log = configure_logging("gateway")  # One-line JSON records, written by a background thread
+chunk_log = RateLimitedLogger(log)  # For events logged per chunk
 
-# Initialize the database
-db = get_database()
+app = Flask(__name__)
+instrument_flask_app(app)  # Request metrics and GET /metrics
+# Client requests start traces here (sampled); GET /traces/<trace_id> gathers their spans from every node
+trace_flask_app(app, "gateway", root=True, collect=lambda trace_id: collect_remote_spans(trace_id))
+profile_flask_app(app)  # On-demand profiling on /admin/profile and /admin/memory
 
 # Master Node URLs with IP addresses
 MASTER_NODES = {
@@ -27,27 +40,227 @@ MASTER_NODES = {
     "master_3": {"ip": os.getenv("MASTER_3_IP"), "port": os.getenv("MASTER_3_PORT")},
 }
 
-def get_current_leader_url():
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", 5000))
+LEADER_CACHE_TTL = 5  # Seconds a discovered leader is reused before asking the masters again
+RING_READ_CANDIDATES = 5  # Workers on the placement ring tried for a chunk read without metadata
+WORKER_CACHE_TTL = 1  # Seconds the active workers fetched for downloads are reused
+TRACE_COLLECT_TIMEOUT = 2  # Seconds each node may take to return its spans of a trace
+
+# Leader URL of each metadata partition, used for mutations; reads go to any master.
+# Also holds the placement ring membership for PLACEMENT_MODE=hash.
+# Both caches are shared by all gateway processes when started with api_gateway.serve.
+leader_cache = create_cache('leader', LEADER_CACHE_TTL)
+worker_cache = create_cache('workers', WORKER_CACHE_TTL)
+read_rotation = itertools.count()
+worker_ring = None  # (membership key, ring) last built in this process, see ring_from_membership
+worker_ring_lock = threading.Lock()
+
+# Hot path metrics served on /metrics, next to the request metrics of every route
+LEADER_LOOKUPS = counter('dfs_leader_lookups', 'Partition leader lookups, by result (cached, discovered, failed)', ('result',))
+LEADER_LOOKUP_SECONDS = histogram('dfs_leader_lookup_seconds', 'Time to discover a partition leader from the masters')
+MASTER_READ_SECONDS = histogram('dfs_master_read_seconds', 'Time of a metadata read sent to the masters')
+CHUNK_FETCH_SECONDS = histogram('dfs_chunk_fetch_seconds', 'Time to fetch a chunk from a worker, by outcome', ('outcome',))
+CHUNK_FETCH_BYTES = counter('dfs_chunk_fetch_bytes', 'Chunk bytes fetched from workers')
+
+def get_master_url(master):
+    info = MASTER_NODES[master]
+    return f"http://{info['ip']}:{info['port']}"
+
+def get_current_leader_url(partition=CLUSTER_PARTITION):
+    cached_url = leader_cache.get(('leader_url', partition))
+    if cached_url:
+        LEADER_LOOKUPS.labels('cached').inc()
+        return cached_url
+
+    with LEADER_LOOKUP_SECONDS.time(), span("leader.discover", partition=partition):
+        leader_url = discover_leader_url(partition)
+    LEADER_LOOKUPS.labels('discovered' if leader_url else 'failed').inc()
+    if not leader_url:
+        raise Exception(f"No leader of partition {partition} could be discovered among master nodes.")
+    return leader_url
+
+def discover_leader_url(partition):
+    """
+    Ask the masters for the leader of a partition and cache its URL.
+    Returns None if no master knows a leader.
+    """
     for master, info in MASTER_NODES.items():
         ip = info["ip"]
         port = info["port"]
         try:
-            print(f"Querying {master} at {ip}:{port} for leader...")
-            response = requests.get(f"http://{ip}:{port}/current_leader", timeout=2)
+            log.debug(f"Querying {master} at {ip}:{port} for leader of partition {partition}")
+            response = requests.get(f"http://{ip}:{port}/current_leader", params={'partition': partition},
+                                    headers=inject(), timeout=2)
             if response.status_code == 200:
                 leader = response.json().get("leader")
-                print(f"Leader discovered from {master}: {leader}")
+                log.debug(f"Leader discovered from {master}: {leader}")
                 if leader:
                     leader_info = MASTER_NODES.get(leader)
                     if leader_info:
                         leader_ip = leader_info["ip"]
                         leader_port = leader_info["port"]
-                        print(f"Returning leader URL: http://{leader_ip}:{leader_port}")
+                        leader_cache.set(('leader_url', partition), f"http://{leader_ip}:{leader_port}")
                         return f"http://{leader_ip}:{leader_port}"
         except requests.exceptions.RequestException as e:
-            print(f"Error querying {master}: {e}")
+            log.warning(f"Error querying {master}: {e}")
+    return None
+
+def send_to_leader(method, path, partition=CLUSTER_PARTITION, **kwargs):
+    """
+    Send a mutating request to the leader master of a metadata partition.
+
+    If the cached leader is unreachable or no longer the leader, the leader is
+    rediscovered and the request is retried once.
+    """
+    headers = kwargs.pop('headers', None)
+    for attempt in range(2):
+        leader_url = get_current_leader_url(partition)
+        try:
+            with span("master.request", method=method, path=path, leader=leader_url):
+                response = requests.request(method, f"{leader_url}{path}", headers=inject(dict(headers or {})), **kwargs)
+        except requests.exceptions.RequestException:
+            leader_cache.invalidate(('leader_url', partition))
+            if attempt:
+                raise
+            continue
+        if response.status_code == 403 and not attempt:
+            leader_cache.invalidate(('leader_url', partition))
+            continue
+        return response
+
+def read_from_masters(path):
+    """
+    Send a read-only metadata request to any master.
+
+    Masters are tried in round-robin order so reads are spread across all of
+    them; if one fails, the next is tried.
+    """
+    masters = list(MASTER_NODES)
+    start = next(read_rotation) % len(masters)
+    last_error = None
+    for i in range(len(masters)):
+        master = masters[(start + i) % len(masters)]
+        try:
+            with MASTER_READ_SECONDS.time(), span("master.read", path=path, master=master):
+                response = requests.get(f"{get_master_url(master)}{path}", headers=inject(), timeout=5)
+        except requests.exceptions.RequestException as e:
+            last_error = e
+            continue
+        if response.status_code >= 500:
+            last_error = f"{master} returned {response.status_code}"
+            continue
+        return response
+    raise requests.exceptions.ConnectionError(f"No master could serve {path}: {last_error}")
+
+def fetch_file_metadata(file_id):
+    """
+    Fetch a file's metadata from any master. Returns None if it does not exist.
+    """
+    response = read_from_masters(f"/files/{file_id}")
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+def fetch_worker_locations():
+    """
+    Fetch the URLs of active workers and their suspicion levels from any master.
+
+    Returns:
+        tuple: ({worker_id: url}, {worker_id: phi}) for active workers.
+    """
+    cached = worker_cache.get('active_workers')
+    if cached:
+        return cached
+    response = read_from_masters("/workers")
+    response.raise_for_status()
+    workers = [w for w in response.json().get('workers', []) if w.get('status') == 'active']
+    locations = {w['worker_id']: w['url'] for w in workers}, {w['worker_id']: w.get('phi') or 0 for w in workers}
+    worker_cache.set('active_workers', locations)
+    return locations
+
+def ring_from_membership(membership):
+    """
+    Return the placement ring and active workers of a /ring membership.
+
+    Only the membership is cached across processes; each process builds the
+    ring itself, and again only when the worker IDs, weights or vnode count
+    change.
+
+    Returns:
+        tuple: (ring over every known worker, {worker_id: url} of active workers)
+    """
+    global worker_ring
+    workers = membership['workers']
+    key = (tuple(sorted(w['worker_id'] for w in workers)), tuple(sorted((membership['weights'] or {}).items())),
+           membership['vnodes'])
+    with worker_ring_lock:
+        if worker_ring is None or worker_ring[0] != key:
+            worker_ring = (key, build_worker_ring(key[0], weights=membership['weights'], vnodes=membership['vnodes']))
+        ring = worker_ring[1]
+    return ring, {w['worker_id']: w['url'] for w in workers if w.get('status') == 'active'}
+
+def fetch_worker_ring():
+    """
+    Fetch the placement ring membership from any master, cached like leaders.
+
+    Returns:
+        tuple: (ring over every known worker, {worker_id: url} of active workers)
+    """
+    membership = leader_cache.get('ring_membership')
+    if membership is None:
+        response = read_from_masters("/ring")
+        response.raise_for_status()
+        membership = response.json()
+        leader_cache.set('ring_membership', membership)
+    return ring_from_membership(membership)
 
-    raise Exception("No leader could be discovered among master nodes.")
+def ring_candidates(chunk_id, active_workers=None):
+    """
+    Return the active workers that the placement ring prefers for a chunk,
+    in the order its replicas were placed.
+    """
+    ring, ring_active_workers = fetch_worker_ring()
+    active_workers = ring_active_workers if active_workers is None else active_workers
+    return hash_placement(ring, chunk_id, RING_READ_CANDIDATES, eligible=active_workers)
+
+def record_chunk_fetch(started, size=None):
+    """
+    Record a chunk fetch from a worker that started at `started`
+    (perf_counter); `size` is None if the fetch failed.
+    """
+    CHUNK_FETCH_SECONDS.labels('failed' if size is None else 'ok').observe(time.perf_counter() - started)
+    if size:
+        CHUNK_FETCH_BYTES.inc(size)
+
+def collect_remote_spans(trace_id):
+    """
+    Gather the spans of a trace recorded by the masters and active workers.
+    Nodes that cannot be reached are skipped.
+    """
+    node_urls = [get_master_url(master) for master in MASTER_NODES]
+    try:
+        node_urls += list(fetch_worker_locations()[0].values())
+    except requests.exceptions.RequestException as e:
+        log.warning(f"Could not list workers for trace {trace_id}: {e}")
+
+    spans = []
+    for node_url in node_urls:
+        try:
+            response = requests.get(f"{node_url}/traces/{trace_id}", params={'local': 1}, timeout=TRACE_COLLECT_TIMEOUT)
+            response.raise_for_status()
+            spans += response.json().get('spans', [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.warning(f"Could not collect spans of trace {trace_id} from {node_url}: {e}")
+    return spans
+
+def format_timestamp(value):
+    """
+    Format an ISO timestamp from the masters for display.
+    """
+    if not value:
+        return ''
+    return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
 
 def calculate_file_hash(file_data):
     """
@@ -66,10 +279,33 @@ def calculate_file_hash(file_data):
 
 
 
+def chunk_range_headers(chunk):
+    """
+    Build the Range header for a chunk entry.
+
+    Packed small files are stored at an offset within a shared container chunk,
+    so only their byte range is requested.
+    """
+    if 'offset' not in chunk:
+        return None
+    start = chunk['offset']
+    end = start + chunk['size'] - 1
+    return {'Range': f"bytes={start}-{end}"}
+
+def extract_chunk_range(chunk, chunk_response):
+    """
+    Return the bytes of a chunk entry from a worker response, slicing the range
+    out locally if the worker ignored the Range header.
+    """
+    if 'offset' in chunk and chunk_response.status_code != 206:
+        return chunk_response.content[chunk['offset']:chunk['offset'] + chunk['size']]
+    return chunk_response.content
+
 @app.route('/files', methods=['POST'])
+@admission_required
 def create_file():
     """
-    Upload file to leader master node.
+    Upload file to the leader master node of the file's metadata partition.
     """
     file = request.files.get('file')
     if not file:
@@ -77,13 +313,36 @@ def create_file():
 
     file_name = file.filename
     file_data = file.read()
+    # The file ID decides the partition, so it is chosen here to route the upload
+    file_id = str(uuid.uuid4())
+    upload_form = {}
+    if request.form.get('chunk_size_mb'):
+        upload_form['chunk_size_mb'] = request.form['chunk_size_mb']  # Optional chunk size hint
 
+    headers = relay_headers(request.headers, request.remote_addr)  # Accounted to the same client
+    if request.headers.get(OWNER_HEADER):
+        headers[OWNER_HEADER] = request.headers[OWNER_HEADER]  # Stored for, and counted against the quota of, this owner
     try:
-        leader_url = get_current_leader_url()  # Identify the leader master node
-        response = requests.post(
-            f"{leader_url}/upload_file",
-            files={'file': (file_name, file_data)}
+        response = send_to_leader(
+            'POST',
+            f"/upload_file?file_id={file_id}",  # In the query string, so a master can turn it away before reading the body
+            partition=partition_for(file_id),
+            files={'file': (file_name, file_data)},
+            data=upload_form,
+            headers=headers
         )
+        body = response.json()
+        return body, response.status_code, rejection_headers(body)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': f'Master node communication failed: {str(e)}'}), 500
+
+@app.route('/usage/<owner>', methods=['GET'])
+def get_usage(owner):
+    """
+    Return an owner's storage usage and quotas, from any master.
+    """
+    try:
+        response = read_from_masters(f"/usage/{owner}")
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({'error': f'Master node communication failed: {str(e)}'}), 500
@@ -91,11 +350,10 @@ def create_file():
 @app.route('/files/<file_id>/delete', methods=['POST'])
 def delete_file_post(file_id):
     """
-    Soft delete a file by notifying the leader master node.
+    Soft delete a file by notifying the leader master node of its partition.
     """
     try:
-        leader_url = get_current_leader_url()
-        response = requests.delete(f"{leader_url}/files/{file_id}")
+        response = send_to_leader('DELETE', f"/files/{file_id}", partition=partition_for(file_id))
         if response.status_code == 200:
             return redirect(url_for('index'))
         else:
@@ -108,8 +366,12 @@ def download_file(file_id):
     """
     Download a file by reconstructing it from its chunks.
     """
-    file_metadata = fetch_file_metadata(file_id)
-    if not file_metadata:
+    try:
+        file_metadata = fetch_file_metadata(file_id)
+        active_workers, suspicion = fetch_worker_locations()
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': f'Master node communication failed: {str(e)}'}), 500
+    if not file_metadata or file_metadata.get('status') == 'deleted':
         return jsonify({'error': 'File not found'}), 404
 
     output_dir = os.path.abspath(os.path.join('storage', 'temp'))
@@ -120,26 +382,39 @@ def download_file(file_id):
         with open(output_file_path, 'wb') as output_file:
             for chunk in file_metadata['chunks']:
                 chunk_id = chunk['chunk_id']
-                worker_ids = chunk['worker_ids']
+                # Least suspected workers first
+                worker_ids = sorted(chunk['worker_ids'], key=lambda w: suspicion.get(w, 0))
+                if PLACEMENT_MODE == "hash":
+                    # Fall back to the ring's preference list if no recorded replica answers
+                    worker_ids += [w for w in ring_candidates(chunk_id, active_workers) if w not in worker_ids]
                 chunk_retrieved = False
 
                 # Try to retrieve the chunk from the assigned workers
                 for worker_id in worker_ids:
-                    # Fetch worker URL from active workers
-                    active_workers = get_active_workers()
-                    worker_info = next((w for w in active_workers if w['worker_id'] == worker_id), None)
-                    if worker_info:
-                        worker_url = worker_info['url']
+                    worker_url = active_workers.get(worker_id)
+                    if worker_url:
+                        started = time.perf_counter()
                         try:
-                            chunk_response = requests.get(f"{worker_url}/chunks/{chunk_id}")
+                            with span("chunk.fetch", chunk_id=chunk_id, worker=worker_id):
+                                chunk_response = requests.get(f"{worker_url}/chunks/{chunk_id}",
+                                                              headers=inject(chunk_range_headers(chunk)))
                             chunk_response.raise_for_status()
-                            output_file.write(chunk_response.content)
+                            chunk_data = extract_chunk_range(chunk, chunk_response)
+                            if 'size' in chunk and len(chunk_data) != chunk['size']:
+                                raise requests.exceptions.RequestException(
+                                    f"expected {chunk['size']} bytes, got {len(chunk_data)}"
+                                )
+                            record_chunk_fetch(started, len(chunk_data))
+                            output_file.write(chunk_data)
                             chunk_retrieved = True
                             break  # Break if chunk is retrieved successfully
                         except requests.exceptions.RequestException as e:
-                            print(f"Failed to retrieve chunk {chunk_id} from worker {worker_id}: {e}")
+                            record_chunk_fetch(started)
+                            chunk_log.warning("chunk.fetch_failed", "Failed to retrieve chunk %s from worker %s: %s",
+                                              chunk_id, worker_id, e, chunk_id=chunk_id, worker_id=worker_id)
                     else:
-                        print(f"Worker {worker_id} is not active.")
+                        chunk_log.info("chunk.worker_inactive", "Worker %s is not active", worker_id,
+                                       chunk_id=chunk_id, worker_id=worker_id)
 
                 if not chunk_retrieved:
                     return jsonify({'error': f'Failed to retrieve chunk {chunk_id} from any worker'}), 500
@@ -148,22 +423,56 @@ def download_file(file_id):
     except Exception as e:
         return jsonify({'error': f'Failed to reconstruct file: {str(e)}'}), 500
 
+@app.route('/chunks/<chunk_id>', methods=['GET'])
+def read_chunk(chunk_id):
+    """
+    Read a chunk without a metadata lookup, from the workers that the
+    placement ring prefers for it (PLACEMENT_MODE=hash only). A Range header
+    is passed on to the worker.
+    """
+    if PLACEMENT_MODE != "hash":
+        return jsonify({'error': 'Chunk reads by ID require PLACEMENT_MODE=hash'}), 400
+    if not is_chunk_id(chunk_id):
+        return jsonify({'error': 'Invalid chunk ID'}), 400
+    try:
+        ring, active_workers = fetch_worker_ring()
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': f'Master node communication failed: {str(e)}'}), 500
+
+    headers = {'Range': request.headers['Range']} if 'Range' in request.headers else None
+    for worker_id in ring_candidates(chunk_id):
+        started = time.perf_counter()
+        try:
+            with span("chunk.fetch", chunk_id=chunk_id, worker=worker_id):
+                chunk_response = requests.get(f"{active_workers[worker_id]}/chunks/{chunk_id}",
+                                              headers=inject(dict(headers or {})), timeout=30)
+        except requests.exceptions.RequestException as e:
+            record_chunk_fetch(started)
+            chunk_log.warning("chunk.fetch_failed", "Failed to retrieve chunk %s from worker %s: %s", chunk_id,
+                              worker_id, e, chunk_id=chunk_id, worker_id=worker_id)
+            continue
+        if chunk_response.status_code in (200, 206):
+            record_chunk_fetch(started, len(chunk_response.content))
+            return Response(chunk_response.content, status=chunk_response.status_code,
+                            content_type='application/octet-stream')
+    return jsonify({'error': f'Chunk {chunk_id} was not found on its ring workers'}), 404
+
 @app.route('/')
 def index():
     """
     Render the index page with a list of all files.
     """
-    files_collection = db["files"]
-    files_cursor = files_collection.find()
+    response = read_from_masters("/files")
+    response.raise_for_status()
     files = []
-    for file_doc in files_cursor:
+    for file_doc in response.json().get('files', []):
         file = {
             'file_id': file_doc.get('file_id'),
             'file_name': file_doc.get('file_name'),
-            'created_at': file_doc.get('created_at').strftime("%Y-%m-%d %H:%M:%S") if file_doc.get('created_at') else '',
+            'created_at': format_timestamp(file_doc.get('created_at')),
             'chunks': file_doc.get('chunks', []),
             'status': file_doc.get('status', 'active'),  # Default to 'active' if not set
-            'deleted_at': file_doc.get('deleted_at').strftime("%Y-%m-%d %H:%M:%S") if file_doc.get('deleted_at') else ''
+            'deleted_at': format_timestamp(file_doc.get('deleted_at'))
         }
         files.append(file)
     return render_template('index.html', files=files)
@@ -182,4 +491,4 @@ def worker_heartbeat(worker_id):
     return jsonify({'message': f'Heartbeat received from {worker_id}'}), 200
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000, host='0.0.0.0')
+    app.run(debug=True, port=GATEWAY_PORT, host='0.0.0.0')
@@ -0,0 +1,114 @@
+"""
+Production launcher for the API gateway: runs --workers gateway processes
+that accept connections from one shared listening socket.
+
+The leader and worker membership caches are served by a single cache
+process (see shared/shared_cache.py), so a leader or ring lookup made by
+one gateway process is reused by all of them instead of every process
+warming its own copy. Crashed gateway processes are restarted.
+
+Usage (from the distributed_file_system directory, POSIX only):
+    python -m api_gateway.serve --workers 4
+    python -m api_gateway.serve --workers 4 --server async --port 5000
+"""
+import argparse
+import os
+import signal
+import socket
+import time
+
+from shared.logs import configure_logging
+from shared.shared_cache import start_cache_server
+
+SUPERVISE_INTERVAL = 1  # Seconds between checks for gateway processes that exited
+LISTEN_BACKLOG = 1024  # Pending connections queued on the shared socket
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(server, sock):
+    """
+    Serves requests from the shared socket until killed. The gateway module
+    is imported here, after the fork, so that its caches connect to the
+    cache server rather than being copied from the parent.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if server == 'async':
+        from aiohttp import web
+        from api_gateway import async_gateway
+        web.run_app(async_gateway.create_app(), sock=sock, print=None, handle_signals=False)
+    else:
+        from werkzeug.serving import make_server
+        from api_gateway import gateway
+        host, port = sock.getsockname()
+        make_server(host, port, gateway.app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+def spawn_worker(server, sock):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(server, sock)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--server", choices=["flask", "async"], default="flask")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("GATEWAY_PORT", 5000)))
+    args = parser.parse_args()
+
+    log = configure_logging("gateway")
+    sock = bind_socket(args.host, args.port)
+    cache_server = start_cache_server()
+    workers = {spawn_worker(args.server, sock) for _ in range(args.workers)}
+    log.info(f"{args.workers} {args.server} gateway workers on {args.host}:{args.port} (pids {sorted(workers)})")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        while not stopping:
+            time.sleep(SUPERVISE_INTERVAL)
+            for pid in list(workers):
+                exited, status = os.waitpid(pid, os.WNOHANG)
+                if not exited or stopping:
+                    continue
+                workers.discard(pid)
+                log.warning(f"Gateway worker {pid} exited with status {status}, restarting")
+                workers.add(spawn_worker(args.server, sock))
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        cache_server.shutdown()
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Sweeps chunk sizes to show the throughput / metadata trade-off.
+
+For each file size and chunk size this measures how fast the master-side
+chunking path runs (slicing plus hashing, the CPU work done per chunk), how
+many chunks and requests the file turns into, and how large its metadata
+document becomes. With --worker-url the chunks are also posted to a running
+worker, so the per-request overhead of small chunks shows up in the results.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.chunk_size_sweep
+    python -m benchmarks.chunk_size_sweep --file-sizes-mb 16 256 --worker-url http://127.0.0.1:5003
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import requests
+
+from shared.chunk_naming import make_chunk_id
+from shared.chunking import MB, choose_chunk_size, split_ranges
+
+try:
+    import bson
+except ImportError:  # pymongo not installed; fall back to JSON size
+    bson = None
+
+DEFAULT_FILE_SIZES_MB = [1, 16, 256, 1024]
+DEFAULT_CHUNK_SIZES_MB = [1, 2, 4, 8, 16, 32, 64]
+
+
+def metadata_document_size(file_id, file_size, chunks):
+    """
+    Size in bytes of the file's metadata document as MongoDB would store it.
+    """
+    document = {
+        "file_id": file_id,
+        "file_name": "benchmark.bin",
+        "size": file_size,
+        "chunks": chunks,
+        "status": "active",
+    }
+    if bson is not None:
+        return len(bson.encode(document))
+    return len(json.dumps(document).encode())
+
+
+def run_case(file_data, chunk_size, replication_factor, worker_url=None):
+    file_id = str(uuid.uuid4())
+    file_size = len(file_data)
+    chunks = []
+
+    start = time.perf_counter()
+    for i, (begin, end) in enumerate(split_ranges(file_size, chunk_size)):
+        chunk_data = file_data[begin:end]
+        hashlib.sha256(chunk_data).hexdigest()
+        chunk_id = make_chunk_id(file_id, i)
+        if worker_url:
+            requests.post(f"{worker_url}/chunks/{chunk_id}", data=chunk_data).raise_for_status()
+        chunks.append({
+            "chunk_id": chunk_id,
+            "size": len(chunk_data),
+            "worker_ids": [f"worker_{n}" for n in range(replication_factor)],
+        })
+    elapsed = time.perf_counter() - start
+
+    if worker_url:
+        requests.post(
+            f"{worker_url}/chunks/bulk_delete", json={"chunk_ids": [c["chunk_id"] for c in chunks]}
+        )
+
+    return {
+        "file_size_mb": file_size / MB,
+        "chunk_size_mb": chunk_size / MB,
+        "chunks": len(chunks),
+        "replica_requests": len(chunks) * replication_factor,
+        "metadata_bytes": metadata_document_size(file_id, file_size, chunks),
+        "seconds": round(elapsed, 4),
+        "throughput_mb_s": round(file_size / MB / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file-sizes-mb", type=int, nargs="+", default=DEFAULT_FILE_SIZES_MB)
+    parser.add_argument("--chunk-sizes-mb", type=int, nargs="+", default=DEFAULT_CHUNK_SIZES_MB)
+    parser.add_argument("--workers", type=int, default=5, help="Cluster width used by the adaptive policy")
+    parser.add_argument("--replication-factor", type=int, default=3)
+    parser.add_argument("--worker-url", help="Also post chunks to this worker")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for file_size_mb in args.file_sizes_mb:
+        file_data = os.urandom(file_size_mb * MB)
+        adaptive = choose_chunk_size(len(file_data), args.workers)
+        for chunk_size in sorted(set(c * MB for c in args.chunk_sizes_mb) | {adaptive}):
+            result = run_case(file_data, chunk_size, args.replication_factor, args.worker_url)
+            result["adaptive"] = chunk_size == adaptive
+            results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'file MB':>8} {'chunk MB':>9} {'chunks':>7} {'requests':>9} {'meta KB':>8} {'MB/s':>8}")
+    for r in results:
+        marker = "  <- adaptive" if r["adaptive"] else ""
+        print(
+            f"{r['file_size_mb']:>8.0f} {r['chunk_size_mb']:>9.0f} {r['chunks']:>7} {r['replica_requests']:>9} "
+            f"{r['metadata_bytes'] / 1024:>8.1f} {r['throughput_mb_s']:>8}{marker}"
+        )
+
+
+if __name__ == "__main__":
+    main()
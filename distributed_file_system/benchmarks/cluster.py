@@ -0,0 +1,276 @@
+"""
+A complete local cluster for benchmarks and experiments: three masters, up
+to five storage workers and the API gateway, each a separate process on
+127.0.0.1, sharing a scratch SQLite metadata store instead of MongoDB.
+
+Everything the cluster writes (config, metadata, chunk storage, logs)
+lives in one temporary directory, so runs never touch the checked-in
+config.json, the storage/ directories or a live database.
+
+    with LocalCluster(workers=5) as cluster:
+        requests.post(f"{cluster.gateway_url}/files", files=...)
+        cluster.kill_worker("worker_2")
+
+Usage (from the distributed_file_system directory), to keep one running:
+    python -m benchmarks.cluster --workers 5 --base-port 7100
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from shared.admin import ADMIN_TOKEN_HEADER
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MAX_WORKERS = 5  # One script per worker exists (storage/worker_<n>/worker<n>.py)
+MASTER_COUNT = 3  # The gateway is configured with exactly three masters
+STARTUP_TIMEOUT = 60  # Seconds for the cluster to elect leaders and register every worker
+POLL_INTERVAL = 0.2
+
+SERVER_MODULES = {
+    "flask": ("master_node.master", "api_gateway.gateway"),
+    "async": ("master_node.async_master", "api_gateway.async_gateway"),
+}
+
+
+class LocalCluster:
+    """
+    Starts and stops the processes of a local cluster.
+
+    Ports: masters at base_port .. base_port + 2, workers at base_port + 11
+    .. base_port + 15, gateway at base_port + 20. Every process runs in its
+    own process group, so Flask's reloader children are stopped with it.
+    """
+
+    def __init__(self, workers=MAX_WORKERS, base_port=7100, server="flask", env=None, keep_data=False):
+        if not 1 <= workers <= MAX_WORKERS:
+            raise ValueError(f"workers must be between 1 and {MAX_WORKERS}")
+        self.worker_ids = [f"worker_{i}" for i in range(1, workers + 1)]
+        self.base_port = base_port
+        self.master_module, self.gateway_module = SERVER_MODULES[server]
+        self.keep_data = keep_data
+        self.directory = tempfile.mkdtemp(prefix="dfs_cluster_")
+        self.config = {
+            f"master_{i}": {"ip": "127.0.0.1", "port": base_port + i - 1} for i in range(1, MASTER_COUNT + 1)
+        }
+        self.config_path = os.path.join(self.directory, "config.json")
+        self.admin_token = secrets.token_hex(16)
+        self.env = dict(
+            os.environ,
+            PYTHONPATH=PROJECT_ROOT,
+            PYTHONUNBUFFERED="1",
+            DFS_CONFIG=self.config_path,
+            METADATA_BACKEND="sqlite",
+            SQLITE_PATH=os.path.join(self.directory, "metadata.db"),
+            GATEWAY_PORT=str(self.gateway_port),
+            ADMIN_TOKEN=self.admin_token,
+            **{f"MASTER_{i}_IP": "127.0.0.1" for i in range(1, MASTER_COUNT + 1)},
+            **{f"MASTER_{i}_PORT": str(base_port + i - 1) for i in range(1, MASTER_COUNT + 1)},
+            **(env or {})
+        )
+        self.processes = {}
+
+    @property
+    def gateway_port(self):
+        return self.base_port + 20
+
+    @property
+    def gateway_url(self):
+        return f"http://127.0.0.1:{self.gateway_port}"
+
+    def master_url(self, master_id):
+        return f"http://127.0.0.1:{self.config[master_id]['port']}"
+
+    def worker_port(self, worker_id):
+        return self.base_port + 10 + int(worker_id.split('_')[1])
+
+    def worker_url(self, worker_id):
+        return f"http://127.0.0.1:{self.worker_port(worker_id)}"
+
+    def _spawn(self, name, command, env=None):
+        log_file = open(os.path.join(self.directory, f"{name}.log"), 'ab')
+        self.processes[name] = subprocess.Popen(
+            command, cwd=self.directory, env=dict(self.env, **(env or {})),
+            stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True
+        )
+        log_file.close()
+
+    def start_master(self, master_id):
+        self._spawn(master_id, [sys.executable, '-m', self.master_module, master_id])
+
+    def start_worker(self, worker_id):
+        number = worker_id.split('_')[1]
+        script = os.path.join(PROJECT_ROOT, 'storage', worker_id, f"worker{number}.py")
+        self._spawn(worker_id, [sys.executable, script], env={
+            f"WORKER_{number}_IP": "127.0.0.1",
+            f"WORKER_{number}_PORT": str(self.worker_port(worker_id)),
+        })
+
+    def start(self):
+        with open(self.config_path, 'w') as config_file:
+            json.dump(self.config, config_file)
+        for master_id in self.config:
+            self.start_master(master_id)
+        for worker_id in self.worker_ids:
+            self.start_worker(worker_id)
+        self._spawn("gateway", [sys.executable, '-m', self.gateway_module])
+        try:
+            self.wait_until_ready()
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def stop(self):
+        for name in list(self.processes):
+            self.kill(name, signal.SIGTERM)
+        if not self.keep_data:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def kill(self, name, sig=signal.SIGKILL):
+        """
+        Stops one process (a master ID, a worker ID or "gateway") with its children.
+        """
+        process = self.processes.pop(name, None)
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+    def kill_worker(self, worker_id):
+        self.kill(worker_id)
+
+    def restart_worker(self, worker_id, timeout=STARTUP_TIMEOUT):
+        self.start_worker(worker_id)
+        self.wait_for(lambda: worker_id in self.active_workers(), timeout, f"{worker_id} to rejoin")
+
+    def active_workers(self):
+        for master_id in self.config:
+            try:
+                response = requests.get(f"{self.master_url(master_id)}/workers", timeout=1)
+                return {w['worker_id'] for w in response.json().get('workers', []) if w.get('status') == 'active'}
+            except (requests.exceptions.RequestException, ValueError):
+                continue
+        return set()
+
+    def leader(self, partition=0):
+        for master_id in self.config:
+            try:
+                response = requests.get(f"{self.master_url(master_id)}/current_leader",
+                                        params={'partition': partition}, timeout=1)
+                leader = response.json().get('leader')
+                if leader:
+                    return leader
+            except (requests.exceptions.RequestException, ValueError):
+                continue
+        return None
+
+    def gateway_ready(self):
+        try:
+            return requests.get(f"{self.gateway_url}/", timeout=2).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def wait_for(self, condition, timeout, description):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return
+            time.sleep(POLL_INTERVAL)
+        raise TimeoutError(f"Timed out waiting for {description} (logs in {self.directory})")
+
+    def wait_until_ready(self, timeout=STARTUP_TIMEOUT):
+        self.wait_for(lambda: self.leader() is not None, timeout, "a leader")
+        self.wait_for(lambda: self.active_workers() >= set(self.worker_ids), timeout, "every worker to register")
+        self.wait_for(self.gateway_ready, timeout, "the gateway")
+
+    def url(self, name):
+        if name == "gateway":
+            return self.gateway_url
+        return self.master_url(name) if name in self.config else self.worker_url(name)
+
+    def set_faults(self, name, config):
+        """
+        Replaces the faults injected by a master or worker (see shared/fault_injection.py).
+        """
+        response = requests.put(f"{self.url(name)}/admin/faults", json=config,
+                                headers={ADMIN_TOKEN_HEADER: self.admin_token}, timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    def clear_faults(self, name):
+        return self.set_faults(name, {})
+
+    def resource_usage(self):
+        """
+        CPU seconds and resident memory of every cluster process, by name
+        (read from /proc, so only available on Linux).
+
+        Returns:
+            dict: {name: {'pid': int, 'cpu_seconds': float, 'rss_mb': float}}, empty if /proc is unavailable.
+        """
+        if not os.path.isdir('/proc'):
+            return {}
+        ticks = os.sysconf('SC_CLK_TCK')
+        groups = {process.pid: name for name, process in self.processes.items()}
+        usage = {name: {'cpu_seconds': 0.0, 'rss_mb': 0.0} for name in self.processes}
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            try:
+                with open(f"/proc/{pid}/stat") as stat_file:
+                    # Fields after the parenthesised command: state, ppid, pgrp, ..., utime (14), stime (15), rss (24)
+                    fields = stat_file.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            name = groups.get(int(fields[2]))
+            if name is None:
+                continue
+            usage[name]['cpu_seconds'] += (int(fields[11]) + int(fields[12])) / ticks
+            usage[name]['rss_mb'] += int(fields[21]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+        return {
+            name: dict({key: round(value, 2) for key, value in usage[name].items()}, pid=pid)
+            for pid, name in groups.items()
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--base-port", type=int, default=7100)
+    parser.add_argument("--server", choices=list(SERVER_MODULES), default="flask")
+    args = parser.parse_args()
+
+    cluster = LocalCluster(workers=args.workers, base_port=args.base_port, server=args.server, keep_data=True)
+    cluster.start()
+    print(f"Gateway at {cluster.gateway_url}; data and logs in {cluster.directory}; "
+          f"admin token {cluster.admin_token}. Ctrl+C to stop.")
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Measures chunk write throughput for each worker durability mode.
+
+--threads request threads write --chunks chunks of --chunk-kb KiB each
+through a ChunkWriter, as the worker's store_chunk does, once per mode:
+"none" (page cache only), "group" (one sync per batch of concurrent writes)
+and "fsync" (one sync per write). Every write replaces a temporary file
+atomically. For each mode it reports throughput, caller-side latency
+percentiles and the number of syncs issued.
+
+Run it on the disk the workers store chunks on: --directory defaults to a
+scratch directory under ./storage, as /tmp is often a RAM file system where
+syncs cost nothing.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.durability
+    python -m benchmarks.durability --threads 64 --chunk-kb 64 --window-ms 5
+    python -m benchmarks.durability --modes group fsync --directory /mnt/data
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from benchmarks.group_commit import run_concurrently
+from shared.chunk_naming import make_chunk_id
+from shared.chunk_writer import DURABILITY_MODES, ChunkWriter
+
+
+def run_mode(mode, args, directory):
+    writer = ChunkWriter(directory, mode=mode, window=args.window_ms / 1000, max_batch=args.max_batch)
+    data = os.urandom(args.chunk_kb * 1024)
+    file_id = "00000000-0000-4000-8000-000000000000"
+    result = run_concurrently(lambda index: writer.write(make_chunk_id(file_id, index), data),
+                              range(args.chunks), args.threads)
+    result["mb_per_sec"] = round(result["ops_per_sec"] * args.chunk_kb / 1024, 1)
+    result["syncs"] = writer.syncs
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=DURABILITY_MODES, default=list(DURABILITY_MODES))
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-kb", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--window-ms", type=float, default=0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--directory", default="storage")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    results = {}
+    for mode in args.modes:
+        directory = tempfile.mkdtemp(prefix="dfs_durability_", dir=args.directory)
+        try:
+            results[mode] = run_mode(mode, args, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
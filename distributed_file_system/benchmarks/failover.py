@@ -0,0 +1,127 @@
+"""
+Measures leader failover time on a local three-master cluster.
+
+The masters run as separate processes on 127.0.0.1 using a temporary
+config file (DFS_CONFIG). Each trial waits for a leader, kills it with
+SIGKILL, and measures the time until a surviving master holds the lease and
+reports itself as leader. The killed master is restarted before the next
+trial.
+
+By default the masters share a scratch SQLite metadata store, so no
+external service is needed. With --backend mongo they use MONGO_URI and a
+scratch database name, so the production leader lease is not touched.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.failover --trials 5
+    python -m benchmarks.failover --backend mongo
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+POLL_INTERVAL = 0.02
+
+
+def write_config(base_port, count):
+    config = {f"master_{i + 1}": {"ip": "127.0.0.1", "port": base_port + i} for i in range(count)}
+    config_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    json.dump(config, config_file)
+    config_file.close()
+    return config, config_file.name
+
+
+def start_master(node_id, config_path, env, log_dir):
+    log_file = open(os.path.join(log_dir, f"{node_id}.log"), 'ab')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'master_node.master', node_id],
+        cwd=PROJECT_ROOT,
+        env=dict(env, DFS_CONFIG=config_path),
+        stdout=log_file,
+        stderr=subprocess.STDOUT
+    )
+
+
+def reported_leader(node_info):
+    try:
+        response = requests.get(f"http://{node_info['ip']}:{node_info['port']}/current_leader", timeout=0.5)
+        return response.json().get('leader')
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def wait_for_leader(config, candidates, exclude=None, timeout=60):
+    """
+    Wait until one of `candidates` reports itself as leader.
+
+    Returns:
+        str: ID of the new leader.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for node_id in candidates:
+            if node_id != exclude and reported_leader(config[node_id]) == node_id:
+                return node_id
+        time.sleep(POLL_INTERVAL)
+    raise TimeoutError("No leader was elected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--masters", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=5900)
+    parser.add_argument("--backend", choices=["sqlite", "mongo"], default="sqlite")
+    parser.add_argument("--db-name", default="dfs_failover_benchmark")
+    args = parser.parse_args()
+
+    config, config_path = write_config(args.base_port, args.masters)
+    log_dir = tempfile.mkdtemp(prefix='dfs_failover_')
+    env = dict(os.environ, METADATA_BACKEND=args.backend, DB_NAME=args.db_name,
+               SQLITE_PATH=os.path.join(log_dir, 'metadata.db'))
+    processes = {node_id: start_master(node_id, config_path, env, log_dir) for node_id in config}
+
+    results = []
+    try:
+        leader = wait_for_leader(config, list(config))
+        for trial in range(args.trials):
+            processes[leader].send_signal(signal.SIGKILL)
+            processes[leader].wait()
+            killed_at = time.monotonic()
+
+            survivors = [node_id for node_id in config if node_id != leader]
+            new_leader = wait_for_leader(config, survivors, exclude=leader)
+            failover_seconds = time.monotonic() - killed_at
+            results.append({'trial': trial + 1, 'killed': leader, 'new_leader': new_leader,
+                            'failover_seconds': round(failover_seconds, 3)})
+            print(f"Trial {trial + 1}: {leader} -> {new_leader} in {failover_seconds:.3f}s", file=sys.stderr)
+
+            processes[leader] = start_master(leader, config_path, env, log_dir)
+            # Let the restarted master come up before the next kill
+            time.sleep(2)
+            leader = wait_for_leader(config, list(config))
+    finally:
+        for process in processes.values():
+            process.kill()
+        os.unlink(config_path)
+
+    durations = [r['failover_seconds'] for r in results]
+    print(json.dumps({
+        'trials': results,
+        'mean_seconds': round(statistics.mean(durations), 3) if durations else None,
+        'median_seconds': round(statistics.median(durations), 3) if durations else None,
+        'max_seconds': max(durations) if durations else None,
+        'logs': log_dir,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Load test for a running gateway: concurrent uploads, then downloads.
+
+For each --concurrency level, --requests uploads of --size-kb random bytes
+are sent with that many in flight, then every uploaded file is downloaded
+(and checked) the same way. Reports requests/s, latency percentiles and
+errors per phase. The uploaded files are deleted afterwards.
+
+Compare the servers by running the same load against each, e.g. a local
+cluster started with the Flask servers (master_node.master,
+api_gateway.gateway) and then with the asyncio ones
+(master_node.async_master, api_gateway.async_gateway).
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.gateway_load --url http://127.0.0.1:5000
+    python -m benchmarks.gateway_load --concurrency 1 16 64 256 --requests 512 --size-kb 256
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+
+import aiohttp
+
+
+def percentile_ms(sorted_latencies, fraction):
+    """
+    Returns a percentile (nearest rank) of sorted latencies in seconds, in milliseconds.
+    """
+    if not sorted_latencies:
+        return None
+    index = max(0, math.ceil(len(sorted_latencies) * fraction) - 1)
+    return round(sorted_latencies[index] * 1e3, 1)
+
+
+async def run_phase(operation, items, concurrency):
+    """
+    Runs `operation` on every item with at most `concurrency` in flight.
+
+    Returns:
+        tuple: (stats dict, list of results, None for failed items)
+    """
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def timed(item):
+        nonlocal errors
+        async with limit:
+            start = time.perf_counter()
+            try:
+                result = await operation(item)
+            except Exception as e:
+                errors += 1
+                print(f"Request failed: {e!r}")
+                return None
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed(item) for item in items))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(items),
+        'errors': errors,
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile_ms(latencies, 0.5),
+        'p90_ms': percentile_ms(latencies, 0.9),
+        'p99_ms': percentile_ms(latencies, 0.99),
+    }, results
+
+
+async def run_level(session, url, concurrency, requests_count, payload):
+    async def upload(index):
+        form = aiohttp.FormData()
+        form.add_field('file', payload, filename=f"load_{index}.bin")
+        async with session.post(f"{url}/files", data=form) as response:
+            body = await response.json(content_type=None)
+            if response.status != 200:
+                raise Exception(f"upload returned {response.status}: {body}")
+            return body['file_id']
+
+    async def download(file_id):
+        async with session.get(f"{url}/files/{file_id}/download") as response:
+            data = await response.read()
+            if response.status != 200 or data != payload:
+                raise Exception(f"download of {file_id} returned {response.status} ({len(data)} bytes)")
+
+    async def delete(file_id):
+        async with session.post(f"{url}/files/{file_id}/delete", allow_redirects=False) as response:
+            await response.read()
+
+    upload_stats, file_ids = await run_phase(upload, range(requests_count), concurrency)
+    file_ids = [file_id for file_id in file_ids if file_id]
+    download_stats, _ = await run_phase(download, file_ids, concurrency)
+    await run_phase(delete, file_ids, concurrency)
+    return {'concurrency': concurrency, 'upload': upload_stats, 'download': download_stats}
+
+
+async def main_async(args):
+    payload = os.urandom(args.size_kb * 1024)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        results = []
+        for concurrency in args.concurrency:
+            result = await run_level(session, args.url, concurrency, args.requests, payload)
+            print(f"concurrency {concurrency}: upload {result['upload']['requests_per_sec']}/s, "
+                  f"download {result['download']['requests_per_sec']}/s")
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--size-kb", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print(json.dumps({'url': args.url, 'size_kb': args.size_kb, 'levels': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Throughput of the multi-process gateway (api_gateway.serve) by number of
+gateway processes.
+
+For each --workers count, starts `python -m api_gateway.serve` on --port,
+runs one level of the gateway_load benchmark against it and stops it.
+Masters and storage workers must already be running; the gateway processes
+inherit this process's environment (MASTER_n_IP / MASTER_n_PORT etc.).
+
+Throughput can only grow with the process count while there are idle cores
+for them, so compare counts up to the number of cores of the machine.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.gateway_scaling --workers 1 2 4 8
+    python -m benchmarks.gateway_scaling --server async --concurrency 128 --requests 1024
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import aiohttp
+import requests
+
+from benchmarks.gateway_load import run_level
+
+STARTUP_TIMEOUT = 30  # Seconds to wait for the gateway to answer after starting it
+
+
+def start_gateway(workers, server, port):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "api_gateway.serve", "--workers", str(workers), "--server", server,
+         "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=2)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    stop_gateway(process)
+    raise RuntimeError(f"Gateway with {workers} workers did not start on port {port}")
+
+
+def stop_gateway(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def measure(url, args, payload):
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        return await run_level(session, url, args.concurrency, args.requests, payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--server", choices=["flask", "async"], default="flask")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--size-kb", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_kb * 1024)
+    url = f"http://127.0.0.1:{args.port}"
+    results = []
+    for workers in args.workers:
+        process = start_gateway(workers, args.server, args.port)
+        try:
+            result = asyncio.run(measure(url, args, payload))
+        finally:
+            stop_gateway(process)
+        result['workers'] = workers
+        print(f"{workers} gateway processes: upload {result['upload']['requests_per_sec']}/s, "
+              f"download {result['download']['requests_per_sec']}/s")
+        results.append(result)
+
+    print(json.dumps({
+        'server': args.server, 'cpu_count': os.cpu_count(), 'size_kb': args.size_kb, 'levels': results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares per-operation commits with group commit for concurrent uploads.
+
+--threads request threads insert --files file documents into a scratch
+store, then tombstone them, either with one store call per file (as with
+METADATA_GROUP_COMMIT=false) or through a GroupCommitWriter (the default).
+Every call returns only once its write is committed, as on the master.
+For each mode it reports throughput and the latency percentiles seen by
+the callers.
+
+The gain is largest when every commit is expensive: with
+--synchronous FULL, SQLite fsyncs each commit, and the mongo backend
+(MONGO_URI) pays a network round trip per commit.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.group_commit
+    python -m benchmarks.group_commit --synchronous FULL --threads 32 --window-ms 1
+    python -m benchmarks.group_commit --backend mongo
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.metadata_ops import file_document
+from database.group_commit import GroupCommitWriter
+from database.sqlite_store import SQLiteMetadataStore
+
+
+def open_store(backend, synchronous, db_name):
+    if backend == "mongo":
+        from database import connection
+        connection.DB_NAME = db_name  # Keep the benchmark documents out of the production database
+        return connection.create_metadata_store("mongo")
+    path = os.path.join(tempfile.mkdtemp(prefix="dfs_group_commit_"), "metadata.db")
+    return SQLiteMetadataStore(path, synchronous=synchronous)
+
+
+def run_concurrently(operation, inputs, threads):
+    """
+    Runs `operation` on every input from a pool of threads.
+
+    Returns:
+        dict: Throughput and caller-side latency percentiles.
+    """
+    def timed(item):
+        start = time.perf_counter()
+        operation(item)
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(executor.map(timed, inputs))
+    elapsed = time.perf_counter() - started
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1e3, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1e3, 2),
+    }
+
+
+def run_mode(store, mode, args):
+    documents = [file_document(args.chunks_per_file, 3) for _ in range(args.files)]
+    file_ids = [doc["file_id"] for doc in documents]
+    if mode == "group":
+        writer = GroupCommitWriter(store, window=args.window_ms / 1000, max_batch=args.max_batch)
+        insert, tombstone = writer.insert_file, writer.tombstone_file
+    else:
+        insert, tombstone = store.store_file_metadata, store.tombstone_file
+    return {
+        "insert": run_concurrently(insert, documents, args.threads),
+        "tombstone": run_concurrently(tombstone, file_ids, args.threads),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "mongo"], default="sqlite")
+    parser.add_argument("--synchronous", choices=["NORMAL", "FULL"], default="NORMAL")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--chunks-per-file", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--window-ms", type=float, default=0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--db-name", default="dfs_group_commit_benchmark")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("single", "group"):
+        store = open_store(args.backend, args.synchronous, args.db_name)
+        results[mode] = run_mode(store, mode, args)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Measures the cost of the metadata operations on each backend.
+
+Runs the operations the master performs per upload, read, heartbeat flush
+and delete directly against a metadata store, and reports the latency
+percentiles and throughput of each. The embedded backends use a scratch
+database; the mongo backend (MONGO_URI) writes to the --db-name database.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.metadata_ops
+    python -m benchmarks.metadata_ops --backends sqlite memory mongo --files 5000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from database.sqlite_store import SQLiteMetadataStore
+from shared.chunk_naming import make_chunk_id
+
+DEFAULT_BACKENDS = ["memory", "sqlite"]
+
+
+def open_store(backend, db_name):
+    if backend == "memory":
+        return SQLiteMetadataStore(":memory:")
+    if backend == "sqlite":
+        return SQLiteMetadataStore(os.path.join(tempfile.mkdtemp(prefix="dfs_metadata_"), "metadata.db"))
+    if backend == "mongo":
+        from database import connection
+        connection.DB_NAME = db_name  # Keep the benchmark documents out of the production database
+        return connection.create_metadata_store("mongo")
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def file_document(chunks_per_file, replication_factor):
+    file_id = str(uuid.uuid4())
+    return {
+        "file_id": file_id,
+        "file_name": "benchmark.bin",
+        "size": chunks_per_file,
+        "chunks": [
+            {
+                "chunk_id": make_chunk_id(file_id, i),
+                "size": 1,
+                "worker_ids": [f"worker_{n + 1}" for n in range(replication_factor)],
+                "pending_worker_ids": [],
+            }
+            for i in range(chunks_per_file)
+        ],
+        "chunk_size": 1,
+        "packed": False,
+        "status": "active",
+        "created_at": datetime.utcnow(),
+    }
+
+
+def timed(operation, inputs):
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        operation(item)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / total) if total else None,
+        "p50_us": round(statistics.median(latencies) * 1e6, 1),
+        "p99_us": round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+    }
+
+
+def run_backend(store, files, chunks_per_file, workers):
+    documents = [file_document(chunks_per_file, 3) for _ in range(files)]
+    file_ids = [doc["file_id"] for doc in documents]
+    heartbeat_batches = [
+        [
+            {"worker_id": f"worker_{n + 1}", "url": f"http://127.0.0.1:{6000 + n}",
+             "status": "active", "last_heartbeat": time.time()}
+            for n in range(workers)
+        ]
+        for _ in range(max(1, files // 10))
+    ]
+
+    return {
+        "store_file_metadata": timed(store.store_file_metadata, documents),
+        "fetch_file_metadata": timed(store.fetch_file_metadata, file_ids),
+        "bulk_update_workers": timed(store.bulk_update_workers, heartbeat_batches),
+        "get_active_workers": timed(lambda _: store.get_active_workers(), range(len(heartbeat_batches))),
+        "tombstone_file": timed(store.tombstone_file, file_ids),
+        "mark_files_collected": timed(lambda file_id: store.mark_files_collected([file_id]), file_ids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=DEFAULT_BACKENDS, choices=["memory", "sqlite", "mongo"])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--chunks-per-file", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument("--db-name", default="dfs_metadata_benchmark")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        store = open_store(backend, args.db_name)
+        results[backend] = run_backend(store, args.files, args.chunks_per_file, args.workers)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'backend':>8} {'operation':>22} {'ops/s':>9} {'p50 us':>9} {'p99 us':>9}")
+    for backend, operations in results.items():
+        for name, r in operations.items():
+            print(f"{backend:>8} {name:>22} {r['ops_per_sec']:>9} {r['p50_us']:>9} {r['p99_us']:>9}")
+
+
+if __name__ == "__main__":
+    main()
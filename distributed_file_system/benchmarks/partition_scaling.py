@@ -0,0 +1,177 @@
+"""
+Measures leader-only metadata throughput as the number of metadata
+partitions grows.
+
+For each partition count, three masters are started on 127.0.0.1 (as in
+benchmarks.failover) with METADATA_PARTITIONS set and a scratch SQLite
+metadata store seeded with --files empty file documents. Once every
+partition has a leader, client processes delete all the files, each
+request sent straight to the leader of the file's partition, and the
+deletes per second are reported. With one partition every delete lands on
+the same master; with several, the work spreads over the partition leaders.
+
+The embedded SQLite store admits one writer at a time across all masters,
+so it caps the gain; with --backend mongo (MONGO_URI) each run uses a
+scratch database that is dropped afterwards.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.partition_scaling
+    python -m benchmarks.partition_scaling --partitions 1 3 6 --files 6000 --clients 12
+    python -m benchmarks.partition_scaling --backend mongo
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+from benchmarks.failover import start_master, write_config
+from database.sqlite_store import SQLiteMetadataStore
+from shared.partitioning import partition_for
+
+POLL_INTERVAL = 0.1
+
+
+def open_store(backend, db_path, db_name):
+    if backend == "mongo":
+        from database import connection
+        connection.DB_NAME = db_name
+        return connection.create_metadata_store("mongo")
+    return SQLiteMetadataStore(db_path)
+
+
+def seed_files(store, count, partition_count):
+    """
+    Store `count` chunkless file documents tagged with their partition.
+
+    Returns:
+        list: The file IDs.
+    """
+    file_ids = [str(uuid.uuid4()) for _ in range(count)]
+    for file_id in file_ids:
+        store.store_file_metadata({
+            "file_id": file_id,
+            "partition": partition_for(file_id, partition_count),
+            "file_name": "benchmark.bin",
+            "size": 0,
+            "chunks": [],
+            "packed": False,
+            "status": "active",
+            "created_at": datetime.utcnow(),
+        })
+    return file_ids
+
+
+def wait_for_partition_leaders(config, partition_count, timeout=60):
+    """
+    Wait until every partition has a leader.
+
+    Returns:
+        dict: Leader URL of each partition.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for node_info in config.values():
+            try:
+                response = requests.get(f"http://{node_info['ip']}:{node_info['port']}/partitions", timeout=0.5)
+                partitions = response.json()['partitions']
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                continue
+            leaders = {p['partition']: p['leader'] for p in partitions if p['leader']}
+            if len(leaders) == partition_count:
+                return {
+                    partition: f"http://{config[leader]['ip']}:{config[leader]['port']}"
+                    for partition, leader in leaders.items()
+                }
+        time.sleep(POLL_INTERVAL)
+    raise TimeoutError("Not every partition elected a leader")
+
+
+def delete_files(requests_batch):
+    """
+    Client process: delete each (leader_url, file_id) pair.
+
+    Returns:
+        int: Number of failed deletes.
+    """
+    failures = 0
+    with requests.Session() as session:
+        for leader_url, file_id in requests_batch:
+            try:
+                response = session.delete(f"{leader_url}/files/{file_id}", timeout=10)
+                failures += response.status_code != 200
+            except requests.exceptions.RequestException:
+                failures += 1
+    return failures
+
+
+def run(partition_count, args, config, config_path):
+    log_dir = tempfile.mkdtemp(prefix=f'dfs_partitions_{partition_count}_')
+    db_path = os.path.join(log_dir, 'metadata.db')
+    db_name = f"{args.db_name}_{partition_count}"
+    store = open_store(args.backend, db_path, db_name)
+    file_ids = seed_files(store, args.files, partition_count)
+    env = dict(os.environ, METADATA_BACKEND=args.backend, SQLITE_PATH=db_path, DB_NAME=db_name,
+               METADATA_PARTITIONS=str(partition_count))
+    processes = [start_master(node_id, config_path, env, log_dir) for node_id in config]
+    try:
+        leader_urls = wait_for_partition_leaders(config, partition_count)
+        # Let the startup elections and preferred-leader handoffs settle
+        time.sleep(args.settle)
+        leader_urls = wait_for_partition_leaders(config, partition_count)
+
+        work = [(leader_urls[partition_for(file_id, partition_count)], file_id) for file_id in file_ids]
+        batches = [work[i::args.clients] for i in range(args.clients)]
+        with multiprocessing.Pool(args.clients) as pool:
+            started = time.perf_counter()
+            failures = sum(pool.map(delete_files, batches))
+            elapsed = time.perf_counter() - started
+    finally:
+        for process in processes:
+            process.kill()
+        if args.backend == "mongo":
+            store.db.client.drop_database(db_name)
+
+    result = {
+        'partitions': partition_count,
+        'leaders': len(set(leader_urls.values())),
+        'deletes': len(file_ids),
+        'failed': failures,
+        'seconds': round(elapsed, 3),
+        'ops_per_second': round((len(file_ids) - failures) / elapsed, 1),
+        'logs': log_dir,
+    }
+    print(f"{partition_count} partition(s) on {result['leaders']} leader(s): "
+          f"{result['ops_per_second']} deletes/s", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--partitions", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--masters", type=int, default=3)
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--clients", type=int, default=6)
+    parser.add_argument("--settle", type=float, default=12.0,
+                        help="Seconds to wait after the first leaders are elected")
+    parser.add_argument("--base-port", type=int, default=5900)
+    parser.add_argument("--backend", choices=["sqlite", "mongo"], default="sqlite")
+    parser.add_argument("--db-name", default="dfs_partition_benchmark")
+    args = parser.parse_args()
+
+    config, config_path = write_config(args.base_port, args.masters)
+    try:
+        results = [run(partition_count, args, config, config_path) for partition_count in args.partitions]
+    finally:
+        os.unlink(config_path)
+    print(json.dumps({'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Simulates how many chunk replicas move when workers join or leave.
+
+Places --chunks chunk IDs (replication factor --replicas) on --workers
+workers with two deterministic schemes, then recomputes the placements
+after one worker joins and after one worker leaves:
+
+  ring     consistent hash ring with --vnodes virtual nodes per worker
+           (PLACEMENT_MODE=hash)
+  modulo   replicas at hash(chunk) mod N and the following workers, the
+           naive way to compute a placement from the chunk ID
+
+For each scheme it reports the fraction of replicas that would have to be
+copied to a new worker, and the load imbalance (the most loaded worker's
+replica count over the mean). Random placement is not simulated: nothing
+moves on membership changes because every location is stored in metadata,
+at the cost of a metadata lookup for every read. With --weights, the
+load of each worker on the ring is compared against its share of the
+total weight (a worker holds at most one replica of each chunk, which caps
+its share at 1/--replicas).
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.placement_simulator
+    python -m benchmarks.placement_simulator --workers 10 --vnodes 16 64 256
+    python -m benchmarks.placement_simulator --weights worker_1=2 worker_2=0.5
+"""
+import argparse
+import json
+from collections import Counter
+
+from shared.chunk_naming import make_chunk_id
+from shared.hash_ring import hash_key
+from shared.placement import build_worker_ring, hash_placement, parse_weights
+
+SIMULATED_FILE_ID = "00000000-0000-4000-8000-000000000000"
+
+
+def ring_placements(worker_ids, chunk_ids, replicas, vnodes, weights):
+    ring = build_worker_ring(worker_ids, weights=weights, vnodes=vnodes)
+    return {chunk_id: hash_placement(ring, chunk_id, replicas) for chunk_id in chunk_ids}
+
+
+def modulo_placements(worker_ids, chunk_ids, replicas):
+    ordered = sorted(worker_ids)
+    placements = {}
+    for chunk_id in chunk_ids:
+        start = hash_key(chunk_id) % len(ordered)
+        placements[chunk_id] = [ordered[(start + i) % len(ordered)] for i in range(replicas)]
+    return placements
+
+
+def moved_fraction(before, after):
+    """
+    Fraction of replicas placed on a worker that did not hold them before.
+    """
+    total = sum(len(workers) for workers in after.values())
+    moved = sum(len(set(after[chunk_id]) - set(before[chunk_id])) for chunk_id in after)
+    return moved / total
+
+
+def load(placements):
+    return Counter(worker_id for workers in placements.values() for worker_id in workers)
+
+
+def imbalance(placements):
+    counts = load(placements)
+    return max(counts.values()) / (sum(counts.values()) / len(counts))
+
+
+def simulate(place, worker_ids, joined, left):
+    before = place(worker_ids)
+    after_join = place(worker_ids + [joined])
+    after_leave = place([worker_id for worker_id in worker_ids if worker_id != left])
+    return {
+        'moved_on_join': round(moved_fraction(before, after_join), 4),
+        'moved_on_leave': round(moved_fraction(before, after_leave), 4),
+        'imbalance': round(imbalance(before), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--vnodes", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--weights", nargs="*", default=[], help="worker_id=weight pairs")
+    args = parser.parse_args()
+
+    worker_ids = [f"worker_{i + 1}" for i in range(args.workers)]
+    joined = f"worker_{args.workers + 1}"
+    left = worker_ids[-1]
+    chunk_ids = [make_chunk_id(SIMULATED_FILE_ID, i) for i in range(args.chunks)]
+    weights = parse_weights(",".join(args.weights))
+
+    results = {
+        'workers': args.workers,
+        'chunks': args.chunks,
+        'replicas': args.replicas,
+        'ideal_moved_on_join': round(1 / (args.workers + 1), 4),
+        'ideal_moved_on_leave': round(1 / args.workers, 4),
+        'schemes': {},
+    }
+    for vnodes in args.vnodes:
+        results['schemes'][f"ring_{vnodes}_vnodes"] = simulate(
+            lambda members: ring_placements(members, chunk_ids, args.replicas, vnodes, weights),
+            worker_ids, joined, left
+        )
+    results['schemes']['modulo'] = simulate(
+        lambda members: modulo_placements(members, chunk_ids, args.replicas), worker_ids, joined, left
+    )
+
+    if weights:
+        vnodes = max(args.vnodes)
+        counts = load(ring_placements(worker_ids, chunk_ids, args.replicas, vnodes, weights))
+        total_weight = sum(weights.get(worker_id, 1) for worker_id in worker_ids)
+        total_replicas = sum(counts.values())
+        results['weighted_load'] = {
+            worker_id: {
+                'weight_share': round(weights.get(worker_id, 1) / total_weight, 4),
+                'replica_share': round(counts[worker_id] / total_replicas, 4),
+            }
+            for worker_id in worker_ids
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+Performance suite: boots a local cluster (three masters, the workers and
+the gateway on 127.0.0.1, with SQLite in a scratch directory standing in
+for MongoDB; see cluster.py) and runs repeatable scenarios against it:
+
+  large_sequential  upload, then download, one large file (--large-mb) at a time
+  small_files       many small files (--small-count of --small-kb) with --concurrency in flight
+  mixed             concurrent reads and writes (--read-fraction reads) over preloaded files
+  worker_failure    uploads and downloads while a worker is SIGKILLed halfway through
+  slow_worker       downloads before and while one worker answers chunk reads --slow-ms late
+  background_load   downloads on idle workers, then while background chunk traffic saturates them
+
+Each scenario reports throughput, latency percentiles (p50/p90/p99), errors
+and the CPU time and memory used by the cluster processes. The results are
+written as JSON (--output); pass an earlier result as --baseline to print
+the change of every throughput and latency figure and flag the ones that
+got worse by more than --tolerance percent (the exit status is then 1).
+
+Payloads come from a seeded generator (--seed), so runs are repeatable.
+
+Usage (from the distributed_file_system directory):
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --scenarios small_files mixed --server async --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+import uuid
+
+import aiohttp
+
+from benchmarks.cluster import MAX_WORKERS, SERVER_MODULES, LocalCluster
+from benchmarks.gateway_load import percentile_ms, run_level, run_phase
+from shared.chunk_naming import make_chunk_id
+from shared.io_scheduler import IO_PRIORITY_HEADER
+
+SCENARIOS = ("large_sequential", "small_files", "mixed", "worker_failure", "slow_worker", "background_load")
+
+
+class Client:
+    """
+    Gateway calls used by the scenarios. Failed calls raise, so run_phase
+    counts them as errors.
+    """
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+
+    async def upload(self, payload, name):
+        form = aiohttp.FormData()
+        form.add_field('file', payload, filename=name)
+        async with self.session.post(f"{self.url}/files", data=form) as response:
+            body = await response.json(content_type=None)
+            if response.status != 200:
+                raise Exception(f"upload returned {response.status}: {body}")
+            return body['file_id']
+
+    async def download(self, file_id, expected):
+        async with self.session.get(f"{self.url}/files/{file_id}/download") as response:
+            data = await response.read()
+            if response.status != 200 or data != expected:
+                raise Exception(f"download of {file_id} returned {response.status} ({len(data)} bytes)")
+            return len(data)
+
+    async def delete(self, file_id):
+        async with self.session.post(f"{self.url}/files/{file_id}/delete", allow_redirects=False) as response:
+            await response.read()
+
+
+def summarize(latencies, errors, elapsed, transferred_bytes=0):
+    latencies = sorted(latencies)
+    stats = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'requests_per_sec': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': percentile_ms(latencies, 0.5),
+        'p90_ms': percentile_ms(latencies, 0.9),
+        'p99_ms': percentile_ms(latencies, 0.99),
+    }
+    if transferred_bytes:
+        stats['mb_per_sec'] = round(transferred_bytes / 2 ** 20 / elapsed, 2)
+    return stats
+
+
+async def large_sequential(client, args, rng):
+    """
+    Uploads and downloads --large-mb files one after another (--large-count
+    of them), so the figures are the throughput of a single stream.
+    """
+    payloads = [rng.randbytes(args.large_mb * 2 ** 20) for _ in range(args.large_count)]
+    phases = {}
+    file_ids = []
+    for phase in ("upload", "download"):
+        latencies, errors, transferred = [], 0, 0
+        started = time.perf_counter()
+        for index, payload in enumerate(payloads):
+            request_started = time.perf_counter()
+            try:
+                if phase == "upload":
+                    file_ids.append(await client.upload(payload, f"large_{index}.bin"))
+                else:
+                    if index >= len(file_ids) or file_ids[index] is None:
+                        continue
+                    await client.download(file_ids[index], payload)
+            except Exception as e:
+                print(f"large_sequential {phase} failed: {e!r}")
+                errors += 1
+                if phase == "upload":
+                    file_ids.append(None)
+                continue
+            latencies.append(time.perf_counter() - request_started)
+            transferred += len(payload)
+        phases[phase] = summarize(latencies, errors, time.perf_counter() - started, transferred)
+    for file_id in filter(None, file_ids):
+        await client.delete(file_id)
+    return phases
+
+
+async def small_files(client, args, rng):
+    """
+    Uploads, downloads and deletes --small-count files of --small-kb with
+    --concurrency requests in flight.
+    """
+    result = await run_level(client.session, client.url, args.concurrency, args.small_count,
+                             rng.randbytes(args.small_kb * 1024))
+    return {'upload': result['upload'], 'download': result['download']}
+
+
+async def mixed(client, args, rng):
+    """
+    Preloads --mixed-files files of --small-kb, then runs --mixed-ops
+    operations with --concurrency in flight: a download of a random
+    preloaded file with probability --read-fraction, an upload otherwise.
+    """
+    payload = rng.randbytes(args.small_kb * 1024)
+    _, preloaded = await run_phase(lambda index: client.upload(payload, f"mixed_seed_{index}.bin"),
+                                   range(args.mixed_files), args.concurrency)
+    preloaded = [file_id for file_id in preloaded if file_id]
+    if not preloaded:
+        raise Exception("Could not preload any file for the mixed scenario")
+
+    operations = [("read", rng.choice(preloaded)) if rng.random() < args.read_fraction else ("write", index)
+                  for index in range(args.mixed_ops)]
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    written = []
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def run(operation):
+        kind, target = operation
+        async with limit:
+            started = time.perf_counter()
+            try:
+                if kind == "read":
+                    await client.download(target, payload)
+                else:
+                    written.append(await client.upload(payload, f"mixed_{target}.bin"))
+            except Exception as e:
+                print(f"mixed {kind} failed: {e!r}")
+                errors[kind] += 1
+                return
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(operation) for operation in operations))
+    elapsed = time.perf_counter() - started
+    await run_phase(client.delete, preloaded + written, args.concurrency)
+    result = summarize(latencies["read"] + latencies["write"], sum(errors.values()), elapsed,
+                       len(operations) * len(payload))
+    for kind in ("read", "write"):
+        result[kind] = summarize(latencies[kind], errors[kind], elapsed)
+    return result
+
+
+async def worker_failure(client, args, rng, cluster):
+    """
+    Runs --concurrency loops that each upload a --failure-mb file and
+    download it back, for --failure-seconds. Halfway through, a worker is
+    killed with SIGKILL (in the middle of transfers), and restarted at the
+    end. Operations are reported separately before and after the kill.
+    """
+    payload = rng.randbytes(args.failure_mb * 2 ** 20)
+    victim = cluster.worker_ids[-1]
+    results = {"before": ([], 0), "after": ([], 0)}
+    killed_at = None
+    file_ids = []
+    deadline = time.perf_counter() + args.failure_seconds
+
+    def record(latency=None):
+        phase = "after" if killed_at is not None else "before"
+        latencies, errors = results[phase]
+        if latency is None:
+            results[phase] = (latencies, errors + 1)
+        else:
+            latencies.append(latency)
+
+    async def loop(loop_index):
+        iteration = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                file_id = await client.upload(payload, f"failure_{loop_index}_{iteration}.bin")
+                file_ids.append(file_id)
+                await client.download(file_id, payload)
+            except Exception as e:
+                print(f"worker_failure operation failed: {e!r}")
+                record()
+            else:
+                record(time.perf_counter() - started)
+            iteration += 1
+
+    async def kill_halfway():
+        nonlocal killed_at
+        await asyncio.sleep(args.failure_seconds / 2)
+        await asyncio.to_thread(cluster.kill_worker, victim)
+        killed_at = time.perf_counter()
+        print(f"Killed {victim}")
+
+    started = time.perf_counter()
+    await asyncio.gather(kill_halfway(), *(loop(index) for index in range(args.concurrency)))
+    ended = time.perf_counter()
+    await run_phase(client.delete, file_ids, args.concurrency)
+    await asyncio.to_thread(cluster.restart_worker, victim)
+
+    result = {'killed_worker': victim}
+    for phase, elapsed in (("before", killed_at - started), ("after", ended - killed_at)):
+        latencies, errors = results[phase]
+        # Every successful operation moves the file twice (upload and download)
+        result[phase] = summarize(latencies, errors, elapsed, len(latencies) * len(payload) * 2)
+    return result
+
+
+async def slow_worker(client, args, rng, cluster):
+    """
+    Downloads --mixed-files files of --small-kb twice with --concurrency in
+    flight: once normally, then while one worker delays every chunk read by
+    --slow-ms (injected with shared/fault_injection.py). The difference shows
+    how well reads avoid a slow replica.
+    """
+    payload = rng.randbytes(args.small_kb * 1024)
+    _, file_ids = await run_phase(lambda index: client.upload(payload, f"slow_{index}.bin"),
+                                  range(args.mixed_files), args.concurrency)
+    file_ids = [file_id for file_id in file_ids if file_id]
+    victim = cluster.worker_ids[-1]
+    result = {'slow_worker': victim}
+    result['healthy'], _ = await run_phase(lambda file_id: client.download(file_id, payload), file_ids, args.concurrency)
+    fault = {'rules': [{'route': '/chunks', 'methods': ['GET'], 'latency_ms': args.slow_ms}], 'seed': args.seed}
+    await asyncio.to_thread(cluster.set_faults, victim, fault)
+    try:
+        result['slow'], _ = await run_phase(lambda file_id: client.download(file_id, payload), file_ids,
+                                            args.concurrency)
+    finally:
+        await asyncio.to_thread(cluster.clear_faults, victim)
+    await run_phase(client.delete, file_ids, args.concurrency)
+    return result
+
+
+async def background_load(client, args, rng, cluster):
+    """
+    Downloads --mixed-files files of --small-kb with --concurrency in flight
+    twice: on idle workers, then while --background-streams loops per worker
+    write and read back --background-mb chunks as fast as they can, sent
+    with the I/O priority --background-priority (background, like the
+    master's repairs and compaction, or foreground for comparison). The
+    worker I/O scheduler should keep the client latency of the second run
+    close to the first.
+    """
+    payload = rng.randbytes(args.small_kb * 1024)
+    _, file_ids = await run_phase(lambda index: client.upload(payload, f"background_{index}.bin"),
+                                  range(args.mixed_files), args.concurrency)
+    file_ids = [file_id for file_id in file_ids if file_id]
+    result = {'background_priority': args.background_priority}
+    result['idle'], _ = await run_phase(lambda file_id: client.download(file_id, payload), file_ids, args.concurrency)
+
+    chunk = rng.randbytes(args.background_mb * 2 ** 20)
+    headers = {IO_PRIORITY_HEADER: args.background_priority}
+    stop = asyncio.Event()
+    moved = {'bytes': 0, 'refused': 0}
+
+    async def background_loop(worker_url, chunk_id):
+        chunk_url = f"{worker_url}/chunks/{chunk_id}"
+        while not stop.is_set():
+            try:
+                async with client.session.post(chunk_url, data=chunk, headers=headers) as response:
+                    await response.read()
+                if response.status == 200:
+                    async with client.session.get(chunk_url, headers=headers) as response:
+                        moved['bytes'] += len(chunk) + len(await response.read())
+                if response.status == 503:
+                    moved['refused'] += 1
+                    await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(0.1)
+        async with client.session.post(f"{chunk_url}/delete", headers=headers) as response:
+            await response.read()
+
+    loops = [asyncio.ensure_future(background_loop(cluster.worker_url(worker_id),
+                                                   make_chunk_id(uuid.UUID(int=rng.getrandbits(128), version=4), index)))
+             for worker_id in cluster.worker_ids for index in range(args.background_streams)]
+    started = time.perf_counter()
+    try:
+        result['loaded'], _ = await run_phase(lambda file_id: client.download(file_id, payload), file_ids,
+                                              args.concurrency)
+    finally:
+        stop.set()
+        await asyncio.gather(*loops)
+    result['background'] = {
+        'mb_per_sec': round(moved['bytes'] / 2 ** 20 / (time.perf_counter() - started), 2),
+        'refused': moved['refused'],
+    }
+    await run_phase(client.delete, file_ids, args.concurrency)
+    return result
+
+
+def usage_delta(before, after):
+    """
+    CPU seconds spent by the cluster between two resource_usage() snapshots,
+    and its resident memory at the end. A process restarted in between
+    counts from zero (the CPU time of a killed one is lost).
+    """
+    by_process = {}
+    for name, usage in after.items():
+        previous = before.get(name)
+        started_with = previous['cpu_seconds'] if previous and previous['pid'] == usage['pid'] else 0
+        by_process[name] = round(usage['cpu_seconds'] - started_with, 2)
+    return {
+        'cpu_seconds': round(sum(by_process.values()), 2),
+        'rss_mb': round(sum(usage['rss_mb'] for usage in after.values()), 1),
+        'by_process': by_process,
+    }
+
+
+async def run_scenarios(cluster, args):
+    rng = random.Random(args.seed)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    results = {}
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        client = Client(session, cluster.gateway_url)
+        for name in args.scenarios:
+            print(f"Running {name}...")
+            before = cluster.resource_usage()
+            started = time.perf_counter()
+            if name in ("worker_failure", "slow_worker", "background_load"):
+                result = await globals()[name](client, args, rng, cluster)
+            else:
+                result = await globals()[name](client, args, rng)
+            result['seconds'] = round(time.perf_counter() - started, 2)
+            result['resources'] = usage_delta(before, cluster.resource_usage())
+            results[name] = result
+    return results
+
+
+def flatten(results, prefix=""):
+    """
+    Flattens nested results into {"scenario.phase.metric": value} for the numeric leaves.
+    """
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of every throughput (higher is better) and latency
+    (lower is better) figure against a baseline.
+
+    Returns:
+        list: The figures that regressed by more than `tolerance` percent.
+    """
+    current, previous = flatten(results['scenarios']), flatten(baseline['scenarios'])
+    regressions = []
+    for path in sorted(current.keys() & previous.keys()):
+        metric = path.rsplit('.', 1)[1]
+        if metric.endswith('_per_sec'):
+            higher_is_better = True
+        elif metric.endswith('_ms'):
+            higher_is_better = False
+        else:
+            continue
+        old, new = previous[path], current[path]
+        if not old:
+            continue
+        change = (new - old) / old * 100
+        regressed = (change < -tolerance) if higher_is_better else (change > tolerance)
+        if regressed:
+            regressions.append(path)
+        print(f"{path:<50} {old:>10} -> {new:>10} ({change:+.1f}%){'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--server", choices=list(SERVER_MODULES), default="flask")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--base-port", type=int, default=7100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--large-mb", type=int, default=64)
+    parser.add_argument("--large-count", type=int, default=2)
+    parser.add_argument("--small-count", type=int, default=500)
+    parser.add_argument("--small-kb", type=int, default=16)
+    parser.add_argument("--mixed-files", type=int, default=100)
+    parser.add_argument("--mixed-ops", type=int, default=500)
+    parser.add_argument("--read-fraction", type=float, default=0.8)
+    parser.add_argument("--failure-mb", type=int, default=4)
+    parser.add_argument("--failure-seconds", type=float, default=30)
+    parser.add_argument("--slow-ms", type=int, default=200)
+    parser.add_argument("--background-streams", type=int, default=2)
+    parser.add_argument("--background-mb", type=int, default=8)
+    parser.add_argument("--background-priority", choices=["background", "foreground"], default="background")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=10, help="Percent change reported as a regression")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the cluster directory (logs, metadata)")
+    args = parser.parse_args()
+
+    if {"worker_failure", "slow_worker"} & set(args.scenarios) and args.workers < 4:
+        parser.error("worker_failure and slow_worker need at least 4 workers (3 replicas must stay placeable)")
+
+    with LocalCluster(workers=args.workers, base_port=args.base_port, server=args.server,
+                      keep_data=args.keep_data) as cluster:
+        scenarios = asyncio.run(run_scenarios(cluster, args))
+        if args.keep_data:
+            print(f"Cluster data and logs kept in {cluster.directory}")
+
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'baseline', 'keep_data')},
+        'scenarios': scenarios,
+    }
+    print(json.dumps(scenarios, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} figure(s) regressed by more than {args.tolerance}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
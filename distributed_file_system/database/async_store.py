@@ -0,0 +1,40 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from database.metadata_store import MetadataStore
+from shared.tracing import in_current_trace
+
+
+class AsyncMetadataStore:
+    """
+    Awaitable view of a metadata store for the asyncio servers.
+
+    Every MetadataStore method becomes a coroutine that runs the blocking
+    call on a dedicated thread pool, so the event loop keeps serving other
+    requests while the database answers. This is also how the async MongoDB
+    driver (motor) works: pymongo on a thread pool. The pool bounds the
+    database calls in flight; MongoDB's connection pool and SQLite's single
+    writer are the actual limits behind it.
+    """
+
+    def __init__(self, store, max_workers=32):
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metadata-store")
+
+    def run(self, function, *args, **kwargs):
+        """
+        Awaits any blocking callable on the store's thread pool, e.g. a
+        db_operations function that goes through the group commit writer.
+        """
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, in_current_trace(functools.partial(function, *args, **kwargs)))
+
+    def __getattr__(self, name):
+        if not callable(getattr(MetadataStore, name, None)):
+            raise AttributeError(name)
+        method = getattr(self._store, name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
@@ -1,25 +1,107 @@
 import os
-from pymongo import MongoClient
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env
 load_dotenv()
 
-# MongoDB URI from environment variables
+# Metadata backend: "mongo", "sqlite" (embedded file in WAL mode) or "memory" (embedded, single process)
+METADATA_BACKEND = os.getenv("METADATA_BACKEND", "mongo").lower()
+
+# MongoDB URI from environment variables (only required by the mongo backend)
 MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise Exception("MONGO_URI not found in environment variables")
 
 # MongoDB Database Name
 DB_NAME = os.getenv("DB_NAME", "prod")
 
-# Establish connection to MongoDB
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+# SQLite database file, shared by all masters and the gateway running on one machine
+SQLITE_PATH = os.getenv("SQLITE_PATH", "database/dfs_metadata.db")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # FULL fsyncs every commit; NORMAL only checkpoints
+
+# Group commit of file inserts and tombstones (see group_commit.py)
+METADATA_GROUP_COMMIT = os.getenv("METADATA_GROUP_COMMIT", "true").lower() == "true"
+METADATA_GROUP_COMMIT_WINDOW_MS = float(os.getenv("METADATA_GROUP_COMMIT_WINDOW_MS", 0))  # Extra wait for more writes per batch
+METADATA_GROUP_COMMIT_MAX_BATCH = int(os.getenv("METADATA_GROUP_COMMIT_MAX_BATCH", 256))  # Writes per bulk write
+
+# Record every metadata store call on /metrics and in traces (see instrumented_store.py)
+METADATA_METRICS = os.getenv("METADATA_METRICS", "true").lower() == "true"
+
+# Threads running blocking metadata calls for the asyncio servers (see async_store.py)
+ASYNC_STORE_THREADS = int(os.getenv("ASYNC_STORE_THREADS", 32))
+
+db = None
+store = None
+writer = None
+async_store = None
+_connect_lock = threading.RLock()
 
 # Export the database connection
 def get_database():
     """
-    Returns the MongoDB database instance.
+    Returns the MongoDB database instance, connecting on first use.
     """
+    global db
+    with _connect_lock:
+        if db is None:
+            if not MONGO_URI:
+                raise Exception("MONGO_URI not found in environment variables")
+            from pymongo import MongoClient
+            db = MongoClient(MONGO_URI)[DB_NAME]
     return db
+
+def create_metadata_store(backend):
+    """
+    Builds a metadata store for a backend name.
+    """
+    if backend == "mongo":
+        from database.mongo_store import MongoMetadataStore
+        return MongoMetadataStore(get_database())
+    if backend == "sqlite":
+        from database.sqlite_store import SQLiteMetadataStore
+        return SQLiteMetadataStore(SQLITE_PATH, synchronous=SQLITE_SYNCHRONOUS)
+    if backend == "memory":
+        from database.sqlite_store import SQLiteMetadataStore
+        return SQLiteMetadataStore(":memory:")
+    raise ValueError(f"Unknown METADATA_BACKEND: {backend}")
+
+def get_metadata_store():
+    """
+    Returns the metadata store selected by METADATA_BACKEND, creating it on first use.
+    """
+    global store
+    with _connect_lock:
+        if store is None:
+            store = create_metadata_store(METADATA_BACKEND)
+            if METADATA_METRICS:
+                from database.instrumented_store import InstrumentedMetadataStore
+                store = InstrumentedMetadataStore(store)
+    return store
+
+def get_metadata_writer():
+    """
+    Returns the group commit writer for the metadata store, or None if
+    METADATA_GROUP_COMMIT is disabled.
+    """
+    global writer
+    if not METADATA_GROUP_COMMIT:
+        return None
+    with _connect_lock:
+        if writer is None:
+            from database.group_commit import GroupCommitWriter
+            writer = GroupCommitWriter(
+                get_metadata_store(),
+                window=METADATA_GROUP_COMMIT_WINDOW_MS / 1000,
+                max_batch=METADATA_GROUP_COMMIT_MAX_BATCH
+            )
+    return writer
+
+def get_async_metadata_store():
+    """
+    Returns an awaitable view of the metadata store, for the asyncio servers.
+    """
+    global async_store
+    with _connect_lock:
+        if async_store is None:
+            from database.async_store import AsyncMetadataStore
+            async_store = AsyncMetadataStore(get_metadata_store(), max_workers=ASYNC_STORE_THREADS)
+    return async_store
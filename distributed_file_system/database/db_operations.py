@@ -1,95 +1,271 @@
-from database.connection import get_database
-from datetime import datetime, timedelta
+from database.connection import get_metadata_store, get_metadata_writer
+from datetime import datetime
 
-# Get the database instance
-db = get_database()
+# Every operation is delegated to the store selected by METADATA_BACKEND (see connection.py).
+# File inserts and tombstones are group-committed unless METADATA_GROUP_COMMIT is disabled.
 
-# Reusable functions for accessing collections
-def get_workers_collection():
+# Utility to update worker information
+def update_worker(worker_id, url, status="active"):
     """
-    Returns the workers collection.
+    Updates or inserts worker information in the workers collection.
     """
-    return db["workers"]
+    get_metadata_store().update_worker(worker_id, url, status)
 
-def get_files_collection():
+# Utility to list every file
+def fetch_all_files():
     """
-    Returns the files collection.
+    Fetches the metadata of every file, including deleted ones.
     """
-    return db["files"]
+    return get_metadata_store().fetch_all_files()
 
-def get_metadata_collection():
+# Utility to write many worker records in one round trip
+def bulk_update_workers(worker_records):
     """
-    Returns the metadata collection.
+    Upserts a batch of worker records with a single bulk write.
+
+    Args:
+        worker_records (list): Dicts with worker_id, url, status and
+            last_heartbeat (epoch seconds).
     """
-    return db["metadata"]
+    get_metadata_store().bulk_update_workers(worker_records)
 
-# Utility to update worker information
-def update_worker(worker_id, url, status="active"):
+# Utility to get every known worker
+def fetch_workers():
     """
-    Updates or inserts worker information in the workers collection.
+    Retrieves all workers with their status and last heartbeat.
     """
-    workers = get_workers_collection()
-    workers.update_one(
-        {"worker_id": worker_id},
-        {"$set": {
-            "url": url,
-            "status": status,
-            "last_heartbeat": datetime.utcnow()
-        }},
-        upsert=True
-    )
+    return get_metadata_store().fetch_workers()
 
 # Utility to get active workers
 def get_active_workers():
     """
     Retrieves all active workers.
     """
-    workers = get_workers_collection()
-    return list(workers.find({"status": "active"}, {"_id": 0, "worker_id": 1, "url": 1}))
+    return get_metadata_store().get_active_workers()
 
 # Utility to store file metadata
-def store_file_metadata(file_id, file_name, size, chunks):
-    files = get_files_collection()
-    print(file_id,"file_id")
-    files.insert_one({
+def store_file_metadata(file_id, file_name, size, chunks, packed=False, chunk_size=None, partition=0, owner=None):
+    """
+    Inserts the metadata of a new file and adds it to its owner's usage.
+    Returns once the record is committed.
+    """
+    file_doc = {
         "file_id": file_id,
+        "partition": partition,
+        "owner": owner,
         "file_name": file_name,
         "size": size,
         "chunks": chunks,
+        "chunk_size": chunk_size,
+        "packed": packed,
         "status": "active",
         "created_at": datetime.utcnow()
-    })
+    }
+    writer = get_metadata_writer()
+    if writer:
+        writer.insert_file(file_doc)
+        return
+    store = get_metadata_store()
+    try:
+        store.store_file_metadata(file_doc)
+    except Exception:
+        # The file may have been stored without being counted: if so, it is stored once its usage is
+        if file_id not in store.settle_usage([file_id]):
+            raise
 
 # Utility to fetch file metadata
 def fetch_file_metadata(file_id):
     """
     Fetches metadata for a file from the files collection.
     """
-    files = get_files_collection()
-    return files.find_one({"file_id": file_id})
+    return get_metadata_store().fetch_file_metadata(file_id)
+
+# Utility to mark a pending replica as durable
+def promote_pending_replica(file_id, chunk_id, pending_worker_id, worker_id):
+    """
+    Moves a chunk replica from the pending list to the durable worker list.
+
+    Args:
+        file_id (str): ID of the file owning the chunk.
+        chunk_id (str): ID of the repaired chunk.
+        pending_worker_id (str): Worker the replica was originally pending on.
+        worker_id (str): Worker that now durably holds the replica.
+    """
+    get_metadata_store().promote_pending_replica(file_id, chunk_id, pending_worker_id, worker_id)
+
+# Utility to find files whose chunks still have replicas to complete
+def fetch_files_with_pending_replicas(partition=None):
+    """
+    Fetches active files (of one metadata partition, if given) that have at
+    least one chunk with pending replicas.
+    """
+    return get_metadata_store().fetch_files_with_pending_replicas(partition)
+
+# Utility to soft delete a file and queue its chunks for garbage collection
+def tombstone_file(file_id):
+    """
+    Marks a file as deleted and leaves its chunks for the garbage collector.
+
+    Returns:
+        bool: True if an active file was tombstoned.
+    """
+    writer = get_metadata_writer()
+    if writer:
+        return writer.tombstone_file(file_id)
+    store = get_metadata_store()
+    try:
+        return store.tombstone_file(file_id)
+    except Exception:
+        store.settle_usage([file_id])  # Counts the tombstone if it was written, as a retry will find no active file
+        raise
+
+# Utility to fetch deleted files whose chunks have not been collected yet
+def fetch_files_pending_gc(limit, partition=None):
+    """
+    Fetches up to `limit` tombstoned files (of one metadata partition, if
+    given) that still have chunks on workers.
+    """
+    return get_metadata_store().fetch_files_pending_gc(limit, partition)
+
+# Utility to record that the chunks of deleted files are gone
+def mark_files_collected(file_ids):
+    """
+    Marks tombstoned files as fully garbage collected.
+    """
+    get_metadata_store().mark_files_collected(file_ids)
+
+# Utility to fetch where the chunks of live files are placed
+def fetch_chunk_placements():
+    """
+    Fetches the chunks of every file whose chunks are still referenced:
+    active files and deleted files that have not been collected yet.
+    """
+    return get_metadata_store().fetch_chunk_placements()
+
+# Utility to register a new container chunk for packed small files
+def create_container(container_id, worker_ids, partition=0):
+    """
+    Inserts a new open container chunk owned by a metadata partition.
+    """
+    get_metadata_store().create_container(container_id, worker_ids, partition)
+
+# Utility to record bytes appended to a container
+def record_container_append(container_id, end_offset, length):
+    """
+    Extends a container's size to `end_offset` and counts `length` live bytes.
+
+    Returns:
+        bool: False if the container is no longer open, in which case nothing is recorded.
+    """
+    return get_metadata_store().record_container_append(container_id, end_offset, length)
+
+# Utility to release the bytes of a deleted packed file
+def release_container_space(container_id, length):
+    """
+    Subtracts `length` bytes from a container's live bytes.
+    """
+    get_metadata_store().release_container_space(container_id, length)
+
+# Utility to stop appending to containers
+def seal_containers(container_ids=None, partition=None):
+    """
+    Seals the given containers, or every open container (of one metadata
+    partition, if given) if none are given.
+    """
+    get_metadata_store().seal_containers(container_ids, partition)
+
+# Utility to find sealed containers that are mostly deleted
+def fetch_containers_to_compact(max_live_ratio, partition=None):
+    """
+    Fetches sealed containers whose live bytes are at most `max_live_ratio` of their size.
+    """
+    return get_metadata_store().fetch_containers_to_compact(max_live_ratio, partition)
+
+# Utility to mark a compacted container as deleted
+def mark_container_deleted(container_id):
+    """
+    Marks a container as deleted once its live files have been moved out.
+    """
+    get_metadata_store().mark_container_deleted(container_id)
+
+# Utility to fetch containers that still hold data
+def fetch_live_containers():
+    """
+    Fetches every container that has not been deleted.
+    """
+    return get_metadata_store().fetch_live_containers()
+
+# Utility to fetch the active files packed into a container
+def fetch_files_in_container(container_id):
+    """
+    Fetches the active files stored in a container chunk.
+    """
+    return get_metadata_store().fetch_files_in_container(container_id)
+
+# Utility to point a packed file at its new container after compaction
+def relocate_packed_file(file_id, old_container_id, new_chunk):
+    """
+    Replaces the container placement of a packed file, if it is still active
+    and still stored in the old container.
+
+    Returns:
+        bool: True if the file was relocated.
+    """
+    return get_metadata_store().relocate_packed_file(file_id, old_container_id, new_chunk)
+
+# Utility to read an owner's usage counters
+def fetch_usage(owner):
+    """
+    Fetches the bytes, files and chunks stored by an owner, and its quotas,
+    from its usage record (kept up to date on upload and delete).
+
+    Returns:
+        dict: The usage record, or None if the owner has none.
+    """
+    return get_metadata_store().fetch_usage(owner)
+
+# Utility to set an owner's quotas
+def set_quota(owner, quota_bytes, quota_files):
+    """
+    Sets the most bytes and files an owner may store (None: the default quota).
+    """
+    get_metadata_store().set_quota(owner, quota_bytes, quota_files)
+
+# Utility to acquire the leader lease
+def acquire_leader_lease(leader_id, lease_seconds, partition=0):
+    """
+    Atomically takes the leader lease of a metadata partition if it has
+    expired (or is already held by `leader_id`), incrementing its fencing token.
+
+    Returns:
+        dict: The lease document if acquired, otherwise None.
+    """
+    return get_metadata_store().acquire_leader_lease(leader_id, lease_seconds, partition)
+
+# Utility to extend the leader lease
+def renew_leader_lease(leader_id, fencing_token, lease_seconds, partition=0):
+    """
+    Extends a partition's lease if it is still held by `leader_id` with `fencing_token`.
+
+    Returns:
+        bool: True if the lease was renewed.
+    """
+    return get_metadata_store().renew_leader_lease(leader_id, fencing_token, lease_seconds, partition)
 
-# Utility to update leader metadata
-def update_leader_metadata(leader_id):
+# Utility to give up the leader lease before it expires
+def release_leader_lease(leader_id, fencing_token, partition=0):
     """
-    Updates leader information in the metadata collection.
+    Expires a partition's lease immediately if it is still held by `leader_id`
+    with `fencing_token`, so another master can take it without waiting.
     """
-    metadata = get_metadata_collection()
-    metadata.update_one(
-        {"type": "leader"},
-        {"$set": {
-            "leader": leader_id,
-            "last_updated": datetime.utcnow()
-        }},
-        upsert=True
-    )
+    get_metadata_store().release_leader_lease(leader_id, fencing_token, partition)
 
 # Utility to fetch leader metadata
-def fetch_leader_metadata():
+def fetch_leader_metadata(partition=0):
     """
-    Fetches leader information from the metadata collection.
+    Fetches the leader lease of a metadata partition from the metadata collection.
     """
-    metadata = get_metadata_collection()
-    return metadata.find_one({"type": "leader"})
+    return get_metadata_store().fetch_leader_metadata(partition)
 
 
 
@@ -97,15 +273,4 @@ def mark_inactive_workers(timeout_seconds):
     """
     Marks workers as inactive if they have not sent a heartbeat within the timeout period.
     """
-    workers = get_workers_collection()
-    timeout_threshold = datetime.utcnow() - timedelta(seconds=timeout_seconds)
-    result = workers.update_many(
-        {
-            "last_heartbeat": {"$lt": timeout_threshold},
-            "status": "active"
-        },
-        {
-            "$set": {"status": "inactive"}
-        }
-    )
-    return result.modified_count  # Number of workers marked as inactive
+    return get_metadata_store().mark_inactive_workers(timeout_seconds)  # Number of workers marked as inactive
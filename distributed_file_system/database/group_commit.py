@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+
+from shared.tracing import span
+
+
+class _PendingWrite:
+    """
+    A write waiting in the group commit queue, and its outcome once committed.
+    """
+
+    def __init__(self, kind, value):
+        self.kind = kind  # "insert" (a file document) or "tombstone" (a file ID)
+        self.value = value
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitWriter:
+    """
+    Commits file inserts and tombstones from many request threads together.
+
+    Callers block in `insert_file` / `tombstone_file` until their write is
+    committed, as with a direct store call. A single background thread takes
+    every queued write (up to `max_batch`) and applies them with one bulk
+    insert and one bulk tombstone, so a burst of uploads costs one database
+    round trip (and one fsync) per batch instead of per file. Writes arriving
+    while a batch commits form the next batch; a `window` (seconds) can make
+    the thread wait for more writes first, which only pays off when a commit
+    costs much more than the wait.
+
+    If a bulk write fails, its writes are retried one by one so a single bad
+    record only fails its own caller. A failed bulk write may still have
+    applied part of the batch without updating the usage counters, so the
+    store first settles the usage of the batch (see
+    MetadataStore.settle_usage), and the retries skip what was applied.
+    """
+
+    def __init__(self, store, window=0.0, max_batch=256):
+        self.store = store
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="metadata-group-commit", daemon=True)
+        self._thread.start()
+
+    def insert_file(self, file_doc):
+        """
+        Inserts a file document; returns once it is committed.
+        """
+        self._submit("insert", file_doc)
+
+    def tombstone_file(self, file_id):
+        """
+        Tombstones a file; returns once committed, True if an active file was tombstoned.
+        """
+        return self._submit("tombstone", file_id)
+
+    def _submit(self, kind, value):
+        write = _PendingWrite(kind, value)
+        with span(f"metadata.group_commit.{kind}"):
+            self._queue.put(write)
+            write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self._commit([write for write in batch if write.kind == "insert"],
+                         [write for write in batch if write.kind == "tombstone"])
+            for write in batch:
+                write.done.set()
+
+    def _commit(self, inserts, tombstones):
+        if inserts:
+            try:
+                self.store.store_files_metadata([write.value for write in inserts])
+            except Exception:
+                if self._settle(inserts, [write.value["file_id"] for write in inserts]):
+                    for write in inserts:
+                        self._commit_one(write)
+        if tombstones:
+            file_ids = list(dict.fromkeys(write.value for write in tombstones))
+            try:
+                tombstoned = set(self.store.tombstone_files(file_ids))
+            except Exception:
+                if self._settle(tombstones, file_ids):
+                    for write in tombstones:
+                        self._commit_one(write)
+                return
+            for write in tombstones:
+                write.result = write.value in tombstoned
+                tombstoned.discard(write.value)  # A duplicate delete in the same batch finds the file already deleted
+
+    def _settle(self, writes, file_ids):
+        """
+        Settles the usage of the files of a failed bulk write. Returns False
+        after failing `writes` if that failed too.
+        """
+        try:
+            self.store.settle_usage(file_ids)
+        except Exception as e:
+            for write in writes:
+                write.error = e
+            return False
+        return True
+
+    def _commit_one(self, write):
+        try:
+            if write.kind == "tombstone":
+                write.result = self.store.tombstone_file(write.value)
+            elif self.store.fetch_file_metadata(write.value["file_id"]) is None:
+                # A failed bulk insert may still have stored part of the batch (its usage is settled)
+                self.store.store_file_metadata(write.value)
+        except Exception as e:
+            write.error = e
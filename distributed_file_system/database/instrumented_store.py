@@ -0,0 +1,45 @@
+import functools
+import time
+
+from database.metadata_store import MetadataStore
+from shared.metrics import counter, histogram
+from shared.tracing import span
+
+METADATA_OP_SECONDS = histogram('dfs_metadata_op_seconds', 'Time of a metadata store call, by operation', ('op',))
+METADATA_OP_ERRORS = counter('dfs_metadata_op_errors', 'Metadata store calls that raised, by operation', ('op',))
+
+
+class InstrumentedMetadataStore:
+    """
+    Metadata store that records the latency and errors of every call made
+    through it (see shared/metrics.py), as well as a span per call in traced
+    requests (see shared/tracing.py), and otherwise behaves like the store it
+    wraps. Each method is wrapped once, on first use.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not callable(getattr(MetadataStore, name, None)):
+            return attribute
+
+        latency = METADATA_OP_SECONDS.labels(name)
+        errors = METADATA_OP_ERRORS.labels(name)
+        span_name = f"metadata.{name}"
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span(span_name):
+                    return attribute(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+
+        setattr(self, name, call)
+        return call
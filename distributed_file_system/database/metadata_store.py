@@ -0,0 +1,242 @@
+from abc import ABC, abstractmethod
+
+
+def lease_type(partition):
+    """
+    Returns the metadata document type of a partition's leader lease.
+    Partition 0 keeps the original "leader" document and its token sequence.
+    """
+    return "leader" if partition == 0 else f"leader_{partition}"
+
+
+def usage_deltas(file_docs, sign=1):
+    """
+    Sums the usage that inserting (sign 1) or deleting (sign -1) file
+    documents adds to their owners. Files without an owner (uploaded before
+    ownership) are not accounted.
+
+    Returns:
+        dict: {owner: (bytes, files, chunks)}
+    """
+    deltas = {}
+    for file_doc in file_docs:
+        owner = file_doc.get("owner")
+        if owner is None:
+            continue
+        size, files, chunks = deltas.get(owner, (0, 0, 0))
+        deltas[owner] = (size + sign * (file_doc.get("size") or 0), files + sign,
+                         chunks + sign * len(file_doc.get("chunks") or []))
+    return deltas
+
+
+class MetadataStore(ABC):
+    """
+    Interface of a metadata backend.
+
+    `db_operations` delegates every operation to the configured store, so the
+    masters and the gateway never talk to a backend directly. Documents are
+    plain dicts shaped like the MongoDB documents, with naive UTC datetimes.
+
+    A `partition` of None means every metadata partition; files and containers
+    written before partitioning belong to partition 0.
+    """
+
+    # Workers
+
+    @abstractmethod
+    def update_worker(self, worker_id, url, status="active"):
+        """
+        Upserts a worker with the current time as its last heartbeat.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk_update_workers(self, worker_records):
+        """
+        Upserts many worker records (last_heartbeat in epoch seconds) at once.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_workers(self):
+        """
+        Returns every worker with its url, status and last heartbeat.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_active_workers(self):
+        """
+        Returns the worker_id and url of every active worker.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_inactive_workers(self, timeout_seconds):
+        """
+        Marks active workers without a recent heartbeat inactive and returns how many.
+        """
+        raise NotImplementedError
+
+    # Files
+
+    @abstractmethod
+    def fetch_all_files(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def store_file_metadata(self, file_doc):
+        """
+        Inserts a new file document and adds it to its owner's usage.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def store_files_metadata(self, file_docs):
+        """
+        Inserts many new file documents (and their usage) in one write.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_file_metadata(self, file_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def promote_pending_replica(self, file_id, chunk_id, pending_worker_id, worker_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_files_with_pending_replicas(self, partition=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def tombstone_file(self, file_id):
+        """
+        Returns True if an active file was tombstoned. Tombstoning subtracts
+        the file from its owner's usage.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def tombstone_files(self, file_ids):
+        """
+        Tombstones the active files among `file_ids` in one write and returns
+        the IDs of the files that were tombstoned.
+        """
+        raise NotImplementedError
+
+    def settle_usage(self, file_ids):
+        """
+        Adds to their owners' usage the files among `file_ids` that were
+        inserted or tombstoned by a write which failed before updating the
+        usage counters (e.g. a bulk insert that stored part of its batch).
+        Stores updating both in one transaction have nothing to settle.
+
+        Returns:
+            list: IDs of the files whose usage was settled.
+        """
+        return []
+
+    @abstractmethod
+    def fetch_files_pending_gc(self, limit, partition=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_files_collected(self, file_ids):
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_chunk_placements(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_files_in_container(self, container_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def relocate_packed_file(self, file_id, old_container_id, new_chunk):
+        """
+        Returns True if the file was relocated.
+        """
+        raise NotImplementedError
+
+    # Containers
+
+    @abstractmethod
+    def create_container(self, container_id, worker_ids, partition=0):
+        raise NotImplementedError
+
+    @abstractmethod
+    def record_container_append(self, container_id, end_offset, length):
+        """
+        Records an append to a container if it is still open. Returns False
+        if it was sealed (e.g. by another leader of its partition) or deleted.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_container_space(self, container_id, length):
+        raise NotImplementedError
+
+    @abstractmethod
+    def seal_containers(self, container_ids=None, partition=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_containers_to_compact(self, max_live_ratio, partition=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_container_deleted(self, container_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_live_containers(self):
+        raise NotImplementedError
+
+    # Usage
+
+    @abstractmethod
+    def fetch_usage(self, owner):
+        """
+        Returns the usage counters (bytes, files, chunks) and quotas
+        (quota_bytes, quota_files, None if unset) of an owner, or None if it
+        has never stored a file nor been given a quota. A single key lookup.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_quota(self, owner, quota_bytes, quota_files):
+        """
+        Sets an owner's quotas (None: no quota of its own).
+        """
+        raise NotImplementedError
+
+    # Leader lease
+
+    @abstractmethod
+    def acquire_leader_lease(self, leader_id, lease_seconds, partition=0):
+        """
+        Atomically takes a partition's lease if it expired or is held by `leader_id`,
+        incrementing the fencing token. Returns the lease document or None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew_leader_lease(self, leader_id, fencing_token, lease_seconds, partition=0):
+        """
+        Returns True if the lease held by `leader_id` with `fencing_token` was extended.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_leader_lease(self, leader_id, fencing_token, partition=0):
+        """
+        Expires the lease now if it is still held by `leader_id` with `fencing_token`.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_leader_metadata(self, partition=0):
+        raise NotImplementedError
@@ -0,0 +1,322 @@
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from database.metadata_store import MetadataStore, lease_type, usage_deltas
+
+
+def partition_filter(partition):
+    """
+    Query matching the documents of a partition (all if None). Documents
+    without a partition field predate partitioning and belong to partition 0.
+    """
+    if partition is None:
+        return {}
+    if partition == 0:
+        return {"partition": {"$in": [0, None]}}
+    return {"partition": partition}
+
+
+class MongoMetadataStore(MetadataStore):
+    """
+    Metadata store backed by a MongoDB database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.workers = db["workers"]
+        self.files = db["files"]
+        self.metadata = db["metadata"]
+        self.containers = db["containers"]
+        self.usage = db["usage"]
+
+    # Workers
+
+    def update_worker(self, worker_id, url, status="active"):
+        self.workers.update_one(
+            {"worker_id": worker_id},
+            {"$set": {
+                "url": url,
+                "status": status,
+                "last_heartbeat": datetime.utcnow()
+            }},
+            upsert=True
+        )
+
+    def bulk_update_workers(self, worker_records):
+        if not worker_records:
+            return
+        self.workers.bulk_write([
+            UpdateOne(
+                {"worker_id": record["worker_id"]},
+                {"$set": {
+                    "url": record["url"],
+                    "status": record["status"],
+                    "last_heartbeat": datetime.utcfromtimestamp(record["last_heartbeat"])
+                }},
+                upsert=True
+            )
+            for record in worker_records
+        ], ordered=False)
+
+    def fetch_workers(self):
+        return list(self.workers.find({}, {"_id": 0, "worker_id": 1, "url": 1, "status": 1, "last_heartbeat": 1}))
+
+    def get_active_workers(self):
+        return list(self.workers.find({"status": "active"}, {"_id": 0, "worker_id": 1, "url": 1}))
+
+    def mark_inactive_workers(self, timeout_seconds):
+        timeout_threshold = datetime.utcnow() - timedelta(seconds=timeout_seconds)
+        result = self.workers.update_many(
+            {"last_heartbeat": {"$lt": timeout_threshold}, "status": "active"},
+            {"$set": {"status": "inactive"}}
+        )
+        return result.modified_count
+
+    # Files
+
+    def fetch_all_files(self):
+        return list(self.files.find({}, {"_id": 0, "usage_pending": 0}))
+
+    def _add_usage(self, file_docs, sign=1):
+        """
+        Updates the usage counters of the owners of inserted (sign 1) or
+        deleted (sign -1) files, right after the files themselves.
+
+        MongoDB cannot update both atomically, so each file document carries
+        the usage it has yet to add to its owner's counters in `usage_pending`
+        (1 once inserted, -1 once tombstoned, 0 once counted), which is
+        cleared here once the counters are updated. A write failing in between
+        leaves it set for `settle_usage`.
+        """
+        deltas = usage_deltas(file_docs, sign)
+        if deltas:
+            self.usage.bulk_write([
+                UpdateOne({"_id": owner}, {"$inc": {"bytes": size, "files": files, "chunks": chunks}}, upsert=True)
+                for owner, (size, files, chunks) in deltas.items()
+            ], ordered=False)
+        self.files.update_many(
+            {"file_id": {"$in": [file_doc["file_id"] for file_doc in file_docs]}},
+            {"$inc": {"usage_pending": -sign}}
+        )
+
+    def store_file_metadata(self, file_doc):
+        self.files.insert_one(dict(file_doc, usage_pending=1))
+        self._add_usage([file_doc])
+
+    def store_files_metadata(self, file_docs):
+        if not file_docs:
+            return
+        try:
+            self.files.insert_many([dict(file_doc, usage_pending=1) for file_doc in file_docs], ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every document but the failed ones was inserted, and is counted before the error is raised
+            failed = {error["index"] for error in e.details.get("writeErrors", ())}
+            inserted = [file_doc for index, file_doc in enumerate(file_docs) if index not in failed]
+            if inserted:
+                self._add_usage(inserted)
+            raise
+        self._add_usage(file_docs)
+
+    def settle_usage(self, file_ids):
+        pending = list(self.files.find(
+            {"file_id": {"$in": list(file_ids)}, "usage_pending": {"$nin": [0, None]}},
+            {"_id": 0, "file_id": 1, "owner": 1, "size": 1, "chunks.chunk_id": 1, "usage_pending": 1}
+        ))
+        for sign in (1, -1):
+            file_docs = [file_doc for file_doc in pending if file_doc["usage_pending"] == sign]
+            if file_docs:
+                self._add_usage(file_docs, sign)
+        return [file_doc["file_id"] for file_doc in pending]
+
+    def fetch_file_metadata(self, file_id):
+        return self.files.find_one({"file_id": file_id}, {"usage_pending": 0})
+
+    def promote_pending_replica(self, file_id, chunk_id, pending_worker_id, worker_id):
+        self.files.update_one(
+            {"file_id": file_id, "chunks.chunk_id": chunk_id},
+            {
+                "$pull": {"chunks.$.pending_worker_ids": pending_worker_id},
+                "$addToSet": {"chunks.$.worker_ids": worker_id}
+            }
+        )
+
+    def fetch_files_with_pending_replicas(self, partition=None):
+        return list(self.files.find(
+            {"status": "active", "chunks.pending_worker_ids.0": {"$exists": True}, **partition_filter(partition)},
+            {"_id": 0, "file_id": 1, "chunks": 1}
+        ))
+
+    def tombstone_file(self, file_id):
+        file_doc = self.files.find_one_and_update(
+            {"file_id": file_id, "status": "active"},
+            {"$set": {"status": "deleted", "deleted_at": datetime.utcnow(), "gc_status": "pending"},
+             "$inc": {"usage_pending": -1}},
+            projection={"_id": 0, "file_id": 1, "owner": 1, "size": 1, "chunks.chunk_id": 1}
+        )
+        if file_doc is None:
+            return False
+        self._add_usage([file_doc], sign=-1)
+        return True
+
+    def tombstone_files(self, file_ids):
+        file_ids = list(file_ids)
+        if not file_ids:
+            return []
+        active = list(self.files.find(
+            {"file_id": {"$in": file_ids}, "status": "active"},
+            {"_id": 0, "file_id": 1, "owner": 1, "size": 1, "chunks.chunk_id": 1}
+        ))
+        if active:
+            # Only the leader of a file's partition tombstones it, so nothing changes between the find and the update
+            self.files.update_many(
+                {"file_id": {"$in": [file_doc["file_id"] for file_doc in active]}, "status": "active"},
+                {"$set": {"status": "deleted", "deleted_at": datetime.utcnow(), "gc_status": "pending"},
+                 "$inc": {"usage_pending": -1}}
+            )
+            self._add_usage(active, sign=-1)
+        return [file_doc["file_id"] for file_doc in active]
+
+    def fetch_files_pending_gc(self, limit, partition=None):
+        return list(self.files.find(
+            {"status": "deleted", "gc_status": "pending", **partition_filter(partition)},
+            {"_id": 0, "file_id": 1, "chunks": 1, "packed": 1}
+        ).limit(limit))
+
+    def mark_files_collected(self, file_ids):
+        if not file_ids:
+            return
+        self.files.update_many(
+            {"file_id": {"$in": list(file_ids)}},
+            {"$set": {"gc_status": "done", "collected_at": datetime.utcnow()}}
+        )
+
+    def fetch_chunk_placements(self):
+        return list(self.files.find(
+            {"$or": [{"status": "active"}, {"gc_status": "pending"}]},
+            {"_id": 0, "file_id": 1, "chunks": 1}
+        ))
+
+    def fetch_files_in_container(self, container_id):
+        return list(self.files.find(
+            {"status": "active", "packed": True, "chunks.chunk_id": container_id},
+            {"_id": 0, "file_id": 1, "chunks": 1}
+        ))
+
+    def relocate_packed_file(self, file_id, old_container_id, new_chunk):
+        result = self.files.update_one(
+            {"file_id": file_id, "status": "active", "chunks.chunk_id": old_container_id},
+            {"$set": {"chunks": [new_chunk]}}
+        )
+        return result.modified_count > 0
+
+    # Containers
+
+    def create_container(self, container_id, worker_ids, partition=0):
+        self.containers.insert_one({
+            "container_id": container_id,
+            "worker_ids": worker_ids,
+            "partition": partition,
+            "size": 0,
+            "live_bytes": 0,
+            "status": "open",
+            "created_at": datetime.utcnow()
+        })
+
+    def record_container_append(self, container_id, end_offset, length):
+        result = self.containers.update_one(
+            {"container_id": container_id, "status": "open"},
+            {"$max": {"size": end_offset}, "$inc": {"live_bytes": length}}
+        )
+        return result.matched_count > 0
+
+    def release_container_space(self, container_id, length):
+        self.containers.update_one({"container_id": container_id}, {"$inc": {"live_bytes": -length}})
+
+    def seal_containers(self, container_ids=None, partition=None):
+        query = {"status": "open", **partition_filter(partition)}
+        if container_ids is not None:
+            query["container_id"] = {"$in": list(container_ids)}
+        self.containers.update_many(query, {"$set": {"status": "sealed", "sealed_at": datetime.utcnow()}})
+
+    def fetch_containers_to_compact(self, max_live_ratio, partition=None):
+        return list(self.containers.find(
+            {
+                "status": "sealed",
+                "$expr": {"$lte": ["$live_bytes", {"$multiply": ["$size", max_live_ratio]}]},
+                **partition_filter(partition)
+            },
+            {"_id": 0}
+        ))
+
+    def mark_container_deleted(self, container_id):
+        self.containers.update_one(
+            {"container_id": container_id},
+            {"$set": {"status": "deleted", "deleted_at": datetime.utcnow()}}
+        )
+
+    def fetch_live_containers(self):
+        return list(self.containers.find({"status": {"$ne": "deleted"}}, {"_id": 0, "container_id": 1, "worker_ids": 1}))
+
+    # Usage
+
+    def fetch_usage(self, owner):
+        usage = self.usage.find_one({"_id": owner})  # Keyed by owner, so a primary key lookup
+        if usage is None:
+            return None
+        return {"owner": owner, "bytes": usage.get("bytes", 0), "files": usage.get("files", 0),
+                "chunks": usage.get("chunks", 0), "quota_bytes": usage.get("quota_bytes"),
+                "quota_files": usage.get("quota_files")}
+
+    def set_quota(self, owner, quota_bytes, quota_files):
+        self.usage.update_one(
+            {"_id": owner}, {"$set": {"quota_bytes": quota_bytes, "quota_files": quota_files}}, upsert=True
+        )
+
+    # Leader lease
+
+    def acquire_leader_lease(self, leader_id, lease_seconds, partition=0):
+        now = datetime.utcnow()
+        # Create the lease document first, so the conditional update below never inserts a second one
+        self.metadata.update_one(
+            {"type": lease_type(partition)},
+            {"$setOnInsert": {"fencing_token": 0, "lease_expires_at": now, "partition": partition}},
+            upsert=True
+        )
+        return self.metadata.find_one_and_update(
+            {
+                "type": lease_type(partition),
+                "$or": [
+                    {"lease_expires_at": {"$exists": False}},
+                    {"lease_expires_at": {"$lte": now}},
+                    {"leader": leader_id}
+                ]
+            },
+            {
+                "$set": {
+                    "leader": leader_id,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "last_updated": now
+                },
+                "$inc": {"fencing_token": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+
+    def renew_leader_lease(self, leader_id, fencing_token, lease_seconds, partition=0):
+        now = datetime.utcnow()
+        result = self.metadata.update_one(
+            {"type": lease_type(partition), "leader": leader_id, "fencing_token": fencing_token},
+            {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "last_updated": now}}
+        )
+        return result.matched_count == 1
+
+    def release_leader_lease(self, leader_id, fencing_token, partition=0):
+        now = datetime.utcnow()
+        self.metadata.update_one(
+            {"type": lease_type(partition), "leader": leader_id, "fencing_token": fencing_token},
+            {"$set": {"lease_expires_at": now, "last_updated": now}}
+        )
+
+    def fetch_leader_metadata(self, partition=0):
+        return self.metadata.find_one({"type": lease_type(partition)})
@@ -0,0 +1,478 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from database.metadata_store import MetadataStore, lease_type, usage_deltas
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    url TEXT,
+    status TEXT NOT NULL,
+    last_heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    gc_status TEXT,
+    packed INTEGER NOT NULL DEFAULT 0,
+    container_id TEXT,
+    has_pending INTEGER NOT NULL DEFAULT 0,
+    partition INTEGER NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_container ON files (container_id) WHERE container_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS files_pending ON files (has_pending) WHERE has_pending = 1;
+CREATE TABLE IF NOT EXISTS containers (
+    container_id TEXT PRIMARY KEY,
+    worker_ids TEXT NOT NULL,
+    partition INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    live_bytes INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    created_at REAL,
+    sealed_at REAL,
+    deleted_at REAL
+);
+CREATE TABLE IF NOT EXISTS usage (
+    owner TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    quota_bytes INTEGER,
+    quota_files INTEGER
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    type TEXT PRIMARY KEY,
+    leader TEXT,
+    fencing_token INTEGER NOT NULL DEFAULT 0,
+    lease_expires_at REAL,
+    last_updated REAL
+);
+"""
+
+# Columns added after the first release, created on databases that lack them
+MIGRATIONS = {
+    "files": {"partition": "INTEGER NOT NULL DEFAULT 0"},
+    "containers": {"partition": "INTEGER NOT NULL DEFAULT 0"},
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS files_status_partition ON files (status, gc_status, partition);
+"""
+
+
+def _to_epoch(value):
+    """
+    Converts a naive UTC datetime into epoch seconds.
+    """
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _from_epoch(value):
+    """
+    Converts epoch seconds into a naive UTC datetime, like pymongo returns.
+    """
+    return datetime.utcfromtimestamp(value) if value is not None else None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": _to_epoch(value)}
+    raise TypeError(f"Cannot encode {type(value).__name__} in a metadata document")
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return _from_epoch(obj["$date"])
+    return obj
+
+
+def encode_document(doc):
+    return json.dumps(doc, default=_encode_value, separators=(",", ":"))
+
+
+def decode_document(text):
+    return json.loads(text, object_hook=_decode_object)
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """
+    Embedded metadata store for single-node deployments, tests and benchmarks.
+
+    Files are kept as JSON documents next to the few columns the queries
+    filter on. The database runs in WAL mode so readers never block the
+    writer, and every read-modify-write runs in a BEGIN IMMEDIATE transaction,
+    which makes it safe for several masters (and the gateway) on one machine
+    to share the same database file. A path of ":memory:" gives a private
+    in-memory database for a single process.
+    """
+
+    def __init__(self, path, synchronous="NORMAL", busy_timeout_ms=5000):
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        # Autocommit mode: transactions are started explicitly in _transaction
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(f"PRAGMA synchronous = {synchronous}")
+        self._conn.executescript(SCHEMA)
+        for table, columns in MIGRATIONS.items():
+            existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        self._conn.executescript(INDEXES)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs a block in a write transaction, taking the database write lock up front.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Workers
+
+    @staticmethod
+    def _worker_row(row, fields=("worker_id", "url", "status", "last_heartbeat")):
+        worker = {field: row[field] for field in fields}
+        if "last_heartbeat" in worker:
+            worker["last_heartbeat"] = _from_epoch(worker["last_heartbeat"])
+        return worker
+
+    def update_worker(self, worker_id, url, status="active"):
+        self.bulk_update_workers([
+            {"worker_id": worker_id, "url": url, "status": status, "last_heartbeat": time.time()}
+        ])
+
+    def bulk_update_workers(self, worker_records):
+        if not worker_records:
+            return
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO workers (worker_id, url, status, last_heartbeat) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET "
+                "url = excluded.url, status = excluded.status, last_heartbeat = excluded.last_heartbeat",
+                [
+                    (record["worker_id"], record["url"], record["status"], record["last_heartbeat"])
+                    for record in worker_records
+                ]
+            )
+
+    def fetch_workers(self):
+        return [self._worker_row(row) for row in self._query("SELECT * FROM workers")]
+
+    def get_active_workers(self):
+        return [
+            self._worker_row(row, ("worker_id", "url"))
+            for row in self._query("SELECT worker_id, url FROM workers WHERE status = 'active'")
+        ]
+
+    def mark_inactive_workers(self, timeout_seconds):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE workers SET status = 'inactive' WHERE status = 'active' AND last_heartbeat < ?",
+                (time.time() - timeout_seconds,)
+            )
+            return cursor.rowcount
+
+    # Files
+
+    @staticmethod
+    def _write_file(conn, file_doc, insert=False):
+        """
+        Inserts or rewrites a file document and the columns derived from it.
+        """
+        chunks = file_doc.get("chunks") or []
+        packed = bool(file_doc.get("packed"))
+        values = (
+            file_doc.get("status", "active"),
+            file_doc.get("gc_status"),
+            int(packed),
+            chunks[0]["chunk_id"] if packed and chunks else None,
+            int(any(chunk.get("pending_worker_ids") for chunk in chunks)),
+            file_doc.get("partition") or 0,
+            encode_document(file_doc),
+            file_doc["file_id"],
+        )
+        if insert:
+            conn.execute(
+                "INSERT INTO files (status, gc_status, packed, container_id, has_pending, partition, doc, file_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                values
+            )
+        else:
+            conn.execute(
+                "UPDATE files SET status = ?, gc_status = ?, packed = ?, container_id = ?, "
+                "has_pending = ?, partition = ?, doc = ? WHERE file_id = ?",
+                values
+            )
+
+    @staticmethod
+    def _add_usage(conn, file_docs, sign=1):
+        """
+        Updates the usage counters of the owners of inserted (sign 1) or deleted (sign -1) files.
+        """
+        conn.executemany(
+            "INSERT INTO usage (owner, bytes, files, chunks) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (owner) DO UPDATE SET bytes = bytes + excluded.bytes, "
+            "files = files + excluded.files, chunks = chunks + excluded.chunks",
+            [(owner,) + delta for owner, delta in usage_deltas(file_docs, sign).items()]
+        )
+
+    @staticmethod
+    def _read_file(conn, file_id):
+        row = conn.execute("SELECT doc FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return decode_document(row["doc"]) if row else None
+
+    def _find_files(self, where, params=(), limit=None, partition=None):
+        sql = f"SELECT doc FROM files WHERE ({where})"
+        if partition is not None:
+            sql += " AND partition = ?"
+            params = tuple(params) + (partition,)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [decode_document(row["doc"]) for row in self._query(sql, params)]
+
+    def fetch_all_files(self):
+        return self._find_files("1")
+
+    def store_file_metadata(self, file_doc):
+        self.store_files_metadata([file_doc])
+
+    def store_files_metadata(self, file_docs):
+        if not file_docs:
+            return
+        with self._transaction() as conn:
+            for file_doc in file_docs:
+                self._write_file(conn, file_doc, insert=True)
+            self._add_usage(conn, file_docs)
+
+    def fetch_file_metadata(self, file_id):
+        with self._lock:
+            return self._read_file(self._conn, file_id)
+
+    def promote_pending_replica(self, file_id, chunk_id, pending_worker_id, worker_id):
+        with self._transaction() as conn:
+            file_doc = self._read_file(conn, file_id)
+            chunk = next((c for c in (file_doc or {}).get("chunks", []) if c["chunk_id"] == chunk_id), None)
+            if chunk is None:
+                return
+            if "pending_worker_ids" in chunk:
+                chunk["pending_worker_ids"] = [w for w in chunk["pending_worker_ids"] if w != pending_worker_id]
+            worker_ids = chunk.setdefault("worker_ids", [])
+            if worker_id not in worker_ids:
+                worker_ids.append(worker_id)
+            self._write_file(conn, file_doc)
+
+    def fetch_files_with_pending_replicas(self, partition=None):
+        return self._find_files("has_pending = 1 AND status = 'active'", partition=partition)
+
+    def tombstone_file(self, file_id):
+        return bool(self.tombstone_files([file_id]))
+
+    def tombstone_files(self, file_ids):
+        tombstoned = []
+        now = datetime.utcnow()
+        with self._transaction() as conn:
+            for file_id in file_ids:
+                file_doc = self._read_file(conn, file_id)
+                if not file_doc or file_doc.get("status") != "active":
+                    continue
+                file_doc.update(status="deleted", deleted_at=now, gc_status="pending")
+                self._write_file(conn, file_doc)
+                tombstoned.append(file_doc)
+            self._add_usage(conn, tombstoned, sign=-1)
+        return [file_doc["file_id"] for file_doc in tombstoned]
+
+    def fetch_files_pending_gc(self, limit, partition=None):
+        return self._find_files("status = 'deleted' AND gc_status = 'pending'", limit=limit, partition=partition)
+
+    def mark_files_collected(self, file_ids):
+        if not file_ids:
+            return
+        now = datetime.utcnow()
+        with self._transaction() as conn:
+            for file_id in file_ids:
+                file_doc = self._read_file(conn, file_id)
+                if file_doc:
+                    file_doc.update(gc_status="done", collected_at=now)
+                    self._write_file(conn, file_doc)
+
+    def fetch_chunk_placements(self):
+        return self._find_files("status = 'active' OR gc_status = 'pending'")
+
+    def fetch_files_in_container(self, container_id):
+        return self._find_files("container_id = ? AND status = 'active'", (container_id,))
+
+    def relocate_packed_file(self, file_id, old_container_id, new_chunk):
+        with self._transaction() as conn:
+            file_doc = self._read_file(conn, file_id)
+            if not file_doc or file_doc.get("status") != "active":
+                return False
+            if not any(chunk["chunk_id"] == old_container_id for chunk in file_doc.get("chunks", [])):
+                return False
+            file_doc["chunks"] = [new_chunk]
+            self._write_file(conn, file_doc)
+            return True
+
+    # Containers
+
+    @staticmethod
+    def _container_row(row):
+        container = dict(row)
+        container["worker_ids"] = json.loads(container["worker_ids"])
+        for field in ("created_at", "sealed_at", "deleted_at"):
+            if container[field] is None:
+                del container[field]
+            else:
+                container[field] = _from_epoch(container[field])
+        return container
+
+    def create_container(self, container_id, worker_ids, partition=0):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO containers (container_id, worker_ids, partition, status, created_at) "
+                "VALUES (?, ?, ?, 'open', ?)",
+                (container_id, json.dumps(worker_ids), partition, time.time())
+            )
+
+    def record_container_append(self, container_id, end_offset, length):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE containers SET size = MAX(size, ?), live_bytes = live_bytes + ? "
+                "WHERE container_id = ? AND status = 'open'",
+                (end_offset, length, container_id)
+            )
+            return cursor.rowcount > 0
+
+    def release_container_space(self, container_id, length):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE containers SET live_bytes = live_bytes - ? WHERE container_id = ?",
+                (length, container_id)
+            )
+
+    def seal_containers(self, container_ids=None, partition=None):
+        with self._transaction() as conn:
+            if container_ids is None:
+                if partition is None:
+                    conn.execute("UPDATE containers SET status = 'sealed', sealed_at = ? WHERE status = 'open'", (time.time(),))
+                else:
+                    conn.execute(
+                        "UPDATE containers SET status = 'sealed', sealed_at = ? WHERE status = 'open' AND partition = ?",
+                        (time.time(), partition)
+                    )
+                return
+            conn.executemany(
+                "UPDATE containers SET status = 'sealed', sealed_at = ? WHERE status = 'open' AND container_id = ?",
+                [(time.time(), container_id) for container_id in container_ids]
+            )
+
+    def fetch_containers_to_compact(self, max_live_ratio, partition=None):
+        sql = "SELECT * FROM containers WHERE status = 'sealed' AND live_bytes <= size * ?"
+        params = (max_live_ratio,)
+        if partition is not None:
+            sql += " AND partition = ?"
+            params += (partition,)
+        rows = self._query(sql, params)
+        return [self._container_row(row) for row in rows]
+
+    def mark_container_deleted(self, container_id):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE containers SET status = 'deleted', deleted_at = ? WHERE container_id = ?",
+                (time.time(), container_id)
+            )
+
+    def fetch_live_containers(self):
+        rows = self._query("SELECT container_id, worker_ids FROM containers WHERE status != 'deleted'")
+        return [{"container_id": row["container_id"], "worker_ids": json.loads(row["worker_ids"])} for row in rows]
+
+    # Usage
+
+    def fetch_usage(self, owner):
+        rows = self._query("SELECT * FROM usage WHERE owner = ?", (owner,))
+        return dict(rows[0]) if rows else None
+
+    def set_quota(self, owner, quota_bytes, quota_files):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO usage (owner, quota_bytes, quota_files) VALUES (?, ?, ?) "
+                "ON CONFLICT (owner) DO UPDATE SET quota_bytes = excluded.quota_bytes, quota_files = excluded.quota_files",
+                (owner, quota_bytes, quota_files)
+            )
+
+    # Leader lease
+
+    @staticmethod
+    def _lease_row(row):
+        if row is None:
+            return None
+        return {
+            "type": row["type"],
+            "leader": row["leader"],
+            "fencing_token": row["fencing_token"],
+            "lease_expires_at": _from_epoch(row["lease_expires_at"]),
+            "last_updated": _from_epoch(row["last_updated"]),
+        }
+
+    def acquire_leader_lease(self, leader_id, lease_seconds, partition=0):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM metadata WHERE type = ?", (lease_type(partition),)).fetchone()
+            if row is not None and row["leader"] != leader_id and (row["lease_expires_at"] or 0) > now:
+                return None
+            conn.execute(
+                "INSERT INTO metadata (type, leader, fencing_token, lease_expires_at, last_updated) "
+                "VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (type) DO UPDATE SET leader = excluded.leader, "
+                "fencing_token = fencing_token + 1, lease_expires_at = excluded.lease_expires_at, "
+                "last_updated = excluded.last_updated",
+                (lease_type(partition), leader_id, now + lease_seconds, now)
+            )
+            row = conn.execute("SELECT * FROM metadata WHERE type = ?", (lease_type(partition),)).fetchone()
+            return self._lease_row(row)
+
+    def renew_leader_lease(self, leader_id, fencing_token, lease_seconds, partition=0):
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE metadata SET lease_expires_at = ?, last_updated = ? "
+                "WHERE type = ? AND leader = ? AND fencing_token = ?",
+                (now + lease_seconds, now, lease_type(partition), leader_id, fencing_token)
+            )
+            return cursor.rowcount == 1
+
+    def release_leader_lease(self, leader_id, fencing_token, partition=0):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE metadata SET lease_expires_at = ?, last_updated = ? "
+                "WHERE type = ? AND leader = ? AND fencing_token = ?",
+                (now, now, lease_type(partition), leader_id, fencing_token)
+            )
+
+    def fetch_leader_metadata(self, partition=0):
+        rows = self._query("SELECT * FROM metadata WHERE type = ?", (lease_type(partition),))
+        return self._lease_row(rows[0] if rows else None)
@@ -0,0 +1,397 @@
+"""
+Asyncio server for a master node.
+
+Serves the same REST routes as master.py and shares its state (leadership,
+worker liveness, repair queue, background jobs), but the data path runs on
+an event loop: uploads write chunks to workers with aiohttp, several chunks
+at a time, and metadata calls run on the async store's thread pool. A
+request waiting on workers or the database no longer holds a thread, so
+thousands of uploads can be in flight per process.
+
+The control-plane routes (leader announcements, heartbeats, /workers,
+/ring, ...) are quick in-memory operations; they are served by the Flask
+views of master.py through a WSGI bridge.
+
+Usage (from the distributed_file_system directory):
+    python -m master_node.async_master master_1
+"""
+import asyncio
+import functools
+import math
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from database.connection import get_async_metadata_store
+from database.db_operations import store_file_metadata, tombstone_file, fetch_file_metadata
+from master_node import master
+from shared.admission import aiohttp_admission_required
+from shared.async_replication import post_chunk_async, send_chunk_along_chain_async
+from shared.chunk_naming import make_chunk_id
+from shared.chunking import choose_chunk_size, split_ranges
+from shared.fault_injection import aiohttp_fault_middleware
+from shared.metrics import aiohttp_metrics_middleware
+from shared.profiling import add_aiohttp_profiling_routes, aiohttp_profiling_middleware
+from shared.tracing import aiohttp_tracing_middleware, span
+from shared.partitioning import partition_for
+from shared.quotas import aiohttp_quota_required
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 1024 ** 3))  # Largest request body accepted
+UPLOAD_CHUNK_CONCURRENCY = int(os.getenv("UPLOAD_CHUNK_CONCURRENCY", 4))  # Chunks of one upload written at once
+WORKER_CONNECTION_LIMIT = 512  # Open connections to workers across all requests
+
+store = get_async_metadata_store()
+
+# Fanout writes still running after their chunk reached the write quorum
+background_writes = set()
+
+
+def read_response(payload, fresh, status=200):
+    """
+    JSON response of a read-only endpoint, advertising how stale it may be.
+    """
+    staleness = '0' if fresh else str(master.METADATA_MAX_STALENESS)
+    return web.json_response(payload, status=status, headers={'X-Metadata-Max-Staleness': staleness})
+
+
+def plan_chunks(file_id, file_size, chunk_size_hint=None, replication_factor=3):
+    """
+    Choose the chunk size and the replica workers of every chunk (blocking:
+    may read worker membership from the metadata store).
+
+    Returns:
+        tuple: ([(chunk_id, start, end, assigned_workers)], chunk_size, {worker_id: url})
+    """
+    active_workers_info = master.get_placement_workers(replication_factor)
+    active_workers = [worker['worker_id'] for worker in active_workers_info]
+    worker_urls = {worker['worker_id']: worker['url'] for worker in active_workers_info}
+    if len(active_workers) < replication_factor:
+        raise Exception("Not enough active workers to replicate chunks")
+
+    chunk_size = choose_chunk_size(file_size, len(active_workers), hint_mb=chunk_size_hint)
+    plan = []
+    for i, (start_index, end_index) in enumerate(split_ranges(file_size, chunk_size)):
+        chunk_id = make_chunk_id(file_id, i)
+        plan.append((chunk_id, start_index, end_index,
+                     master.choose_replica_workers(chunk_id, active_workers, replication_factor)))
+    return plan, chunk_size, worker_urls
+
+
+async def store_chunk_replicas(session, chunk_id, chunk_data, assigned_workers, worker_urls, partition):
+    """
+    Asyncio version of master.store_chunk_replicas: write a chunk to its
+    assigned workers until the write quorum is durable.
+
+    Returns:
+        list: IDs of the workers that durably stored the chunk.
+    """
+    quorum = min(master.WRITE_QUORUM, len(assigned_workers))
+    headers = master.leader_headers(partition=partition)
+    started = time.perf_counter()
+    with span("chunk.store", chunk_id=chunk_id, size=len(chunk_data), workers=assigned_workers,
+              mode=master.REPLICATION_MODE) as store_span:
+        durable_workers = await write_replicas(session, chunk_id, chunk_data, assigned_workers, worker_urls, quorum, headers)
+        store_span.set('durable_workers', durable_workers)
+
+    master.record_replica_write(started, assigned_workers, durable_workers)
+    if len(durable_workers) < quorum:
+        raise Exception(
+            f"Failed to store chunk {chunk_id}: only {len(durable_workers)} of {quorum} required replicas are durable"
+        )
+    return durable_workers
+
+
+async def write_replicas(session, chunk_id, chunk_data, assigned_workers, worker_urls, quorum, headers):
+    """
+    Send a chunk down its replica chain, or to every replica in parallel
+    (fanout), until `quorum` replicas acknowledged it. Like the Flask master,
+    chain writes that fall short of the quorum are completed directly.
+
+    Returns:
+        list: IDs of the workers that durably stored the chunk.
+    """
+    if master.REPLICATION_MODE == "chain":
+        chain_urls = [worker_urls[worker_id] for worker_id in assigned_workers]
+        try:
+            stored_on = await send_chunk_along_chain_async(session, chunk_id, chunk_data, chain_urls, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            master.chunk_log.warning("chunk.store_failed", "Failed to store chunk %s on chain %s: %s", chunk_id,
+                                     assigned_workers, e, chunk_id=chunk_id)
+            stored_on = []
+        durable_workers = [worker_id for worker_id in assigned_workers if worker_id in stored_on]
+        if len(durable_workers) < quorum:
+            missing = [worker_id for worker_id in assigned_workers if worker_id not in durable_workers]
+            durable_workers += await write_replicas_directly(
+                session, chunk_id, chunk_data, missing, worker_urls, quorum - len(durable_workers), headers
+            )
+        return durable_workers
+    return await write_replicas_directly(session, chunk_id, chunk_data, assigned_workers, worker_urls, quorum, headers)
+
+
+async def write_replicas_directly(session, chunk_id, chunk_data, worker_ids, worker_urls, quorum, headers):
+    """
+    Send a chunk to every given worker in parallel until `quorum` of them
+    acknowledged it (or all of them answered).
+
+    Returns:
+        list: IDs of the workers that durably stored the chunk.
+    """
+    writes = {
+        asyncio.ensure_future(post_chunk_async(session, worker_urls[worker_id], chunk_id, chunk_data, headers)): worker_id
+        for worker_id in worker_ids
+    }
+    durable_workers = []
+    pending = set(writes)
+    while pending and len(durable_workers) < quorum:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for write in done:
+            if write.exception() is None:
+                durable_workers.append(writes[write])
+            else:
+                master.chunk_log.warning("chunk.store_failed", "Failed to store chunk %s on worker %s: %s", chunk_id,
+                                         writes[write], write.exception(), chunk_id=chunk_id,
+                                         worker_id=writes[write])
+    # The remaining writes finish in the background; the repair queue completes them
+    for write in pending:
+        background_writes.add(write)
+        write.add_done_callback(background_writes.discard)
+    return durable_workers
+
+
+async def divide_file_into_chunks(session, file_data, file_id, chunk_size_hint, partition):
+    """
+    Asyncio version of master.divide_file_into_chunks. Up to
+    UPLOAD_CHUNK_CONCURRENCY chunks of the file are written at once.
+
+    Returns:
+        tuple: (chunks_info, chunk_size) where chunk_size is in bytes.
+    """
+    plan, chunk_size, worker_urls = await store.run(plan_chunks, file_id, len(file_data), chunk_size_hint)
+    limit = asyncio.Semaphore(UPLOAD_CHUNK_CONCURRENCY)
+
+    async def write_chunk(chunk_id, start_index, end_index, assigned_workers):
+        chunk_data = file_data[start_index:end_index]
+        async with limit:
+            durable_workers = await store_chunk_replicas(
+                session, chunk_id, chunk_data, assigned_workers, worker_urls, partition
+            )
+        return {
+            'chunk_id': chunk_id,
+            'size': len(chunk_data),
+            'worker_ids': durable_workers,
+            'pending_worker_ids': [worker_id for worker_id in assigned_workers if worker_id not in durable_workers]
+        }
+
+    writes = [asyncio.ensure_future(write_chunk(*chunk)) for chunk in plan]
+    try:
+        chunks_info = await asyncio.gather(*writes)
+    except BaseException:
+        # The upload fails (or was cancelled) as a whole: stop writing its other chunks. Chunks already
+        # written are left for reconcile_worker_inventories to purge
+        for write in writes:
+            write.cancel()
+        await asyncio.gather(*writes, return_exceptions=True)
+        raise
+    return list(chunks_info), chunk_size
+
+
+def upload_leader_required(handler):
+    """
+    Like master.upload_leader_required, for an aiohttp handler: the upload's
+    file ID and partition are stored in `request['file_id']` and `request['partition']`.
+    """
+    @functools.wraps(handler)
+    async def led(request):
+        file_id, partition, error = master.upload_partition(request.query.get('file_id'))
+        if error:
+            message, status = error
+            return web.json_response({'error': message}, status=status)
+        request['file_id'], request['partition'] = file_id, partition
+        return await handler(request)
+    return led
+
+
+@upload_leader_required
+@aiohttp_admission_required
+@aiohttp_quota_required(master.quotas, run=store.run)
+async def upload_file(request):
+    """
+    Handle file uploads from the gateway, on behalf of their owner (X-Owner).
+    """
+    file_id, partition = request['file_id'], request['partition']
+    if request.query.get('file_id') and await store.run(fetch_file_metadata, file_id):
+        return web.json_response({'error': f'File {file_id} already exists'}, status=409)
+
+    form = await request.post()
+
+    file = form.get('file')
+    if not isinstance(file, web.FileField):
+        return web.json_response({'error': 'No file provided'}, status=400)
+
+    file_name = file.filename
+    file_data = file.file.read()
+    file_size = len(file_data)
+    chunk_size_hint = form.get('chunk_size_mb')  # Optional client hint
+    if chunk_size_hint:
+        try:
+            chunk_size_mb = float(chunk_size_hint)
+            if not math.isfinite(chunk_size_mb) or chunk_size_mb <= 0:
+                raise ValueError
+        except ValueError:
+            return web.json_response({'error': 'chunk_size_mb must be a positive number'}, status=400)
+
+    try:
+        chunks_info = None
+        chunk_size = None
+        if master.PACK_SMALL_FILES and 0 < file_size <= master.PACK_THRESHOLD:
+            try:
+                chunks_info = [await store.run(master.pack_small_file, file_data, partition)]
+            except Exception as e:
+                master.log.warning(f"Packing {file_id} failed, storing it as regular chunks: {e}")
+        packed = chunks_info is not None
+        if not packed:
+            chunks_info, chunk_size = await divide_file_into_chunks(
+                request.app['session'], file_data, file_id, chunk_size_hint, partition
+            )
+        await store.run(
+            store_file_metadata,
+            file_id=file_id,
+            file_name=file_name,
+            size=file_size,
+            chunks=chunks_info,
+            packed=packed,
+            chunk_size=chunk_size,
+            partition=partition,
+            owner=request['owner']
+        )
+        # Complete the replicas that were not durable when the quorum was reached
+        pending_replicas = 0
+        for chunk in chunks_info:
+            for worker_id in chunk['pending_worker_ids']:
+                master.enqueue_repair(file_id, chunk['chunk_id'], worker_id)
+                pending_replicas += 1
+        return web.json_response({
+            'message': f'File {file_name} uploaded successfully',
+            'file_id': file_id,
+            'pending_replicas': pending_replicas
+        })
+    except Exception as e:
+        return web.json_response({'error': f'Failed to upload file: {str(e)}'}, status=500)
+
+
+async def delete_file(request):
+    """
+    Handle file deletion requests (see master.delete_file).
+    """
+    file_id = request.match_info['file_id']
+    partition = partition_for(file_id)
+    if not master.is_leader(partition):
+        return web.json_response({'error': f'This node is not the leader of partition {partition}'}, status=403)
+
+    if not await store.run(tombstone_file, file_id) and not await store.run(fetch_file_metadata, file_id):
+        return web.json_response({'error': 'File not found'}, status=404)
+    return web.json_response({'message': f'File {file_id} deleted successfully'})
+
+
+async def get_file_info(request):
+    """
+    Return a file's metadata. Served by any master.
+    """
+    file_id = request.match_info['file_id']
+    file_metadata = await store.run(master.read_file_metadata, file_id)
+    if not file_metadata:
+        return web.json_response({'error': 'File not found'}, status=404)
+    return read_response(master.serialize_file(file_metadata), fresh=master.is_leader(partition_for(file_id)))
+
+
+def locate_chunk(file_id, chunk_id):
+    """
+    Blocking part of get_chunk_worker_url: find an active worker holding a chunk.
+
+    Returns:
+        tuple: (location, error, status)
+    """
+    file_metadata = master.read_file_metadata(file_id)
+    if not file_metadata:
+        return None, 'File not found', 404
+    chunk = next((c for c in file_metadata['chunks'] if c['chunk_id'] == chunk_id), None)
+    if not chunk:
+        return None, 'Chunk not found', 404
+
+    active_workers = {worker['worker_id']: worker['url'] for worker in master.get_live_workers()}
+    for worker_id in master.order_by_suspicion(chunk['worker_ids']):
+        if worker_id in active_workers:
+            location = {'worker_url': f"{active_workers[worker_id]}/chunks/{chunk_id}"}
+            if 'offset' in chunk:
+                # Packed file: the caller reads this range of the container
+                location.update({'offset': chunk['offset'], 'size': chunk['size']})
+            return location, None, 200
+    return None, 'No active worker has this chunk', 500
+
+
+async def get_chunk_worker_url(request):
+    """
+    Return the URL of a worker that has the requested chunk. Served by any master.
+    """
+    file_id = request.match_info['file_id']
+    location, error, status = await store.run(locate_chunk, file_id, request.match_info['chunk_id'])
+    if error:
+        return web.json_response({'error': error}, status=status)
+    return read_response(location, fresh=master.is_leader(partition_for(file_id)))
+
+
+async def wsgi_bridge(request):
+    """
+    Serve a request with the Flask views of master.py, on the store's thread pool.
+    """
+    body = await request.read()
+    environ = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        query_string=request.query_string,
+        headers=list(request.headers.items()),
+        data=body
+    ).get_environ()
+
+    def call_flask():
+        app_iter, status, headers = run_wsgi_app(master.app, environ, buffered=True)
+        return int(status.split()[0]), headers, b"".join(app_iter)
+
+    status, headers, payload = await store.run(call_flask)
+    response_headers = {key: value for key, value in headers.items() if key.lower() != 'content-length'}
+    return web.Response(body=payload, status=status, headers=response_headers)
+
+
+async def open_session(app):
+    app['session'] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=WORKER_CONNECTION_LIMIT))
+
+
+async def close_session(app):
+    await app['session'].close()
+
+
+def create_app():
+    # Requests bridged to master.app are recorded, traced, faulted and profiled by its own hooks
+    app = web.Application(client_max_size=MAX_UPLOAD_BYTES, middlewares=[
+        aiohttp_metrics_middleware(skip=(wsgi_bridge,)),
+        aiohttp_tracing_middleware(skip=(wsgi_bridge,)),
+        aiohttp_fault_middleware(skip=(wsgi_bridge,)),
+        aiohttp_profiling_middleware(skip=(wsgi_bridge,)),
+    ])
+    app.router.add_post('/upload_file', upload_file)
+    app.router.add_delete('/files/{file_id}', delete_file)
+    app.router.add_get('/files/{file_id}', get_file_info)
+    app.router.add_get('/chunks/{file_id}/{chunk_id}', get_chunk_worker_url)
+    add_aiohttp_profiling_routes(app)  # Served on the event loop, so "cprofile" windows profile it
+    app.router.add_route('*', '/{tail:.*}', wsgi_bridge)  # Every other route of master.py
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+    return app
+
+
+if __name__ == '__main__':
+    master.start_background_tasks()
+    web.run_app(create_app(), host='0.0.0.0', port=master.PORT)
@@ -0,0 +1,38 @@
+import time
+
+
+class PartitionLeadership:
+    """
+    Leadership of one metadata partition as seen by this master.
+
+    Each partition has its own leader lease and fencing token sequence; a
+    master may lead several partitions, one, or none.
+    """
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.leader = None  # Leader of the partition, as last observed
+        self.fencing_token = None  # Fencing token of our lease while we lead the partition
+        self.lease_valid_until = 0.0  # Monotonic time at which our lease must be considered expired
+        self.highest_token_seen = 0  # Highest fencing token announced by any leader of the partition
+        self.lease_expired_since = None  # Monotonic time since which no valid lease was observed
+        self.next_handoff_check = 0.0  # Monotonic time of the next check whether to hand the partition back
+
+    def is_held_by(self, node_id):
+        """
+        Returns True if `node_id` leads the partition and, for our own lease,
+        it has not run out.
+        """
+        return self.leader == node_id and time.monotonic() < self.lease_valid_until
+
+    def take(self, node_id, fencing_token, valid_until):
+        self.leader = node_id
+        self.fencing_token = fencing_token
+        self.highest_token_seen = max(self.highest_token_seen, fencing_token)
+        self.lease_valid_until = valid_until
+        self.lease_expired_since = None
+
+    def release(self):
+        self.leader = None
+        self.fencing_token = None
+        self.lease_valid_until = 0.0
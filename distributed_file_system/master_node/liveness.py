@@ -0,0 +1,212 @@
+import math
+import threading
+import time
+from collections import deque
+from datetime import timezone
+
+
+class PhiAccrualDetector:
+    """
+    Phi accrual failure detector for one heartbeat source.
+
+    Keeps a sliding window of heartbeat inter-arrival times and reports how
+    unlikely the current silence is under a normal distribution fitted to it:
+    phi = -log10(P(next heartbeat arrives later than now)). A phi of 1 means a
+    10% chance the source is still alive, 3 means 0.1%, and so on, so the
+    threshold adapts to each worker's own heartbeat jitter.
+    """
+
+    def __init__(self, expected_interval, window_size=100, min_std_deviation=1.0, acceptable_pause=0.5):
+        self.min_std_deviation = min_std_deviation
+        self.acceptable_pause = acceptable_pause
+        self.last_heartbeat = None
+        self._intervals = deque(maxlen=window_size)
+        # Bootstrap with the expected interval so a new source is not suspected immediately
+        self._intervals.extend([expected_interval - expected_interval / 4, expected_interval + expected_interval / 4])
+
+    def heartbeat(self, now):
+        if self.last_heartbeat is not None and now > self.last_heartbeat:
+            self._intervals.append(now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def phi(self, now):
+        if self.last_heartbeat is None:
+            return 0.0
+
+        count = len(self._intervals)
+        mean = sum(self._intervals) / count
+        variance = sum((interval - mean) ** 2 for interval in self._intervals) / count
+        std_deviation = max(math.sqrt(variance), self.min_std_deviation)
+
+        elapsed = now - self.last_heartbeat
+        y = (elapsed - mean - self.acceptable_pause) / std_deviation
+        # Logistic approximation of the normal CDF tail, as used by Cassandra and Akka
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if elapsed > mean + self.acceptable_pause:
+            if e == 0.0:
+                return math.inf  # So long overdue that the tail probability underflows
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+
+class WorkerLivenessTable:
+    """
+    In-memory view of worker liveness kept by the leader.
+
+    Heartbeats and status changes only touch memory; the records that changed
+    since the last flush are handed out by `drain_dirty` so they can be written
+    to the database in a single bulk write.
+
+    Each worker also has a phi accrual detector. Workers whose phi reaches
+    `suspect_threshold` are suspected: still active, but avoided for new
+    placements and tried last for reads. Reaching `inactive_threshold`, or
+    the hard timeout, marks them inactive.
+    """
+
+    def __init__(self, timeout_seconds, heartbeat_interval=5, suspect_threshold=3.0, inactive_threshold=8.0):
+        self.timeout_seconds = timeout_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.suspect_threshold = suspect_threshold
+        self.inactive_threshold = inactive_threshold
+        self.seeded = False
+        self._lock = threading.Lock()
+        self._workers = {}  # worker_id -> {'url', 'status', 'last_heartbeat'}
+        self._detectors = {}  # worker_id -> PhiAccrualDetector
+        self._dirty = set()
+
+    def _detector(self, worker_id):
+        detector = self._detectors.get(worker_id)
+        if detector is None:
+            detector = self._detectors[worker_id] = PhiAccrualDetector(self.heartbeat_interval)
+        return detector
+
+    def seed(self, worker_records):
+        """
+        Loads the last persisted state of the workers, e.g. after becoming leader.
+
+        Records already updated by heartbeats since are left untouched.
+        """
+        with self._lock:
+            for record in worker_records:
+                worker_id = record['worker_id']
+                if worker_id in self._workers:
+                    continue
+                # Persisted heartbeats are naive UTC datetimes
+                last_heartbeat = record.get('last_heartbeat')
+                self._workers[worker_id] = {
+                    'url': record.get('url'),
+                    'status': record.get('status', 'inactive'),
+                    'last_heartbeat': last_heartbeat.replace(tzinfo=timezone.utc).timestamp() if last_heartbeat else 0,
+                }
+                if last_heartbeat:
+                    self._detector(worker_id).heartbeat(self._workers[worker_id]['last_heartbeat'])
+            self.seeded = True
+
+    def reset(self):
+        """
+        Forgets all workers, e.g. after losing leadership.
+        """
+        with self._lock:
+            self._workers.clear()
+            self._detectors.clear()
+            self._dirty.clear()
+            self.seeded = False
+
+    def record_heartbeat(self, worker_id, url, now=None):
+        """
+        Records a heartbeat and marks the worker active.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._workers[worker_id] = {'url': url, 'status': 'active', 'last_heartbeat': now}
+            self._detector(worker_id).heartbeat(now)
+            self._dirty.add(worker_id)
+
+    def suspicion(self, worker_id, now=None):
+        """
+        Returns the phi suspicion level of a worker (0 if unknown).
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            detector = self._detectors.get(worker_id)
+            return detector.phi(now) if detector else 0.0
+
+    def is_suspected(self, worker_id, now=None):
+        return self.suspicion(worker_id, now) >= self.suspect_threshold
+
+    def mark_inactive(self, now=None):
+        """
+        Marks workers inactive if their phi reached the inactive threshold or
+        their last heartbeat is older than the timeout.
+
+        Returns:
+            list: IDs of the workers that just became inactive.
+        """
+        now = now if now is not None else time.time()
+        threshold = now - self.timeout_seconds
+        newly_inactive = []
+        with self._lock:
+            for worker_id, worker in self._workers.items():
+                if worker['status'] != 'active':
+                    continue
+                detector = self._detectors.get(worker_id)
+                phi = detector.phi(now) if detector else 0.0
+                if worker['last_heartbeat'] < threshold or phi >= self.inactive_threshold:
+                    worker['status'] = 'inactive'
+                    self._dirty.add(worker_id)
+                    newly_inactive.append(worker_id)
+        return newly_inactive
+
+    def active_workers(self, exclude_suspected=False, now=None):
+        """
+        Returns the active workers in the same shape as `get_active_workers`,
+        optionally leaving out suspected ones.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            return [
+                {'worker_id': worker_id, 'url': worker['url']}
+                for worker_id, worker in self._workers.items()
+                if worker['status'] == 'active' and not (
+                    exclude_suspected
+                    and worker_id in self._detectors
+                    and self._detectors[worker_id].phi(now) >= self.suspect_threshold
+                )
+            ]
+
+    def snapshot(self, now=None):
+        """
+        Returns every known worker with its status and suspicion level.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            return [
+                {
+                    'worker_id': worker_id,
+                    'url': worker['url'],
+                    'status': worker['status'],
+                    'seconds_since_heartbeat': round(now - worker['last_heartbeat'], 3),
+                    'phi': round(self._detectors[worker_id].phi(now), 3) if worker_id in self._detectors else 0.0,
+                }
+                for worker_id, worker in self._workers.items()
+            ]
+
+    def drain_dirty(self):
+        """
+        Returns the records changed since the last call and clears the dirty set.
+        """
+        with self._lock:
+            records = [
+                dict(self._workers[worker_id], worker_id=worker_id)
+                for worker_id in self._dirty
+                if worker_id in self._workers
+            ]
+            self._dirty.clear()
+        return records
+
+    def mark_dirty(self, worker_ids):
+        """
+        Flags records for the next flush again, e.g. after a failed write.
+        """
+        with self._lock:
+            self._dirty.update(worker_id for worker_id in worker_ids if worker_id in self._workers)
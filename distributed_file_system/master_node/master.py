@@ -1,29 +1,71 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from datetime import datetime
+import functools
 import threading
 import json
+import math
 import uuid
 import time
 import requests
 import sys
-import random
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from database.connection import get_database
 from database.db_operations import (
-    get_metadata_collection,
-    mark_inactive_workers,
     store_file_metadata,
     fetch_file_metadata,
-    update_leader_metadata,
+    fetch_all_files,
+    acquire_leader_lease,
+    renew_leader_lease,
+    release_leader_lease,
     fetch_leader_metadata,
     get_active_workers,
-    update_worker
+    update_worker,
+    bulk_update_workers,
+    fetch_workers,
+    promote_pending_replica,
+    fetch_files_with_pending_replicas,
+    tombstone_file,
+    fetch_files_pending_gc,
+    mark_files_collected,
+    fetch_chunk_placements,
+    create_container,
+    record_container_append,
+    release_container_space,
+    seal_containers,
+    fetch_containers_to_compact,
+    mark_container_deleted,
+    fetch_live_containers,
+    fetch_files_in_container,
+    relocate_packed_file,
+    fetch_usage,
+    set_quota
 )
+from master_node.liveness import WorkerLivenessTable
+from master_node.leadership import PartitionLeadership
+from shared.replication import send_chunk_along_chain, OFFSET_HEADER
+from shared.fencing import FENCING_HEADER, FENCING_PARTITION_HEADER
+from shared.ttl_cache import TTLCache
+from shared.chunk_naming import make_chunk_id, make_container_id
+from shared.chunking import choose_chunk_size, split_ranges
+from shared.partitioning import METADATA_PARTITIONS, CLUSTER_PARTITION, partition_for, partition_priority
+from shared.placement import PLACEMENT_MODE, PLACEMENT_VNODES, PLACEMENT_WEIGHTS, build_worker_ring, hash_placement, random_placement
+from shared.metrics import counter, histogram, instrument_flask_app
+from shared.tracing import in_current_trace, inject, span, start_trace, trace_flask_app
+from shared.fault_injection import faults, fault_inject_flask_app
+from shared.profiling import profile_flask_app
+from shared.logs import RateLimitedLogger, configure_logging
+from shared.io_scheduler import BACKGROUND, io_priority_headers, set_io_priority
+from shared.admission import admission_required
+from shared.admin import admin_required
+from shared.quotas import QuotaReservations, check_owner, effective_quotas, quota_required
 
 app = Flask(__name__)
+instrument_flask_app(app)  # Request metrics and GET /metrics
 
-# Load Configuration from `config.json`
-with open("config.json", "r") as config_file:
+# Load Configuration from `config.json` (DFS_CONFIG overrides the path, e.g. for local test clusters)
+with open(os.getenv("DFS_CONFIG", "config.json"), "r") as config_file:
     config = json.load(config_file)
 
 # Get Master Node ID from Command-Line Argument
@@ -37,44 +79,146 @@ if MASTER_NODE_ID not in config:
     print(f"Error: {MASTER_NODE_ID} not found in config.json")
     sys.exit(1)
 
+log = configure_logging(MASTER_NODE_ID)  # One-line JSON records, written by a background thread
+chunk_log = RateLimitedLogger(log)  # For events logged per chunk
+trace_flask_app(app, MASTER_NODE_ID)  # Spans of traced requests and GET /traces
+fault_inject_flask_app(app)  # Faults injected for testing, configured on /admin/faults
+profile_flask_app(app)  # On-demand profiling on /admin/profile and /admin/memory
+
 IP = config[MASTER_NODE_ID]["ip"]
 PORT = config[MASTER_NODE_ID]["port"]
 BACKUP_MASTERS = [node for node in config.keys() if node != MASTER_NODE_ID]  # Exclude self
 
-HEARTBEAT_INTERVAL = 5  # Seconds to check if current leader is alive
-LEADER_CHECK_INTERVAL = 10  # How often to sync the leader from MongoDB
+HEARTBEAT_INTERVAL = 1  # Seconds between leader lease checks (renewal on the leader, expiry on followers)
+LEASE_DURATION = float(os.getenv("LEASE_DURATION", 5))  # Seconds a leader lease stays valid without renewal
+ELECTION_PROBE_TIMEOUT = 0.5  # Timeout of the parallel alive probes sent during an election
+HANDOFF_CHECK_INTERVAL = 10  # How often a leader checks whether a partition's preferred master is back
+HANDOFF_BACKOFF = 120  # Minimum time between two handoffs of the same partition, to avoid flapping
 HEARTBEAT_TIMEOUT = 15  # Workers are considered inactive if no heartbeat for 15 seconds
-WORKER_CHECK_INTERVAL = 5  # How often to check for inactive workers
-current_leader = None  # Track the current leader dynamically
+WORKER_CHECK_INTERVAL = 1  # How often to check for inactive workers (in memory on the leader)
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", 5))  # How often heartbeats are persisted
+WORKER_HEARTBEAT_INTERVAL = 5  # Expected interval between heartbeats of a worker
+PHI_SUSPECT_THRESHOLD = float(os.getenv("PHI_SUSPECT_THRESHOLD", 3))  # Suspected workers get no new placements
+PHI_INACTIVE_THRESHOLD = float(os.getenv("PHI_INACTIVE_THRESHOLD", 8))  # Workers are marked inactive at this phi
+REPLICATION_MODE = os.getenv("REPLICATION_MODE", "chain")  # "chain" (pipelined through workers) or "fanout"
+WRITE_QUORUM = int(os.getenv("WRITE_QUORUM", 2))  # Replicas that must be durable before an upload is acknowledged
+REPAIR_RETRY_DELAY = 10  # Seconds before retrying a failed replica repair
+REPAIR_SCAN_INTERVAL = 60  # How often the leader rescans metadata for pending replicas
+GC_INTERVAL = 10  # How often the leader deletes the chunks of deleted files
+GC_FILES_PER_CYCLE = 500  # Deleted files collected per GC cycle
+GC_BATCH_SIZE = 1000  # Chunk IDs per bulk delete request
+GC_RECONCILE_INTERVAL = 600  # How often worker inventories are checked for orphaned chunks
+GC_ORPHAN_GRACE_PERIOD = 3600  # Minimum age in seconds before an unreferenced chunk is purged
+PACK_SMALL_FILES = os.getenv("PACK_SMALL_FILES", "false").lower() == "true"  # Pack small files into container chunks
+PACK_THRESHOLD = int(os.getenv("PACK_THRESHOLD_BYTES", 1024 * 1024))  # Files up to this size are packed
+CONTAINER_MAX_SIZE = int(os.getenv("CONTAINER_MAX_SIZE_BYTES", 64 * 1024 * 1024))  # Containers are sealed at this size
+COMPACTION_INTERVAL = 300  # How often sealed containers are checked for compaction
+COMPACTION_LIVE_RATIO = 0.5  # Containers with at most this fraction of live bytes are rewritten
+METADATA_MAX_STALENESS = float(os.getenv("METADATA_MAX_STALENESS", 2))  # Seconds followers may serve cached metadata
+
+# Hot path metrics served on /metrics, next to the request metrics of every route
+REPLICA_WRITE_SECONDS = histogram('dfs_replica_write_seconds', 'Time to write a chunk to its write quorum, by replication mode', ('mode',))
+REPLICA_WRITES = counter('dfs_replica_writes', 'Chunk replica writes, by outcome', ('outcome',))
+HEARTBEATS_RECEIVED = counter('dfs_heartbeats_received', 'Worker heartbeats received')
+
+# Leadership of each metadata partition (files are assigned to partitions by consistent hashing)
+leadership = {partition: PartitionLeadership(partition) for partition in range(METADATA_PARTITIONS)}
+
+# Replicas left to complete after an upload was acknowledged: (file_id, chunk_id, worker_id)
+repair_queue = queue.Queue()
+queued_repairs = set()
+queued_repairs_lock = threading.Lock()
+
+# Worker liveness absorbed from heartbeats on the leader, persisted in batches
+liveness = WorkerLivenessTable(
+    HEARTBEAT_TIMEOUT,
+    heartbeat_interval=WORKER_HEARTBEAT_INTERVAL,
+    suspect_threshold=PHI_SUSPECT_THRESHOLD,
+    inactive_threshold=PHI_INACTIVE_THRESHOLD
+)
+
+# Shared pool for fanout replica writes
+replica_executor = ThreadPoolExecutor(max_workers=16)
+
+# Pool for parallel bulk deletes and inventory requests during garbage collection
+gc_executor = ThreadPoolExecutor(max_workers=8)
+
+# Metadata read by followers, served for at most METADATA_MAX_STALENESS seconds
+metadata_cache = TTLCache(METADATA_MAX_STALENESS)
+
+# Pool for parallel election probes and leader announcements
+election_executor = ThreadPoolExecutor(max_workers=max(1, len(BACKUP_MASTERS)))
 
-db = get_database()
+# Uploads in progress, counted against their owner's quotas until their file is committed
+quotas = QuotaReservations(fetch_usage)
+
+# Containers that small files are currently appended to, per led partition
+open_containers = {}
+open_container_lock = threading.Lock()
+
+# Consistent hash ring over every known worker, rebuilt when membership changes (PLACEMENT_MODE=hash)
+worker_ring = None
+worker_ring_lock = threading.Lock()
+
+def is_leader(partition=CLUSTER_PARTITION):
+    """
+    Return True if this node leads a metadata partition and its lease has not
+    run out. Without a partition, checks partition 0, whose leader also runs
+    the cluster-wide jobs.
+
+    The lease is checked against the local monotonic clock, so a leader that
+    cannot renew (e.g. cut off from the metadata store) stops acting as leader before
+    another master can acquire the lease.
+    """
+    return leadership[partition].is_held_by(MASTER_NODE_ID)
+
+def led_partitions():
+    """
+    Return the metadata partitions this node currently leads.
+    """
+    return [partition for partition in leadership if is_leader(partition)]
 
-def announce_leader():
+def leader_headers(headers=None, partition=CLUSTER_PARTITION):
     """
-    Notify other master nodes about the newly elected leader.
-    Write the leader to MongoDB.
+    Return headers for a mutating request to a worker, including our fencing
+    token for the partition the request is made on behalf of, and the I/O
+    priority of the calling thread.
     """
-    global current_leader
+    result = io_priority_headers(headers)
+    token = leadership[partition].fencing_token
+    if token is not None:
+        result[FENCING_HEADER] = str(token)
+        result[FENCING_PARTITION_HEADER] = str(partition)
+    return result
 
-    # Persist leader information in MongoDB
-    update_leader_metadata(current_leader)
+def announce_leader(partition=CLUSTER_PARTITION):
+    """
+    Notify other master nodes about the newly elected leader of a partition, in parallel.
+    The lease in the metadata store is the source of truth; announcements only speed up
+    failover on the other masters.
+    """
+    state = leadership[partition]
 
-    # Notify all other masters
-    for node in BACKUP_MASTERS:
+    @in_current_trace
+    def announce(node):
         node_ip = config[node]["ip"]
         node_port = config[node]["port"]
         try:
-            response = requests.post(
-                f"http://{node_ip}:{node_port}/leader",
-                json={'leader': current_leader},
-                timeout=2
-            )
+            with span("election.announce", node=node, partition=partition):
+                response = requests.post(
+                    f"http://{node_ip}:{node_port}/leader",
+                    json={'leader': state.leader, 'fencing_token': state.fencing_token, 'partition': partition},
+                    headers=inject(),
+                    timeout=2
+                )
             if response.status_code == 200:
-                print(f"{MASTER_NODE_ID}: Successfully announced leader to {node}")
+                log.info(f"Successfully announced leader of partition {partition} to {node}")
             else:
-                print(f"{MASTER_NODE_ID}: Failed to announce leader to {node}")
+                log.warning(f"Failed to announce leader of partition {partition} to {node}")
         except requests.exceptions.RequestException as e:
-            print(f"{MASTER_NODE_ID}: Error announcing leader to {node}: {e}")
+            log.warning(f"Error announcing leader to {node}: {e}")
+
+    list(election_executor.map(announce, BACKUP_MASTERS))
 
 
 @app.route('/health',methods = ['GET'])
@@ -85,117 +229,241 @@ def health():
 def leader_announcement():
     """
     Handle leader announcements from other masters.
+    Announcements carrying an older fencing token than one already seen for
+    the partition are rejected.
     """
-    global current_leader
     data = request.get_json()
     leader = data.get('leader')
+    token = data.get('fencing_token')
+    partition = data.get('partition', CLUSTER_PARTITION)
+    state = leadership.get(partition)
+
+    if state is None:
+        return jsonify({'error': f'Unknown metadata partition {partition}'}), 400
+    if not isinstance(token, int) or token < state.highest_token_seen:
+        log.warning(f"Rejected stale leader announcement from {leader} (token {token})")
+        return jsonify({'error': 'Stale fencing token'}), 409
+
+    state.highest_token_seen = token
+    if leader != MASTER_NODE_ID and state.leader == MASTER_NODE_ID:
+        step_down(partition, "another master holds a newer lease")
 
     # Update the leader in the local state
-    current_leader = leader
-    print(f"{MASTER_NODE_ID}: New leader acknowledged: {current_leader}")
+    state.leader = leader
+    log.info(f"New leader of partition {partition} acknowledged: {leader}")
     return jsonify({'status': 'ok'}), 200
 
-def start_election():
+def probe_alive(node):
     """
-    Bully Algorithm for leader election.
+    Return True if a master answers the alive check.
+    """
+    node_ip = config[node]["ip"]
+    node_port = config[node]["port"]
+    try:
+        with span("election.probe", node=node):
+            response = requests.get(f"http://{node_ip}:{node_port}/alive", headers=inject(), timeout=ELECTION_PROBE_TIMEOUT)
+        return response.status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+def start_election(partition=CLUSTER_PARTITION, force=False):
+    """
+    Bully Algorithm for leader election of a partition.
+
+    Masters ranked higher for this partition are probed in parallel. If none
+    is alive (or `force` is set because they failed to take the lease in
+    time), this node tries to acquire the partition's lease. The ranking is
+    rotated per partition, so partition leadership spreads across masters.
+
+    Every election is traced; GET /traces lists it with its trace ID.
     """
-    global current_leader
     candidate_id = MASTER_NODE_ID
-    higher_nodes = [node for node in config.keys() if node > candidate_id]
+    ranking = partition_priority(config.keys(), partition)
+    higher_nodes = ranking[ranking.index(candidate_id) + 1:]
 
-    print(f"{candidate_id} starting election.")
+    with start_trace("election", root=True, sample_rate=1, partition=partition, force=force) as election:
+        log.info(f"Starting election for partition {partition}", extra={"partition": partition})
 
-    # Send election message to all higher-priority nodes
-    higher_nodes_alive = []
-    for node in higher_nodes:
-        node_ip = config[node]["ip"]
-        node_port = config[node]["port"]
-        try:
-            response = requests.get(f"http://{node_ip}:{node_port}/alive", timeout=2)
-            if response.status_code == 200:
-                higher_nodes_alive.append(node)
-        except requests.exceptions.RequestException:
-            # Node is not reachable
-            continue
+        # Send election message to all higher-priority nodes at once
+        higher_nodes_alive = [
+            node for node, alive in zip(higher_nodes, election_executor.map(in_current_trace(probe_alive), higher_nodes))
+            if alive
+        ]
+        election.set('higher_nodes_alive', higher_nodes_alive)
+
+        if higher_nodes_alive and not force:
+            # Higher-priority node(s) are alive, so we wait for them to declare leader
+            log.info(f"Higher-priority node(s) {higher_nodes_alive} are alive; waiting for them to declare leader")
+        else:
+            election.set('elected', try_acquire_lease(partition))
+
+def try_acquire_lease(partition=CLUSTER_PARTITION):
+    """
+    Take a partition's leader lease in the metadata store and, on success,
+    become its leader.
+
+    Returns:
+        bool: True if this node now leads the partition.
+    """
+    requested_at = time.monotonic()
+    with span("election.acquire_lease", partition=partition):
+        lease = acquire_leader_lease(MASTER_NODE_ID, LEASE_DURATION, partition)
+    if not lease:
+        return False
+
+    state = leadership[partition]
+    # Another leader may have sealed, compacted and deleted the container cached from an earlier term
+    forget_open_container(partition)
+    state.take(MASTER_NODE_ID, lease['fencing_token'], requested_at + LEASE_DURATION)
+    log.info(f"New Leader of partition {partition} elected: {MASTER_NODE_ID} (fencing token {state.fencing_token})")
+    announce_leader(partition)
+    return True
 
-    if higher_nodes_alive:
-        # Higher-priority node(s) are alive, so we wait for them to declare leader
-        print(f"{candidate_id}: Higher-priority node(s) {higher_nodes_alive} are alive. Waiting for them to declare leader.")
+def renew_lease(partition=CLUSTER_PARTITION):
+    """
+    Extend our lease of a partition; step down if it was lost.
+    """
+    state = leadership[partition]
+    requested_at = time.monotonic()
+    try:
+        renewed = renew_leader_lease(MASTER_NODE_ID, state.fencing_token, LEASE_DURATION, partition)
+    except Exception as e:
+        log.warning(f"Failed to renew leader lease of partition {partition}: {e}")
+        renewed = False
+
+    if renewed:
+        state.lease_valid_until = requested_at + LEASE_DURATION
+    elif time.monotonic() >= state.lease_valid_until or state.fencing_token is None:
+        step_down(partition, "lease could not be renewed")
     else:
-        # No higher-priority nodes are alive, so declare self as leader
-        current_leader = candidate_id
-        print(f"{candidate_id}: New Leader elected: {current_leader}")
-        announce_leader()
+        # Keep trying until the local lease runs out
+        log.warning(f"Lease renewal of partition {partition} failed; retrying")
 
-def get_leader_from_mongo():
+def step_down(partition, reason):
     """
-    Fetch the current leader from MongoDB.
+    Stop acting as leader of a partition.
     """
-    leader_data = fetch_leader_metadata()
-    if leader_data:
-        return leader_data.get("leader")
-    return None
+    with start_trace("election.step_down", root=True, sample_rate=1, partition=partition, reason=reason):
+        log.warning(f"Stepping down as leader of partition {partition}: {reason}")
+        leadership[partition].release()
+        forget_open_container(partition)
+
+def sync_leader_from_lease(partition=CLUSTER_PARTITION):
+    """
+    Follow the leader recorded in a partition's lease, or start an election
+    if the lease has expired.
+    """
+    state = leadership[partition]
+    lease = fetch_leader_metadata(partition)
+    expires_at = lease.get('lease_expires_at') if lease else None
+
+    if expires_at and expires_at > datetime.utcnow():
+        if lease['leader'] == MASTER_NODE_ID:
+            # We hold the lease from before a restart; take it again with a new token
+            try_acquire_lease(partition)
+            return
+        state.leader = lease['leader']
+        state.highest_token_seen = max(state.highest_token_seen, lease.get('fencing_token', 0))
+        state.lease_expired_since = None
+        return
+
+    state.leader = None
+    if state.lease_expired_since is None:
+        state.lease_expired_since = time.monotonic()
+    # If higher-priority masters have not taken the lease within one lease period, take it ourselves
+    start_election(partition, force=time.monotonic() - state.lease_expired_since > LEASE_DURATION)
+
+def hand_off_to_preferred_leader(partition):
+    """
+    Give a partition back to its preferred (highest-priority) master once it
+    is alive again, so partition leadership spreads across the masters after
+    failovers and staggered restarts. The lease is released rather than left
+    to expire, so the preferred master can take it within a second.
+    """
+    state = leadership[partition]
+    now = time.monotonic()
+    preferred = partition_priority(config.keys(), partition)[-1]
+    if preferred == MASTER_NODE_ID or now < state.next_handoff_check:
+        return
+    state.next_handoff_check = now + HANDOFF_CHECK_INTERVAL
+    if not is_leader(partition) or not probe_alive(preferred):
+        return
+
+    state.next_handoff_check = now + HANDOFF_BACKOFF
+    token = state.fencing_token
+    step_down(partition, f"handing off to preferred leader {preferred}")
+    release_leader_lease(MASTER_NODE_ID, token, partition)
 
 def discover_leader():
     """
-    Attempts to discover the current leader by querying MongoDB.
-    Verifies if the leader is alive.
+    Discover the leader of every partition from the leases in the metadata
+    store, electing one where the lease has expired.
     """
-    global current_leader
-    leader = get_leader_from_mongo()
-    if leader:
-        if is_leader_alive(leader):
-            current_leader = leader
-            print(f"{MASTER_NODE_ID}: Discovered leader {current_leader} from MongoDB")
+    for partition, state in leadership.items():
+        sync_leader_from_lease(partition)
+        if state.leader:
+            log.info(f"Discovered leader {state.leader} of partition {partition} from the metadata store")
         else:
-            print(f"{MASTER_NODE_ID}: Leader {leader} from MongoDB is not alive.")
-            start_election()
-    else:
-        print(f"{MASTER_NODE_ID}: No leader found in MongoDB.")
-        start_election()
+            log.warning(f"No leader holds a valid lease of partition {partition}")
 
-def get_leader_address(leader):
-    leader_config = config.get(leader, {})
-    ip = leader_config.get("ip", "127.0.0.1")  # Default to 127.0.0.1 if leader is not found
-    port = leader_config.get("port", 5001)  # Default to 5001 if leader is not found
-    return ip, port
+def partition_leader(partition):
+    """
+    Return the leader of a partition as advertised to others.
+    """
+    state = leadership[partition]
+    if state.leader == MASTER_NODE_ID:
+        # Do not advertise ourselves once our lease has run out
+        return MASTER_NODE_ID if is_leader(partition) else None
+    return state.leader
 
 @app.route('/current_leader', methods=['GET'])
 def current_leader_endpoint():
     """
-    Return the current leader's ID.
+    Return the current leader's ID: of partition 0 (the cluster leader that
+    workers send heartbeats to), or of the partition given as a query parameter.
     """
-    global current_leader
-    return jsonify({'leader': current_leader}), 200
+    partition = request.args.get('partition', CLUSTER_PARTITION, type=int)
+    if partition not in leadership:
+        return jsonify({'error': f'Unknown metadata partition {partition}'}), 400
+    return jsonify({
+        'leader': partition_leader(partition),
+        'fencing_token': leadership[partition].highest_token_seen,
+        'partition': partition
+    }), 200
 
-def is_leader_alive(leader_id):
+@app.route('/partitions', methods=['GET'])
+def list_partitions():
     """
-    Check if the leader is alive.
+    Return the leader of every metadata partition.
     """
-    if leader_id == MASTER_NODE_ID:
-        return True  # We are the leader
-    leader_ip, leader_port = get_leader_address(leader_id)
-    try:
-        response = requests.get(f"http://{leader_ip}:{leader_port}/alive", timeout=2)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+    return jsonify({
+        'partition_count': METADATA_PARTITIONS,
+        'partitions': [
+            {'partition': partition, 'leader': partition_leader(partition), 'fencing_token': state.highest_token_seen}
+            for partition, state in leadership.items()
+        ]
+    }), 200
 
 def check_leader_alive():
     """
-    Periodically check if the current leader is alive.
-    If not, start a new election.
+    Periodically renew our leases, or follow the leases of the partitions we
+    do not lead (and start an election once one expires).
     """
-    global current_leader
     while True:
         time.sleep(HEARTBEAT_INTERVAL)
-        if current_leader != MASTER_NODE_ID:
-            if not is_leader_alive(current_leader):
-                print(f"{MASTER_NODE_ID}: Leader {current_leader} is unresponsive. Starting election.")
-                start_election()
-        else:
-            # If we are the leader, no need to check
-            pass
+        for partition, state in leadership.items():
+            try:
+                if state.leader == MASTER_NODE_ID:
+                    if faults.suppress_heartbeat():
+                        # Lets the lease run out, as if this leader had stalled
+                        log.info(f"Lease renewal of partition {partition} suppressed by fault injection")
+                        continue
+                    renew_lease(partition)
+                    hand_off_to_preferred_leader(partition)
+                else:
+                    sync_leader_from_lease(partition)
+            except Exception as e:
+                log.warning(f"Leader check of partition {partition} failed: {e}")
 
 @app.route('/alive', methods=['GET'])
 def alive():
@@ -204,13 +472,59 @@ def alive():
     """
     return jsonify({'status': 'alive'}), 200
 
+def upload_partition(file_id):
+    """
+    Resolve the file ID and partition of an upload this node is to take.
+
+    Args:
+        file_id (str): ID chosen by the gateway, which routes by its partition (None: pick one here).
+
+    Returns:
+        tuple: (file_id, partition, error), where error is an (message, status)
+        pair if the file ID is invalid or this node does not lead its partition.
+    """
+    if file_id:
+        try:
+            file_id = str(uuid.UUID(file_id))
+        except ValueError:
+            return None, None, ('file_id must be a UUID', 400)
+        partition = partition_for(file_id)
+        if not is_leader(partition):
+            return None, None, (f'This node is not the leader of partition {partition}', 403)
+        return file_id, partition, None
+    partitions = led_partitions()
+    if not partitions:
+        return None, None, ('This node is not the leader', 403)
+    return (*new_file_id(partitions), None)
+
+def upload_leader_required(view):
+    """
+    Decorator turning away uploads this node does not lead before their quota
+    is reserved or their body read: the file ID comes from the query string.
+    The view finds the upload's file ID and partition in `g.file_id` and
+    `g.partition`.
+    """
+    @functools.wraps(view)
+    def led(*args, **kwargs):
+        file_id, partition, error = upload_partition(request.args.get('file_id'))
+        if error:
+            message, status = error
+            return jsonify({'error': message}), status
+        g.file_id, g.partition = file_id, partition
+        return view(*args, **kwargs)
+    return led
+
 @app.route('/upload_file', methods=['POST'])
+@upload_leader_required
+@admission_required
+@quota_required(quotas)
 def upload_file():
     """
-    Handle file uploads from the gateway.
+    Handle file uploads from the gateway, on behalf of their owner (X-Owner).
     """
-    if current_leader != MASTER_NODE_ID:
-        return jsonify({'error': 'This node is not the leader'}), 403
+    file_id, partition = g.file_id, g.partition
+    if request.args.get('file_id') and fetch_file_metadata(file_id):
+        return jsonify({'error': f'File {file_id} already exists'}), 409
 
     file = request.files.get('file')
     if not file:
@@ -219,102 +533,796 @@ def upload_file():
     file_name = file.filename
     file_data = file.read()
     file_size = len(file_data)
-    file_id = str(uuid.uuid4())
-    print(file_id, "file_isssssd")
+    chunk_size_hint = request.form.get('chunk_size_mb')  # Optional client hint
+    if chunk_size_hint:
+        try:
+            chunk_size_mb = float(chunk_size_hint)
+            if not math.isfinite(chunk_size_mb) or chunk_size_mb <= 0:
+                raise ValueError
+        except ValueError:
+            return jsonify({'error': 'chunk_size_mb must be a positive number'}), 400
     # Divide file into chunks and assign to workers
     try:
-        chunks_info = divide_file_into_chunks(file_data, file_id)
+        chunks_info = None
+        chunk_size = None
+        if PACK_SMALL_FILES and 0 < file_size <= PACK_THRESHOLD:
+            try:
+                chunks_info = [pack_small_file(file_data, partition)]
+            except Exception as e:
+                log.warning(f"Packing {file_id} failed, storing it as regular chunks: {e}")
+        packed = chunks_info is not None
+        if not packed:
+            chunks_info, chunk_size = divide_file_into_chunks(
+                file_data, file_id, chunk_size_hint=chunk_size_hint, partition=partition
+            )
         # Store file metadata
         store_file_metadata(
             file_id=file_id,
             file_name=file_name,
             size=file_size,
-            chunks=chunks_info
+            chunks=chunks_info,
+            packed=packed,
+            chunk_size=chunk_size,
+            partition=partition,
+            owner=g.owner
         )
-        return jsonify({'message': f'File {file_name} uploaded successfully', 'file_id': file_id}), 200
+        # Complete the replicas that were not durable when the quorum was reached
+        pending_replicas = 0
+        for chunk in chunks_info:
+            for worker_id in chunk['pending_worker_ids']:
+                enqueue_repair(file_id, chunk['chunk_id'], worker_id)
+                pending_replicas += 1
+        return jsonify({
+            'message': f'File {file_name} uploaded successfully',
+            'file_id': file_id,
+            'pending_replicas': pending_replicas
+        }), 200
     except Exception as e:
         return jsonify({'error': f'Failed to upload file: {str(e)}'}), 500
 
-def divide_file_into_chunks(file_data, file_id, chunk_size_mb=4, replication_factor=3):
+def new_file_id(partitions):
+    """
+    Generate a file ID that hashes into one of the given partitions.
+
+    Returns:
+        tuple: (file_id, partition)
+    """
+    while True:
+        file_id = str(uuid.uuid4())
+        partition = partition_for(file_id)
+        if partition in partitions:
+            return file_id, partition
+
+def get_known_workers():
+    """
+    Return every registered worker, active or not.
+    """
+    if is_leader():
+        get_live_workers()  # Seeds the liveness table if needed
+        return liveness.snapshot()
+    workers = metadata_cache.get('known_workers')
+    if workers is None:
+        workers = fetch_workers()
+        metadata_cache.set('known_workers', workers)
+    return workers
+
+def get_worker_ring(members=()):
+    """
+    Return the placement ring over every registered worker (and `members`,
+    which may have registered after the known workers were last read).
+
+    Inactive workers stay on the ring and are skipped when placing replicas,
+    so a worker going down only shifts the placements of its own ring
+    segments instead of reshuffling the whole mapping.
+    """
+    global worker_ring
+    worker_ids = sorted({worker['worker_id'] for worker in get_known_workers()} | set(members))
+    with worker_ring_lock:
+        if worker_ring is None or sorted(worker_ring.nodes) != worker_ids:
+            worker_ring = build_worker_ring(worker_ids)
+            log.info(f"Rebuilt placement ring over {len(worker_ids)} worker(s)")
+        return worker_ring
+
+def choose_replica_workers(chunk_id, candidates, count, exclude=()):
+    """
+    Pick the workers to hold a chunk's replicas among the eligible candidates.
+
+    With PLACEMENT_MODE=hash the choice is the chunk's preference list on the
+    worker ring, so anyone with the ring membership can compute it from the
+    chunk ID; otherwise the workers are sampled at random.
+    """
+    if PLACEMENT_MODE == "hash":
+        return hash_placement(get_worker_ring(candidates), chunk_id, count, eligible=set(candidates), exclude=exclude)
+    return random_placement(candidates, count, exclude=exclude)
+
+@app.route('/ring', methods=['GET'])
+def get_ring():
+    """
+    Return the placement mode and ring membership, from which clients can
+    compute the preferred replica workers of a chunk. Served by any master.
+    """
+    workers = get_known_workers()
+    return read_response({
+        'mode': PLACEMENT_MODE,
+        'vnodes': PLACEMENT_VNODES,
+        'weights': PLACEMENT_WEIGHTS,
+        'workers': [
+            {'worker_id': worker['worker_id'], 'url': worker.get('url'), 'status': worker.get('status')}
+            for worker in workers
+        ]
+    })
+
+def divide_file_into_chunks(file_data, file_id, chunk_size_hint=None, replication_factor=3, partition=CLUSTER_PARTITION):
     """
     Divide the file data into chunks and assign to active workers.
+
+    The chunk size is chosen from the file size and the number of active
+    workers, unless the client passed a hint.
+
+    Returns:
+        tuple: (chunks_info, chunk_size) where chunk_size is in bytes.
     """
-    chunk_size = chunk_size_mb * 1024 * 1024
     file_size = len(file_data)
-    num_chunks = (file_size + chunk_size - 1) // chunk_size
     chunks_info = []
 
     # Fetch active workers
-    active_workers_info = get_active_workers()
+    active_workers_info = get_placement_workers(replication_factor)
     active_workers = [worker['worker_id'] for worker in active_workers_info]
     worker_urls = {worker['worker_id']: worker['url'] for worker in active_workers_info}
 
     if len(active_workers) < replication_factor:
         raise Exception("Not enough active workers to replicate chunks")
 
-    for i in range(num_chunks):
-        start_index = i * chunk_size
-        end_index = min(start_index + chunk_size, file_size)
+    chunk_size = choose_chunk_size(file_size, len(active_workers), hint_mb=chunk_size_hint)
+
+    for i, (start_index, end_index) in enumerate(split_ranges(file_size, chunk_size)):
         chunk_data = file_data[start_index:end_index]
-        chunk_id = f"{file_id}_chunk_{i+1}"
-        assigned_workers = random.sample(active_workers, replication_factor)
+        chunk_id = make_chunk_id(file_id, i)
+        assigned_workers = choose_replica_workers(chunk_id, active_workers, replication_factor)
+        durable_workers = store_chunk_replicas(chunk_id, chunk_data, assigned_workers, worker_urls, partition=partition)
+        pending_workers = [worker_id for worker_id in assigned_workers if worker_id not in durable_workers]
+
+        chunks_info.append({
+            'chunk_id': chunk_id,
+            'size': len(chunk_data),
+            'worker_ids': durable_workers,
+            'pending_worker_ids': pending_workers
+        })
+
+    return chunks_info, chunk_size
+
+def store_chunk_replicas(chunk_id, chunk_data, assigned_workers, worker_urls, quorum=None, headers=None,
+                         partition=CLUSTER_PARTITION):
+    """
+    Write a chunk to its assigned workers until the write quorum is durable,
+    fenced with our lease of the file's metadata partition.
 
-        for worker_id in assigned_workers:
-            worker_url = worker_urls[worker_id]
+    In chain mode the chunk is sent once to the first worker, which pipelines it
+    down the chain (skipping unreachable hops); if fewer than the quorum
+    acknowledge, the missing replicas are written directly by the master. In
+    fanout mode the master sends every replica in parallel and returns as
+    soon as the quorum has acknowledged. Replicas still missing once the
+    quorum is durable are left to the repair queue.
+
+    Returns:
+        list: IDs of the workers that durably stored the chunk.
+    """
+    quorum = min(quorum or WRITE_QUORUM, len(assigned_workers))
+    headers = io_priority_headers(headers)  # Fanout writes run on other threads
+    started = time.perf_counter()
+
+    with span("chunk.store", chunk_id=chunk_id, size=len(chunk_data), workers=assigned_workers,
+              mode=REPLICATION_MODE) as store_span:
+        if REPLICATION_MODE == "chain":
+            chain_urls = [worker_urls[worker_id] for worker_id in assigned_workers]
             try:
-                chunk_response = requests.post(f"{worker_url}/chunks/{chunk_id}", data=chunk_data)
-                chunk_response.raise_for_status()
+                stored_on = send_chunk_along_chain(
+                    chunk_id, chunk_data, chain_urls, headers=leader_headers(headers, partition)
+                )
             except requests.exceptions.RequestException as e:
-                raise Exception(f"Failed to store chunk {chunk_id} on worker {worker_id}: {e}")
+                chunk_log.warning("chunk.store_failed", "Failed to store chunk %s on chain %s: %s", chunk_id,
+                                  assigned_workers, e, chunk_id=chunk_id)
+                stored_on = []
+            durable_workers = [worker_id for worker_id in assigned_workers if worker_id in stored_on]
+            if len(durable_workers) < quorum:
+                missing = [worker_id for worker_id in assigned_workers if worker_id not in durable_workers]
+                durable_workers += write_replicas_directly(
+                    chunk_id, chunk_data, missing, worker_urls, quorum - len(durable_workers), headers, partition
+                )
+        else:
+            durable_workers = write_replicas_directly(
+                chunk_id, chunk_data, assigned_workers, worker_urls, quorum, headers, partition
+            )
+        store_span.set('durable_workers', durable_workers)
+
+    record_replica_write(started, assigned_workers, durable_workers)
+    if len(durable_workers) < quorum:
+        raise Exception(
+            f"Failed to store chunk {chunk_id}: only {len(durable_workers)} of {quorum} required replicas are durable"
+        )
+    return durable_workers
+
+def write_replicas_directly(chunk_id, chunk_data, worker_ids, worker_urls, quorum, headers=None,
+                            partition=CLUSTER_PARTITION):
+    """
+    Send a chunk to every given worker in parallel, returning as soon as
+    `quorum` of them acknowledged (or all of them answered).
 
-        chunks_info.append({'chunk_id': chunk_id, 'size': len(chunk_data), 'worker_ids': assigned_workers})
+    Returns:
+        list: IDs of the workers that durably stored the chunk.
+    """
+    post_chunk_traced = in_current_trace(post_chunk)
+    futures = {
+        replica_executor.submit(post_chunk_traced, worker_urls[worker_id], chunk_id, chunk_data, headers, partition): worker_id
+        for worker_id in worker_ids
+    }
+    durable_workers = []
+    for future in as_completed(futures):
+        worker_id = futures[future]
+        try:
+            future.result()
+            durable_workers.append(worker_id)
+        except requests.exceptions.RequestException as e:
+            chunk_log.warning("chunk.store_failed", "Failed to store chunk %s on worker %s: %s", chunk_id,
+                              worker_id, e, chunk_id=chunk_id, worker_id=worker_id)
+        if len(durable_workers) >= quorum:
+            # The remaining writes finish in the background; the repair queue completes them
+            break
+    return durable_workers
 
-    return chunks_info
+def record_replica_write(started, assigned_workers, durable_workers):
+    """
+    Record the latency and outcome of writing a chunk's replicas. Fanout
+    writes still running after the quorum was reached count as pending.
+    """
+    REPLICA_WRITE_SECONDS.labels(REPLICATION_MODE).observe(time.perf_counter() - started)
+    REPLICA_WRITES.labels('durable').inc(len(durable_workers))
+    if len(assigned_workers) > len(durable_workers):
+        REPLICA_WRITES.labels('pending').inc(len(assigned_workers) - len(durable_workers))
+
+def post_chunk(worker_url, chunk_id, chunk_data, headers=None, partition=CLUSTER_PARTITION):
+    """
+    Store a single chunk replica on a worker.
+    """
+    with span("chunk.replica_write", chunk_id=chunk_id, worker=worker_url):
+        response = requests.post(
+            f"{worker_url}/chunks/{chunk_id}", data=chunk_data, headers=inject(leader_headers(headers, partition))
+        )
+    response.raise_for_status()
+
+def open_new_container(partition, replication_factor=3):
+    """
+    Seal a partition's current container and start a new one on active
+    workers. Must be called with `open_container_lock` held.
+    """
+    current = open_containers.get(partition)
+    if current is None:
+        # Containers left open by a previous leader of the partition are never appended to again
+        seal_containers(partition=partition)
+    else:
+        retire_container(current)
+
+    active_workers = [worker['worker_id'] for worker in get_placement_workers(replication_factor)]
+    if len(active_workers) < replication_factor:
+        raise Exception("Not enough active workers to replicate containers")
+
+    container_id = make_container_id()
+    worker_ids = choose_replica_workers(container_id, active_workers, replication_factor)
+    create_container(container_id, worker_ids, partition)
+    open_containers[partition] = {'container_id': container_id, 'worker_ids': worker_ids, 'size': 0,
+                                  'appending': 0, 'retired': False}
+    log.info(f"Opened container {container_id} on {worker_ids} for partition {partition}")
+    return open_containers[partition]
+
+def retire_container(container):
+    """
+    Seal a container that no longer takes new appends once the appends
+    already given a range in it are recorded, since only open containers
+    record appends. Must be called with `open_container_lock` held.
+    """
+    container['retired'] = True
+    if not container['appending']:
+        seal_containers([container['container_id']])
+
+def forget_open_container(partition):
+    """
+    Drop the cached open container of a partition whose leadership changes
+    hands, so the next small file opens a new one after sealing those left
+    open (see open_new_container).
+    """
+    with open_container_lock:
+        open_containers.pop(partition, None)
+
+def pack_small_file(file_data, partition=CLUSTER_PARTITION):
+    """
+    Append a small file to the open container chunk of its metadata partition.
+
+    The byte range is reserved under a lock, then written to every container
+    replica at that offset, so concurrent small uploads proceed in parallel.
+    If any replica write fails the container is sealed, since its replicas
+    may now differ beyond this range. The append fails too if the container
+    was sealed meanwhile by another leader of the partition, which may have
+    compacted it away; the caller then stores the file as regular chunks.
+
+    Returns:
+        dict: Chunk entry pointing at the file's range within the container.
+    """
+    length = len(file_data)
+    with open_container_lock:
+        container = open_containers.get(partition)
+        if container is None or container['size'] + length > CONTAINER_MAX_SIZE:
+            container = open_new_container(partition)
+        offset = container['size']
+        container['size'] += length
+        container['appending'] += 1
+
+    active_workers = {worker['worker_id']: worker['url'] for worker in get_live_workers()}
+    try:
+        if any(worker_id not in active_workers for worker_id in container['worker_ids']):
+            raise Exception(f"Container {container['container_id']} has inactive replicas")
+        store_chunk_replicas(
+            container['container_id'], file_data, container['worker_ids'], active_workers,
+            quorum=len(container['worker_ids']), headers={OFFSET_HEADER: str(offset)}, partition=partition
+        )
+        if not record_container_append(container['container_id'], offset + length, length):
+            raise Exception(f"Container {container['container_id']} is no longer open")
+    except Exception:
+        with open_container_lock:
+            if open_containers.get(partition) is container:
+                seal_containers([container['container_id']])
+                del open_containers[partition]
+        raise
+    finally:
+        with open_container_lock:
+            container['appending'] -= 1
+            if container['retired'] and not container['appending']:
+                seal_containers([container['container_id']])
+
+    return {
+        'chunk_id': container['container_id'],
+        'offset': offset,
+        'size': length,
+        'worker_ids': list(container['worker_ids']),
+        'pending_worker_ids': []
+    }
+
+def read_packed_range(chunk):
+    """
+    Read a packed file's byte range from one of its container replicas.
+    """
+    active_workers = {worker['worker_id']: worker['url'] for worker in get_live_workers()}
+    start, end = chunk['offset'], chunk['offset'] + chunk['size'] - 1
+    for worker_id in order_by_suspicion(chunk['worker_ids']):
+        if worker_id not in active_workers:
+            continue
+        try:
+            response = requests.get(
+                f"{active_workers[worker_id]}/chunks/{chunk['chunk_id']}",
+                headers=io_priority_headers({'Range': f"bytes={start}-{end}"}),
+                timeout=30
+            )
+            response.raise_for_status()
+            if response.status_code == 206:
+                return response.content
+            return response.content[start:end + 1]
+        except requests.exceptions.RequestException as e:
+            chunk_log.warning("chunk.read_failed", "Failed to read %s from %s: %s", chunk['chunk_id'], worker_id, e,
+                              chunk_id=chunk['chunk_id'], worker_id=worker_id)
+    raise Exception(f"No active replica of container {chunk['chunk_id']} could be read")
+
+def compact_container(container):
+    """
+    Move the live files out of a mostly deleted container, then delete it.
+    """
+    container_id = container['container_id']
+    partition = container.get('partition', CLUSTER_PARTITION)
+    for file_doc in fetch_files_in_container(container_id):
+        old_chunk = next(c for c in file_doc['chunks'] if c['chunk_id'] == container_id)
+        new_chunk = pack_small_file(read_packed_range(old_chunk), partition)
+        if not relocate_packed_file(file_doc['file_id'], container_id, new_chunk):
+            # The file was deleted while it was being copied
+            release_container_space(new_chunk['chunk_id'], new_chunk['size'])
+
+    mark_container_deleted(container_id)
+    active_workers = {worker['worker_id']: worker['url'] for worker in get_live_workers()}
+    for worker_id in container['worker_ids']:
+        # Replicas on unreachable workers are purged later as orphans
+        if worker_id in active_workers:
+            bulk_delete_on_worker(active_workers[worker_id], [container_id], partition)
+    log.info(f"Compacted container {container_id}")
+
+def run_container_compaction():
+    """
+    Background job on partition leaders that rewrites their sealed containers
+    once enough of their contents are deleted.
+    """
+    set_io_priority(BACKGROUND)
+    while True:
+        time.sleep(COMPACTION_INTERVAL)
+        if not PACK_SMALL_FILES:
+            continue
+        try:
+            for partition in led_partitions():
+                for container in fetch_containers_to_compact(COMPACTION_LIVE_RATIO, partition):
+                    compact_container(container)
+        except Exception as e:
+            log.warning(f"Container compaction failed: {e}")
+
+def enqueue_repair(file_id, chunk_id, worker_id):
+    """
+    Queue a pending replica for asynchronous completion, ignoring duplicates.
+    """
+    task = (file_id, chunk_id, worker_id)
+    with queued_repairs_lock:
+        if task in queued_repairs:
+            return
+        queued_repairs.add(task)
+    repair_queue.put(task)
+
+def retry_repair_later(task):
+    """
+    Put a failed repair back on the queue after a delay.
+    """
+    timer = threading.Timer(REPAIR_RETRY_DELAY, lambda: enqueue_repair(*task))
+    timer.daemon = True
+    timer.start()
+
+def repair_replica(file_id, chunk_id, pending_worker_id):
+    """
+    Copy a chunk from a durable replica to a worker it is still pending on.
+
+    If the pending worker is no longer active, another active worker that does
+    not already hold the chunk is used instead.
+
+    Returns:
+        bool: True if the replica is complete (or no longer needed).
+    """
+    file_metadata = fetch_file_metadata(file_id)
+    if not file_metadata or file_metadata.get('status') != 'active':
+        return True
+
+    partition = file_metadata.get('partition', CLUSTER_PARTITION)
+    if not is_leader(partition):
+        # The partition's leader rediscovers the pending replica from metadata
+        return True
+
+    chunk = next((c for c in file_metadata['chunks'] if c['chunk_id'] == chunk_id), None)
+    if not chunk or pending_worker_id not in chunk.get('pending_worker_ids', []):
+        return True
+
+    active_workers = {worker['worker_id']: worker['url'] for worker in get_live_workers()}
+    sources = [worker_id for worker_id in order_by_suspicion(chunk['worker_ids']) if worker_id in active_workers]
+    if not sources:
+        log.warning(f"No active durable replica of chunk {chunk_id} to repair from")
+        return False
+
+    target_id = pending_worker_id
+    if target_id not in active_workers:
+        holders = set(chunk['worker_ids']) | set(chunk.get('pending_worker_ids', []))
+        placeable = [worker['worker_id'] for worker in get_placement_workers(1)]
+        candidates = [worker_id for worker_id in placeable if worker_id not in holders]
+        if not candidates:
+            log.warning(f"No active worker available to repair chunk {chunk_id}")
+            return False
+        target_id = choose_replica_workers(chunk_id, candidates, 1)[0]
+
+    try:
+        source_response = requests.get(f"{active_workers[sources[0]]}/chunks/{chunk_id}",
+                                       headers=io_priority_headers(), timeout=30)
+        source_response.raise_for_status()
+        post_chunk(active_workers[target_id], chunk_id, source_response.content, partition=partition)
+    except requests.exceptions.RequestException as e:
+        chunk_log.warning("chunk.repair_failed", "Failed to repair chunk %s on worker %s: %s", chunk_id, target_id, e,
+                          chunk_id=chunk_id, worker_id=target_id)
+        return False
+
+    promote_pending_replica(file_id, chunk_id, pending_worker_id, target_id)
+    chunk_log.info("chunk.repaired", "Completed replica of chunk", chunk_id=chunk_id, worker_id=target_id)
+    return True
+
+def process_repair_queue():
+    """
+    Background worker that completes pending replicas on partition leaders.
+    """
+    set_io_priority(BACKGROUND)
+    while True:
+        task = repair_queue.get()
+        with queued_repairs_lock:
+            queued_repairs.discard(task)
+
+        if not led_partitions():
+            # The new leader rediscovers pending replicas from metadata
+            continue
+
+        try:
+            repaired = repair_replica(*task)
+        except Exception as e:
+            log.warning(f"Error repairing replica {task}: {e}")
+            repaired = False
+
+        if not repaired:
+            retry_repair_later(task)
+
+def scan_pending_replicas():
+    """
+    Periodically re-queue pending replicas recorded in metadata, so repairs
+    survive leader changes and restarts.
+    """
+    while True:
+        for partition in led_partitions():
+            try:
+                for file_doc in fetch_files_with_pending_replicas(partition):
+                    for chunk in file_doc['chunks']:
+                        for worker_id in chunk.get('pending_worker_ids', []):
+                            enqueue_repair(file_doc['file_id'], chunk['chunk_id'], worker_id)
+            except Exception as e:
+                log.warning(f"Error scanning partition {partition} for pending replicas: {e}")
+        time.sleep(REPAIR_SCAN_INTERVAL)
 
 @app.route('/files/<file_id>', methods=['DELETE'])
 def delete_file(file_id):
     """
     Handle file deletion requests.
+
+    The file is tombstoned in metadata; its chunks are removed from the workers
+    by the background garbage collector. Only the leader of the file's
+    metadata partition accepts the request.
     """
-    if current_leader != MASTER_NODE_ID:
-        return jsonify({'error': 'This node is not the leader'}), 403
+    partition = partition_for(file_id)
+    if not is_leader(partition):
+        return jsonify({'error': f'This node is not the leader of partition {partition}'}), 403
 
-    file_metadata = fetch_file_metadata(file_id)
+    # Group-committed with concurrent deletes; only a miss needs the extra read
+    if not tombstone_file(file_id) and not fetch_file_metadata(file_id):
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify({'message': f'File {file_id} deleted successfully'}), 200
+
+def bulk_delete_on_worker(worker_url, chunk_ids, partition=CLUSTER_PARTITION, headers=None):
+    """
+    Delete chunks from a worker in batches. Callers on other threads pass
+    the I/O priority of the job in `headers` (see io_priority_headers).
+
+    Returns:
+        bool: True if every batch was accepted by the worker.
+    """
+    chunk_ids = list(chunk_ids)
+    for start in range(0, len(chunk_ids), GC_BATCH_SIZE):
+        batch = chunk_ids[start:start + GC_BATCH_SIZE]
+        try:
+            response = requests.post(
+                f"{worker_url}/chunks/bulk_delete", json={'chunk_ids': batch},
+                headers=leader_headers(headers, partition=partition), timeout=30
+            )
+            response.raise_for_status()
+            if response.json().get('failed'):
+                return False
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.warning(f"Bulk delete on {worker_url} failed: {e}")
+            return False
+    return True
+
+def collect_deleted_files(partition=CLUSTER_PARTITION):
+    """
+    Delete the chunks of a partition's tombstoned files from their workers.
+
+    Chunks are grouped per worker and deleted with parallel bulk requests. A
+    file is marked collected only once every worker holding one of its chunks
+    has confirmed; files with chunks on unreachable workers are retried on the
+    next cycle.
+    """
+    pending_files = fetch_files_pending_gc(GC_FILES_PER_CYCLE, partition)
+    if not pending_files:
+        return
+
+    chunks_by_worker = {}
+    workers_by_file = {}
+    for file_doc in pending_files:
+        if file_doc.get('packed'):
+            # Packed files share their container; only release their bytes for compaction
+            for chunk in file_doc.get('chunks', []):
+                release_container_space(chunk['chunk_id'], chunk['size'])
+            workers_by_file[file_doc['file_id']] = set()
+            continue
+
+        file_workers = set()
+        for chunk in file_doc.get('chunks', []):
+            for worker_id in chunk['worker_ids'] + chunk.get('pending_worker_ids', []):
+                chunks_by_worker.setdefault(worker_id, set()).add(chunk['chunk_id'])
+                file_workers.add(worker_id)
+        workers_by_file[file_doc['file_id']] = file_workers
+
+    active_workers = {worker['worker_id']: worker['url'] for worker in get_live_workers()}
+    headers = io_priority_headers()  # The deletes run on gc_executor threads, which do not inherit the priority
+    futures = {
+        gc_executor.submit(bulk_delete_on_worker, active_workers[worker_id], chunk_ids, partition, headers): worker_id
+        for worker_id, chunk_ids in chunks_by_worker.items()
+        if worker_id in active_workers
+    }
+    done_workers = {futures[future] for future in as_completed(futures) if future.result()}
+
+    collected = [file_id for file_id, file_workers in workers_by_file.items() if file_workers <= done_workers]
+    mark_files_collected(collected)
+    if collected:
+        log.info(f"Garbage collected {len(collected)} deleted file(s) of partition {partition}")
+
+def fetch_worker_inventory(worker_url, headers=None):
+    """
+    Fetch the list of chunks stored on a worker. Callers on other threads
+    pass the I/O priority of the job in `headers` (see io_priority_headers).
+    """
+    response = requests.get(f"{worker_url}/chunks", headers=io_priority_headers(headers), timeout=30)
+    response.raise_for_status()
+    return response.json().get('chunks', [])
+
+def reconcile_worker_inventories():
+    """
+    Purge chunks that workers hold but metadata no longer references, such as
+    leftovers of failed uploads or deletes missed while a worker was down.
+
+    Only chunks older than the grace period are purged, so uploads still in
+    progress are never affected.
+    """
+    referenced = {}
+    for file_doc in fetch_chunk_placements():
+        for chunk in file_doc.get('chunks', []):
+            for worker_id in chunk['worker_ids'] + chunk.get('pending_worker_ids', []):
+                referenced.setdefault(worker_id, set()).add(chunk['chunk_id'])
+    for container in fetch_live_containers():
+        for worker_id in container['worker_ids']:
+            referenced.setdefault(worker_id, set()).add(container['container_id'])
+
+    active_workers = {worker['worker_id']: worker['url'] for worker in get_live_workers()}
+    headers = io_priority_headers()  # The scans run on gc_executor threads, which do not inherit the priority
+    futures = {
+        gc_executor.submit(fetch_worker_inventory, worker_url, headers): worker_id
+        for worker_id, worker_url in active_workers.items()
+    }
+    for future in as_completed(futures):
+        worker_id = futures[future]
+        try:
+            inventory = future.result()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.warning(f"Could not fetch inventory of {worker_id}: {e}")
+            continue
+
+        worker_chunks = referenced.get(worker_id, set())
+        orphans = [
+            chunk['chunk_id'] for chunk in inventory
+            if chunk['chunk_id'] not in worker_chunks and chunk['age_seconds'] > GC_ORPHAN_GRACE_PERIOD
+        ]
+        if orphans and bulk_delete_on_worker(active_workers[worker_id], orphans):
+            log.info(f"Purged {len(orphans)} orphaned chunk(s) from {worker_id}")
+
+def run_garbage_collector():
+    """
+    Background garbage collector. Each partition leader collects the deleted
+    files of its partitions; the cluster leader also purges orphaned chunks.
+    """
+    set_io_priority(BACKGROUND)
+    last_reconcile = time.time()
+    while True:
+        time.sleep(GC_INTERVAL)
+        try:
+            for partition in led_partitions():
+                collect_deleted_files(partition)
+            if is_leader() and time.time() - last_reconcile >= GC_RECONCILE_INTERVAL:
+                last_reconcile = time.time()
+                reconcile_worker_inventories()
+        except Exception as e:
+            log.warning(f"Garbage collection failed: {e}")
+
+def read_file_metadata(file_id):
+    """
+    Fetch file metadata for a read-only request.
+
+    The leader of the file's partition always reads the latest metadata;
+    other masters may answer from a cache that is at most
+    METADATA_MAX_STALENESS seconds old.
+    """
+    if is_leader(partition_for(file_id)):
+        return fetch_file_metadata(file_id)
+    file_metadata = metadata_cache.get(('file', file_id))
+    if file_metadata is None:
+        file_metadata = fetch_file_metadata(file_id)
+        if file_metadata:
+            metadata_cache.set(('file', file_id), file_metadata)
+    return file_metadata
+
+def serialize_file(file_doc):
+    """
+    Convert a file document into a JSON-friendly dict.
+    """
+    file_info = {key: value for key, value in file_doc.items() if key != '_id'}
+    for key, value in file_info.items():
+        if isinstance(value, datetime):
+            file_info[key] = value.isoformat()
+    return file_info
+
+def read_response(payload, status=200, fresh=None):
+    """
+    Build a response for a read-only endpoint, advertising how stale it may be.
+    `fresh` tells whether the payload was read uncached (default: if we are the cluster leader).
+    """
+    response = jsonify(payload)
+    response.status_code = status
+    fresh = is_leader() if fresh is None else fresh
+    response.headers['X-Metadata-Max-Staleness'] = '0' if fresh else str(METADATA_MAX_STALENESS)
+    return response
+
+@app.route('/files/<file_id>', methods=['GET'])
+def get_file_info(file_id):
+    """
+    Return a file's metadata. Served by any master.
+    """
+    file_metadata = read_file_metadata(file_id)
     if not file_metadata:
         return jsonify({'error': 'File not found'}), 404
+    return read_response(serialize_file(file_metadata), fresh=is_leader(partition_for(file_id)))
 
-    # Delete chunks from workers
-    for chunk in file_metadata['chunks']:
-        chunk_id = chunk['chunk_id']
-        worker_ids = chunk['worker_ids']
-
-        for worker_id in worker_ids:
-            worker_info = next((w for w in get_active_workers() if w['worker_id'] == worker_id), None)
-            if worker_info:
-                worker_url = worker_info['url']
-                try:
-                    response = requests.post(f"{worker_url}/chunks/{chunk_id}/delete")
-                    response.raise_for_status()
-                except requests.exceptions.RequestException as e:
-                    print(f"Failed to delete chunk {chunk_id} from worker {worker_id}: {e}")
-            else:
-                print(f"Worker {worker_id} is not active.")
+@app.route('/files', methods=['GET'])
+def list_files():
+    """
+    Return the metadata of every file. Served by any master.
+    """
+    fresh = len(led_partitions()) == METADATA_PARTITIONS
+    files = None if fresh else metadata_cache.get('files')
+    if files is None:
+        files = [serialize_file(file_doc) for file_doc in fetch_all_files()]
+        if not fresh:
+            metadata_cache.set('files', files)
+    return read_response({'files': files}, fresh=fresh)
 
-    # Soft delete the file metadata
-    files_collection = db["files"]
-    files_collection.update_one(
-        {"file_id": file_id},
-        {"$set": {"status": "deleted", "deleted_at": datetime.utcnow()}}
-    )
+def serialize_usage(owner, usage):
+    """
+    Convert an owner's usage record (None: no record) into a JSON-friendly
+    dict, with the quotas that apply to it (0: no limit).
+    """
+    usage = usage or {}
+    quota_bytes, quota_files = effective_quotas(usage)
+    return {
+        'owner': owner,
+        'bytes': usage.get('bytes', 0),
+        'files': usage.get('files', 0),
+        'chunks': usage.get('chunks', 0),
+        'quota_bytes': quota_bytes,
+        'quota_files': quota_files
+    }
 
-    return jsonify({'message': f'File {file_id} deleted successfully'}), 200
+@app.route('/usage/<owner>', methods=['GET'])
+def get_usage(owner):
+    """
+    Return the bytes, files and chunks an owner stores, and its quotas.
+    Served by any master from the owner's usage counters, without a scan.
+    """
+    return read_response(serialize_usage(owner, fetch_usage(owner)), fresh=True)
+
+@app.route('/admin/quotas/<owner>', methods=['PUT'])
+@admin_required
+def put_quota(owner):
+    """
+    Set an owner's quotas from {"bytes": ..., "files": ...}. A missing or
+    null quota falls back to QUOTA_BYTES / QUOTA_FILES; 0 means no limit.
+    """
+    try:
+        check_owner(owner)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object with "bytes" and "files"'}), 400
+    quota_bytes, quota_files = body.get('bytes'), body.get('files')
+    for name, value in (('bytes', quota_bytes), ('files', quota_files)):
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            return jsonify({'error': f'"{name}" must be a non-negative integer or null'}), 400
+    set_quota(owner, quota_bytes, quota_files)
+    return jsonify(serialize_usage(owner, fetch_usage(owner))), 200
 
 @app.route('/chunks/<file_id>/<chunk_id>', methods=['GET'])
 def get_chunk_worker_url(file_id, chunk_id):
     """
-    Return the URL of a worker that has the requested chunk.
+    Return the URL of a worker that has the requested chunk. Served by any master.
     """
-    file_metadata = fetch_file_metadata(file_id)
+    file_metadata = read_file_metadata(file_id)
     if not file_metadata:
         return jsonify({'error': 'File not found'}), 404
 
@@ -322,14 +1330,18 @@ def get_chunk_worker_url(file_id, chunk_id):
     if not chunk:
         return jsonify({'error': 'Chunk not found'}), 404
 
-    worker_ids = chunk['worker_ids']
-    active_workers_info = get_active_workers()
+    worker_ids = order_by_suspicion(chunk['worker_ids'])
+    active_workers_info = get_live_workers()
     active_workers = {worker['worker_id']: worker['url'] for worker in active_workers_info}
 
     for worker_id in worker_ids:
         if worker_id in active_workers:
             worker_url = active_workers[worker_id]
-            return jsonify({'worker_url': f"{worker_url}/chunks/{chunk_id}"}), 200
+            location = {'worker_url': f"{worker_url}/chunks/{chunk_id}"}
+            if 'offset' in chunk:
+                # Packed file: the caller reads this range of the container
+                location.update({'offset': chunk['offset'], 'size': chunk['size']})
+            return read_response(location, fresh=is_leader(partition_for(file_id)))
 
     return jsonify({'error': 'No active worker has this chunk'}), 500
 
@@ -343,22 +1355,140 @@ def worker_heartbeat(worker_id):
     if not worker_url:
         return jsonify({'error': 'Worker URL not provided'}), 400
 
-    # Update or insert worker info
-    update_worker(worker_id, worker_url)
+    HEARTBEATS_RECEIVED.inc()
+    if is_leader():
+        # Absorbed in memory; flushed to the metadata store by flush_worker_liveness
+        liveness.record_heartbeat(worker_id, worker_url)
+    else:
+        # A worker with a stale view of the leader; persist directly
+        update_worker(worker_id, worker_url)
     return jsonify({'message': f'Heartbeat received from {worker_id}'}), 200
 
+def get_live_workers():
+    """
+    Return the active workers.
+
+    The leader answers from its in-memory liveness table, seeding it from
+    the metadata store the first time; other masters read the last flushed state.
+    """
+    if not is_leader():
+        active_workers = metadata_cache.get('active_workers')
+        if active_workers is None:
+            active_workers = get_active_workers()
+            metadata_cache.set('active_workers', active_workers)
+        return active_workers
+    if not liveness.seeded:
+        liveness.seed(fetch_workers())
+    return liveness.active_workers()
+
+def get_placement_workers(min_workers):
+    """
+    Return the active workers eligible for new replicas.
+
+    Workers the failure detector suspects are left out, unless that would
+    leave fewer than `min_workers` to choose from.
+    """
+    if not is_leader():
+        return get_active_workers()
+    get_live_workers()  # Seeds the liveness table if needed
+    unsuspected = liveness.active_workers(exclude_suspected=True)
+    if len(unsuspected) >= min_workers:
+        return unsuspected
+    return liveness.active_workers()
+
+def order_by_suspicion(worker_ids):
+    """
+    Order replica holders so the least suspected workers are tried first.
+    """
+    if not is_leader():
+        return list(worker_ids)
+    return sorted(worker_ids, key=liveness.suspicion)
+
+@app.route('/workers', methods=['GET'])
+def list_workers():
+    """
+    Return every known worker with its status and failure-detector suspicion.
+    Only the leader tracks suspicion; other masters report the persisted state.
+    """
+    if is_leader():
+        get_live_workers()
+        return read_response({'workers': liveness.snapshot(), 'suspect_threshold': PHI_SUSPECT_THRESHOLD})
+
+    workers = metadata_cache.get('workers')
+    if workers is None:
+        workers = [
+            {'worker_id': worker['worker_id'], 'url': worker.get('url'), 'status': worker.get('status'), 'phi': None}
+            for worker in fetch_workers()
+        ]
+        metadata_cache.set('workers', workers)
+    return read_response({'workers': workers, 'suspect_threshold': PHI_SUSPECT_THRESHOLD})
+
+def detect_inactive_workers():
+    """
+    Marks the workers that stopped sending heartbeats inactive, in memory on
+    the leader; changes are persisted by the flusher.
+
+    The liveness table is seeded here on becoming leader, so a dead worker is
+    detected without waiting for a request to seed it.
+
+    Returns:
+        list: IDs of the workers that just became inactive.
+    """
+    if not is_leader():
+        return []
+    if not liveness.seeded:
+        liveness.seed(fetch_workers())
+    inactive = liveness.mark_inactive()
+    if inactive:
+        log.info(f"Marked {len(inactive)} worker(s) as inactive: {inactive}")
+    return inactive
+
 def check_inactive_workers():
     """
-    Periodically checks for inactive workers and updates their status.
+    Periodically checks for inactive workers and updates their status (see
+    detect_inactive_workers).
     """
     while True:
-        inactive_count = mark_inactive_workers(HEARTBEAT_TIMEOUT)
-        if inactive_count > 0:
-            print(f"{MASTER_NODE_ID}: Marked {inactive_count} worker(s) as inactive.")
+        try:
+            detect_inactive_workers()
+        except Exception as e:
+            log.warning(f"Worker liveness check failed: {e}")
         time.sleep(WORKER_CHECK_INTERVAL)
 
-if __name__ == '__main__':
+def flush_worker_liveness():
+    """
+    Periodically persists the worker records changed since the last flush in
+    one bulk write, so the metadata store sees one write per interval regardless of the
+    number of workers.
+    """
+    while True:
+        time.sleep(HEARTBEAT_FLUSH_INTERVAL)
+        if not is_leader():
+            if liveness.seeded:
+                liveness.reset()
+            continue
+
+        records = liveness.drain_dirty()
+        try:
+            bulk_update_workers(records)
+        except Exception as e:
+            log.warning(f"Failed to flush {len(records)} worker record(s): {e}")
+            liveness.mark_dirty(record['worker_id'] for record in records)
+
+def start_background_tasks():
+    """
+    Discover the leaders and start the background jobs. Called before serving
+    requests, by this module or by the asyncio server (async_master).
+    """
     discover_leader()  # Discover leader and synchronize metadata on startup
     threading.Thread(target=check_leader_alive, daemon=True).start()  # Check leader periodically
     threading.Thread(target=check_inactive_workers, daemon=True).start()  # Check workers periodically
+    threading.Thread(target=flush_worker_liveness, daemon=True).start()  # Persist heartbeats in batches
+    threading.Thread(target=process_repair_queue, daemon=True).start()  # Complete pending replicas
+    threading.Thread(target=scan_pending_replicas, daemon=True).start()  # Recover pending replicas from metadata
+    threading.Thread(target=run_garbage_collector, daemon=True).start()  # Delete chunks of deleted files
+    threading.Thread(target=run_container_compaction, daemon=True).start()  # Rewrite mostly deleted containers
+
+if __name__ == '__main__':
+    start_background_tasks()
     app.run(debug=True, port=PORT, host='0.0.0.0', use_reloader=False)
@@ -0,0 +1,39 @@
+import functools
+import hmac
+import os
+
+# Shared secret required on /admin/* endpoints; without it they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Request header carrying the admin token
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def admin_error(headers):
+    """
+    Checks the admin token of a request.
+
+    Returns:
+        tuple: (status, message) if the request must be refused, or None if it is authorized.
+    """
+    if not ADMIN_TOKEN:
+        return 403, "Admin endpoints are disabled (set ADMIN_TOKEN to enable them)"
+    if not hmac.compare_digest(headers.get(ADMIN_TOKEN_HEADER, ""), ADMIN_TOKEN):
+        return 401, f"Missing or wrong {ADMIN_TOKEN_HEADER} header"
+    return None
+
+
+def admin_required(view):
+    """
+    Refuses requests to a Flask view without the admin token.
+    """
+    from flask import jsonify, request
+
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        error = admin_error(request.headers)
+        if error is not None:
+            status, message = error
+            return jsonify({'error': message}), status
+        return view(*args, **kwargs)
+    return guarded
@@ -0,0 +1,370 @@
+import asyncio
+import collections
+import functools
+import math
+import os
+import threading
+import time
+
+from shared.admin import ADMIN_TOKEN, ADMIN_TOKEN_HEADER, admin_error
+from shared.metrics import counter, gauge, histogram
+
+# Header identifying the client an upload is made for, set by trusted relays (otherwise: the client's address)
+CLIENT_ID_HEADER = "X-Client-Id"
+
+ADMISSION_MAX_INFLIGHT_BYTES = int(os.getenv("ADMISSION_MAX_INFLIGHT_BYTES", 256 * 1024 * 1024))  # Upload bytes admitted at once (0: no limit)
+ADMISSION_MAX_INFLIGHT_REQUESTS = int(os.getenv("ADMISSION_MAX_INFLIGHT_REQUESTS", 16))  # Uploads admitted at once (0: no limit)
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", 64))  # Uploads waiting for admission before 429s
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))  # Longest an upload waits for admission before a 429
+ADMISSION_RETRY_AFTER = 1  # Retry-After of uploads refused because the node is saturated, in seconds
+CLIENT_RATE_LIMIT = float(os.getenv("CLIENT_RATE_LIMIT", 0))  # Uploads per second per client (0: no limit)
+CLIENT_RATE_BURST = float(os.getenv("CLIENT_RATE_BURST", 10))  # Uploads a client may make at once after being idle
+CLIENT_BUCKETS_MAX = 10000  # Rate limiter states kept before those of idle clients are dropped
+TRUSTED_PROXIES = frozenset(address.strip() for address in os.getenv("TRUSTED_PROXIES", "").split(",") if address.strip())  # Addresses whose X-Client-Id is honored
+
+ADMISSION_QUEUE_WAIT_SECONDS = histogram('dfs_admission_queue_wait_seconds', 'Time an upload waited for admission',
+                                         buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+ADMISSION_INFLIGHT_BYTES = gauge('dfs_admission_inflight_bytes', 'Bytes of the uploads admitted and not finished')
+ADMISSION_INFLIGHT_REQUESTS = gauge('dfs_admission_inflight_requests', 'Uploads admitted and not finished')
+ADMISSION_QUEUED = gauge('dfs_admission_queued', 'Uploads waiting for admission')
+ADMISSION_REJECTED = counter('dfs_admission_rejected', 'Uploads refused with a 429, by reason (rate_limited, queue_full, timeout)', ('reason',))
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an upload is refused; `retry_after` is the number of seconds
+    the client should wait before trying again.
+    """
+
+    def __init__(self, message, reason, retry_after=ADMISSION_RETRY_AFTER):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _TokenBucket:
+    """
+    Allows `rate` requests per second on average, and bursts of `burst`.
+    """
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate, burst, now):
+        """
+        Returns 0 if a request may be made now (and counts it), else the
+        seconds until it may.
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / rate
+
+
+class _Waiter:
+    """
+    An upload waiting for admission. `grant` may be called from any thread.
+    """
+
+    __slots__ = ('client', 'nbytes', 'granted', '_event', '_loop', '_future')
+
+    def __init__(self, client, nbytes, loop=None):
+        self.client = client
+        self.nbytes = nbytes
+        self.granted = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self._future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AdmissionTicket:
+    """
+    An admitted upload, holding its share of the limits until released (or
+    the `with` block exits). Releasing twice is harmless.
+    """
+
+    __slots__ = ('_controller', 'nbytes', '_released')
+
+    def __init__(self, controller, nbytes):
+        self._controller = controller
+        self.nbytes = nbytes
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self.nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Decides when uploads may start, so a burst of them cannot exhaust the
+    memory of a node that buffers whole files:
+
+    - Each client may start `rate` uploads per second (bursts of `burst`);
+      faster ones are refused at once with the time until they may retry.
+    - At most `max_requests` uploads totalling `max_bytes` (from their
+      Content-Length) run at once. An upload larger than `max_bytes` runs
+      alone, and one of unknown length counts as `max_bytes`.
+    - Uploads that do not fit wait in one FIFO queue per client, and the
+      queues are served in turn, so a client sending many uploads does not
+      delay the others by more than one upload each. At most `max_queued`
+      uploads wait, each for `queue_timeout` seconds at most; the others are
+      refused.
+    """
+
+    def __init__(self, max_bytes=ADMISSION_MAX_INFLIGHT_BYTES, max_requests=ADMISSION_MAX_INFLIGHT_REQUESTS,
+                 max_queued=ADMISSION_MAX_QUEUED, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                 rate=CLIENT_RATE_LIMIT, burst=CLIENT_RATE_BURST):
+        self.max_bytes = max_bytes
+        self.max_requests = max_requests
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.inflight_bytes = 0
+        self.inflight_requests = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._queues = collections.OrderedDict()  # Client -> deque of waiters, in serving order
+        self._buckets = {}
+
+    def acquire(self, client, nbytes):
+        """
+        Waits until an upload of `nbytes` bytes (None: unknown) by `client` may start.
+
+        Returns:
+            AdmissionTicket: To release once the upload is done.
+
+        Raises:
+            AdmissionRejected: If the client exceeds its rate, or the upload cannot be admitted in time.
+        """
+        started = time.monotonic()
+        waiter = self._enter(client, nbytes, None)
+        if not waiter.granted:
+            waiter.wait(self.queue_timeout)
+        return self._admitted(waiter, started)
+
+    async def acquire_async(self, client, nbytes):
+        """
+        Like `acquire`, waiting on the running event loop.
+        """
+        started = time.monotonic()
+        waiter = self._enter(client, nbytes, asyncio.get_running_loop())
+        if not waiter.granted:
+            try:
+                await waiter.wait_async(self.queue_timeout)
+            except asyncio.CancelledError:
+                # The client went away while queued: give up its place, or its admission
+                if not self._leave(waiter):
+                    self._release(waiter.nbytes)
+                raise
+        return self._admitted(waiter, started)
+
+    def _enter(self, client, nbytes, loop):
+        nbytes = self.max_bytes if nbytes is None else nbytes
+        waiter = _Waiter(client, nbytes, loop)
+        with self._lock:
+            now = time.monotonic()
+            if self.rate:
+                wait = self._bucket(client, now).take(self.rate, self.burst, now)
+                if wait:
+                    ADMISSION_REJECTED.labels('rate_limited').inc()
+                    raise AdmissionRejected(f"Client {client} exceeds {self.rate:g} uploads per second",
+                                            'rate_limited', wait)
+            if not self._queues and self._fits(nbytes):
+                self._admit(waiter)
+                return waiter
+            if self.queued >= self.max_queued:
+                ADMISSION_REJECTED.labels('queue_full').inc()
+                raise AdmissionRejected("Too many uploads in progress, try again later", 'queue_full')
+            self._queues.setdefault(client, collections.deque()).append(waiter)
+            self.queued += 1
+            ADMISSION_QUEUED.inc()
+        return waiter
+
+    def _admitted(self, waiter, started):
+        if self._leave(waiter):
+            ADMISSION_REJECTED.labels('timeout').inc()
+            raise AdmissionRejected(f"Upload not admitted within {self.queue_timeout:g} seconds", 'timeout')
+        ADMISSION_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started)
+        return AdmissionTicket(self, waiter.nbytes)
+
+    def _leave(self, waiter):
+        """
+        Removes a waiter from its queue unless it was admitted in the meantime.
+
+        Returns:
+            bool: True if it was removed, False if it was admitted.
+        """
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.client]
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.client]
+            self.queued -= 1
+            ADMISSION_QUEUED.dec()
+            self._dispatch()  # A large upload leaving the head of its queue may let smaller ones in
+            return True
+
+    def _bucket(self, client, now):
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= CLIENT_BUCKETS_MAX:
+                # Full buckets behave like new ones, so dropping them changes nothing
+                idle = self.burst / self.rate
+                self._buckets = {key: value for key, value in self._buckets.items() if now - value.updated < idle}
+            bucket = self._buckets[client] = _TokenBucket(self.burst, now)
+        return bucket
+
+    def _fits(self, nbytes):
+        if not self.inflight_requests:
+            return True
+        if self.max_requests and self.inflight_requests >= self.max_requests:
+            return False
+        return not self.max_bytes or self.inflight_bytes + nbytes <= self.max_bytes
+
+    def _admit(self, waiter):
+        self.inflight_bytes += waiter.nbytes
+        self.inflight_requests += 1
+        ADMISSION_INFLIGHT_BYTES.inc(waiter.nbytes)
+        ADMISSION_INFLIGHT_REQUESTS.inc()
+        waiter.grant()
+
+    def _dispatch(self):
+        """
+        Admits queued uploads, taking the next one of each client in turn,
+        until the one whose turn it is does not fit.
+        """
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            if not self._fits(queue[0].nbytes):
+                return
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self.queued -= 1
+            ADMISSION_QUEUED.dec()
+            self._admit(waiter)
+
+    def _release(self, nbytes):
+        with self._lock:
+            self.inflight_bytes -= nbytes
+            self.inflight_requests -= 1
+            ADMISSION_INFLIGHT_BYTES.dec(nbytes)
+            ADMISSION_INFLIGHT_REQUESTS.dec()
+            self._dispatch()
+
+
+# Upload admission of this process (gateways and masters)
+upload_admission = AdmissionController()
+
+
+def client_id(headers, remote_address):
+    """
+    Returns the client an upload is accounted to: its address, or the
+    X-Client-Id set by a trusted relay (a gateway sending the admin token, or
+    one listed in TRUSTED_PROXIES). Anyone else could pick a new client ID
+    per request to escape their rate limit and queue.
+    """
+    relayed = headers.get(CLIENT_ID_HEADER)
+    if relayed and (remote_address in TRUSTED_PROXIES or admin_error(headers) is None):
+        return relayed
+    return remote_address or "unknown"
+
+
+def relay_headers(headers, remote_address):
+    """
+    Returns the headers a gateway sends to a master with an upload, so that
+    the master accounts it to the same client. They carry the admin token,
+    if one is set, for the master to trust the client ID.
+    """
+    relayed = {CLIENT_ID_HEADER: client_id(headers, remote_address)}
+    if ADMIN_TOKEN:
+        relayed[ADMIN_TOKEN_HEADER] = ADMIN_TOKEN
+    return relayed
+
+
+def rejection_headers(body):
+    """
+    Returns the Retry-After header of a 429 response body from
+    `rejection_body`, to relay a master's refusal to the client.
+    """
+    retry_after = body.get('retry_after') if isinstance(body, dict) else None
+    return {'Retry-After': str(retry_after)} if retry_after else {}
+
+
+def rejection_body(error):
+    return {'error': str(error), 'reason': error.reason, 'retry_after': error.retry_after}
+
+
+def admission_required(view, controller=upload_admission):
+    """
+    Admits requests to a Flask view through `controller`, answering refused
+    ones with a 429 and Retry-After before their body is read.
+    """
+    from flask import jsonify, request
+
+    @functools.wraps(view)
+    def admitted(*args, **kwargs):
+        try:
+            ticket = controller.acquire(client_id(request.headers, request.remote_addr), request.content_length)
+        except AdmissionRejected as e:
+            return jsonify(rejection_body(e)), 429, {'Retry-After': str(e.retry_after)}
+        with ticket:
+            return view(*args, **kwargs)
+    return admitted
+
+
+def aiohttp_admission_required(handler, controller=upload_admission):
+    """
+    Like `admission_required`, for an aiohttp handler.
+    """
+    from aiohttp import web
+
+    @functools.wraps(handler)
+    async def admitted(request):
+        try:
+            ticket = await controller.acquire_async(client_id(request.headers, request.remote), request.content_length)
+        except AdmissionRejected as e:
+            return web.json_response(rejection_body(e), status=429, headers={'Retry-After': str(e.retry_after)})
+        with ticket:
+            return await handler(request)
+    return admitted
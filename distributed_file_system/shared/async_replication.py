@@ -0,0 +1,63 @@
+import asyncio
+
+import aiohttp
+
+from shared.replication import CHAIN_HEADER, CHAIN_HOP_TIMEOUT, encode_chain
+from shared.tracing import inject, span
+
+
+async def post_chunk_async(session, worker_url, chunk_id, chunk_data, headers=None):
+    """
+    Stores a single chunk replica on a worker.
+
+    Raises:
+        aiohttp.ClientError: If the worker could not be reached or refused the chunk.
+    """
+    with span("chunk.replica_write", chunk_id=chunk_id, worker=worker_url):
+        async with session.post(
+            f"{worker_url}/chunks/{chunk_id}", data=chunk_data, headers=inject(dict(headers or {})),
+            timeout=aiohttp.ClientTimeout(total=CHAIN_HOP_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+
+
+async def send_chunk_along_chain_async(session, chunk_id, chunk_data, chain_urls, headers=None):
+    """
+    Asyncio version of `send_chunk_along_chain`: sends a chunk to the head of
+    a replica chain, which forwards it down the rest of the chain. Heads that
+    cannot be reached are skipped.
+
+    Returns:
+        list: IDs of the workers that acknowledged the write, in chain order.
+
+    Raises:
+        aiohttp.ClientError: If no worker of the chain could be reached and
+        acknowledged the write.
+        asyncio.TimeoutError: If the last worker tried timed out.
+    """
+    error = None
+    for index, head_url in enumerate(chain_urls):
+        downstream = chain_urls[index + 1:]
+        request_headers = dict(headers or {})
+        if downstream:
+            request_headers[CHAIN_HEADER] = encode_chain(downstream)
+
+        try:
+            with span("chunk.chain_send", chunk_id=chunk_id, head=head_url, chain_length=len(chain_urls) - index):
+                async with session.post(
+                    f"{head_url}/chunks/{chunk_id}", data=chunk_data, headers=inject(request_headers),
+                    timeout=aiohttp.ClientTimeout(total=CHAIN_HOP_TIMEOUT * (len(chain_urls) - index))
+                ) as response:
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        body = {}
+                    # A failed hop still reports which replicas further down the chain succeeded
+                    if response.status >= 400 and not (body or {}).get('stored_on'):
+                        response.raise_for_status()
+                    return (body or {}).get('stored_on', [])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+    if error is not None:
+        raise error
+    return []
@@ -0,0 +1,39 @@
+import re
+import uuid
+
+# Chunk IDs are "<file uuid>_chunk_<n>"
+CHUNK_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_chunk_\d+$")
+
+# Container chunks holding packed small files are "container_<uuid>"
+CONTAINER_ID_PATTERN = re.compile(r"^container_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def make_chunk_id(file_id, index):
+    """
+    Builds the ID of the chunk at a zero-based index within a file.
+    """
+    return f"{file_id}_chunk_{index + 1}"
+
+
+def make_container_id():
+    """
+    Builds the ID of a new container chunk.
+    """
+    return f"container_{uuid.uuid4()}"
+
+
+def is_container_id(name):
+    """
+    Returns True if a name is a valid container chunk ID.
+    """
+    return bool(CONTAINER_ID_PATTERN.match(name))
+
+
+def is_chunk_id(name):
+    """
+    Returns True if a name is a valid chunk or container chunk ID.
+
+    Workers use this to tell chunk files apart from anything else in their
+    storage directory, and to reject IDs that could escape it.
+    """
+    return bool(CHUNK_ID_PATTERN.match(name)) or is_container_id(name)
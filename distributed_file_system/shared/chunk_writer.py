@@ -0,0 +1,230 @@
+import os
+import queue
+import threading
+import time
+import uuid
+
+from shared.metrics import counter, histogram
+
+WORKER_DURABILITY = os.getenv("WORKER_DURABILITY", "group")  # "none", "group" (batched syncs) or "fsync" (one sync per write)
+DURABILITY_WINDOW_MS = float(os.getenv("DURABILITY_WINDOW_MS", 0))  # Extra wait for writes to join a group sync; those arriving during one join the next anyway
+DURABILITY_MAX_BATCH = int(os.getenv("DURABILITY_MAX_BATCH", 256))  # Writes made durable by one group sync at most
+DURABILITY_MODES = ("none", "group", "fsync")
+TEMP_SUFFIX = ".tmp"  # Chunks being written are named ".<chunk_id>.<random>.tmp" until renamed into place
+
+CHUNK_SYNC_SECONDS = histogram('dfs_chunk_sync_seconds', 'Time to make chunk writes durable, per sync (a whole batch in group mode)')
+CHUNK_SYNC_BATCH = histogram('dfs_chunk_sync_batch_writes', 'Chunk writes made durable by one group sync',
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+CHUNK_SYNCS = counter('dfs_chunk_syncs', 'Durability syncs of chunk storage, by kind (syncfs, fsync)', ('kind',))
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # Not on macOS
+
+
+def _load_syncfs():
+    """
+    Returns libc's syncfs(), which flushes every pending write of one file
+    system with a single journal commit (Linux only), or None.
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        syncfs = libc.syncfs
+    except (OSError, AttributeError):
+        return None
+
+    def call(fd):
+        if syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    return call
+
+
+class _PendingSync:
+    """
+    A write waiting for a group sync, and its outcome.
+    """
+
+    __slots__ = ('path', 'temp_path', 'error', 'done')
+
+    def __init__(self, path, temp_path):
+        self.path = path
+        self.temp_path = temp_path  # Renamed to `path` once durable; None for in-place writes
+        self.error = None
+        self.done = threading.Event()
+
+
+class ChunkWriter:
+    """
+    Writes chunk files to a worker's storage directory.
+
+    A whole chunk is written to a temporary file and renamed into place, so
+    a crash never leaves a torn chunk under its real name: readers see the
+    old chunk or the new one. Leftover temporary files are removed when the
+    writer is created. Writes at an offset (appends to container chunks) are
+    made in place.
+
+    `mode` sets when a write returns:
+    - "none": once the data is in the OS page cache. A crash of the machine
+      may lose recent chunks, but never exposes partial ones.
+    - "group": once the data is on disk. Concurrent writes wait for a single
+      sync thread, which makes every write queued while it was busy (and
+      within `window` more seconds) durable at once: one syncfs() on Linux,
+      else one fsync per file. It then renames them into place and syncs
+      the directory once.
+    - "fsync": once the data is on disk, each write syncing its own file and
+      the directory.
+    """
+
+    def __init__(self, directory, mode=WORKER_DURABILITY, window=DURABILITY_WINDOW_MS / 1000,
+                 max_batch=DURABILITY_MAX_BATCH):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {mode!r}, expected one of {', '.join(DURABILITY_MODES)}")
+        self.directory = directory
+        self.mode = mode
+        self.window = window
+        self.max_batch = max_batch
+        os.makedirs(directory, exist_ok=True)
+        self.remove_temp_files()
+        try:
+            self._dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            self._dir_fd = None  # Directories cannot be opened (Windows); renames are not synced
+        self._syncfs = _load_syncfs() if self._dir_fd is not None else None
+        self.syncs = 0  # Syncs issued so far (file or file system)
+        self._syncs_lock = threading.Lock()
+        self._queue = queue.Queue()
+        if mode == "group":
+            threading.Thread(target=self._run, name="chunk-group-sync", daemon=True).start()
+
+    def remove_temp_files(self):
+        """
+        Removes chunks whose write never completed (e.g. the worker crashed).
+
+        Returns:
+            int: The number of files removed.
+        """
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.') and entry.name.endswith(TEMP_SUFFIX) and entry.is_file():
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def write(self, chunk_id, data):
+        """
+        Writes (or replaces) a whole chunk; returns once it is as durable as the mode requires.
+        """
+        path = os.path.join(self.directory, chunk_id)
+        temp_path = os.path.join(self.directory, f".{chunk_id}.{uuid.uuid4().hex}{TEMP_SUFFIX}")
+        try:
+            with open(temp_path, 'wb') as chunk_file:
+                chunk_file.write(data)
+                if self.mode == "fsync":
+                    chunk_file.flush()
+                    self._sync_file(chunk_file.fileno())
+            if self.mode == "group":
+                self._submit(path, temp_path)
+            else:
+                os.replace(temp_path, path)
+                if self.mode == "fsync":
+                    self._sync_directory()
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def write_at(self, chunk_id, data, offset):
+        """
+        Writes data at an offset of a chunk, creating it if needed. Concurrent
+        writers target disjoint ranges, so the chunk is never truncated.
+        """
+        path = os.path.join(self.directory, chunk_id)
+        created = not os.path.exists(path)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+            if self.mode == "fsync":
+                self._sync_file(fd)
+        finally:
+            os.close(fd)
+        if self.mode == "group":
+            self._submit(path, None)
+        elif self.mode == "fsync" and created:
+            self._sync_directory()
+
+    def _sync_file(self, fd):
+        with CHUNK_SYNC_SECONDS.time():
+            _fdatasync(fd)
+        self._count_sync('fsync')
+
+    def _count_sync(self, kind):
+        CHUNK_SYNCS.labels(kind).inc()
+        with self._syncs_lock:
+            self.syncs += 1
+
+    def _sync_directory(self):
+        if self._dir_fd is not None:
+            os.fsync(self._dir_fd)
+
+    def _submit(self, path, temp_path):
+        pending = _PendingSync(path, temp_path)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._sync_batch(batch)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = pending.error or e
+            for pending in batch:
+                pending.done.set()
+
+    def _sync_batch(self, batch):
+        started = time.perf_counter()
+        if self._syncfs is not None:
+            self._syncfs(self._dir_fd)
+            self._count_sync('syncfs')
+        else:
+            for pending in batch:
+                try:
+                    fd = os.open(pending.temp_path or pending.path, os.O_RDONLY)
+                    try:
+                        _fdatasync(fd)
+                    finally:
+                        os.close(fd)
+                    self._count_sync('fsync')
+                except OSError as e:
+                    pending.error = e
+        renamed = False
+        for pending in batch:
+            if pending.temp_path is not None and pending.error is None:
+                try:
+                    os.replace(pending.temp_path, pending.path)
+                    renamed = True
+                except OSError as e:
+                    pending.error = e
+        if renamed or self._syncfs is None:
+            self._sync_directory()
+        CHUNK_SYNC_SECONDS.observe(time.perf_counter() - started)
+        CHUNK_SYNC_BATCH.observe(len(batch))
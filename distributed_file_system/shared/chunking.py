@@ -0,0 +1,51 @@
+MB = 1024 * 1024
+
+MIN_CHUNK_SIZE = 1 * MB  # Smaller chunks cost more in requests and metadata than they gain
+MAX_CHUNK_SIZE = 64 * MB  # Larger chunks limit parallelism and take long to re-replicate
+TARGET_CHUNKS_PER_WORKER = 4  # Aim for enough chunks to spread a file over the whole cluster
+
+
+def _round_up_to_power_of_two(value):
+    power = 1
+    while power < value:
+        power <<= 1
+    return power
+
+
+def clamp_chunk_size(chunk_size):
+    """
+    Clamps a chunk size in bytes to the supported range.
+    """
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, int(chunk_size)))
+
+
+def choose_chunk_size(file_size, num_workers, hint_mb=None):
+    """
+    Picks the chunk size for a file.
+
+    Small files get small chunks so they still spread across workers; large
+    files get large chunks so they do not turn into thousands of tiny chunks.
+    A client hint, if given, takes precedence but is still clamped, and
+    rounded up to a power of two.
+
+    Args:
+        file_size (int): Size of the file in bytes.
+        num_workers (int): Number of workers available for placement.
+        hint_mb (float): Chunk size requested by the client, in MB.
+
+    Returns:
+        int: Chunk size in bytes, a power of two between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE.
+    """
+    if hint_mb:
+        return _round_up_to_power_of_two(clamp_chunk_size(float(hint_mb) * MB))
+
+    target_chunks = max(1, num_workers * TARGET_CHUNKS_PER_WORKER)
+    chunk_size = _round_up_to_power_of_two(max(1, -(-file_size // target_chunks)))
+    return clamp_chunk_size(chunk_size)
+
+
+def split_ranges(file_size, chunk_size):
+    """
+    Splits a file into (start, end) byte ranges of at most `chunk_size` bytes.
+    """
+    return [(start, min(start + chunk_size, file_size)) for start in range(0, file_size, chunk_size)]
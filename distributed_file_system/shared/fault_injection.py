@@ -0,0 +1,327 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+from shared.admin import admin_required
+from shared.metrics import counter
+
+FAULTS = os.getenv("FAULTS")  # Fault configuration applied at startup, in the format of PUT /admin/faults
+FAULT_SEED = int(os.getenv("FAULT_SEED", 0))  # Seed of the random draws, so a run can be repeated exactly
+THROTTLE_BLOCK_SIZE = 64 * 1024  # Bytes sent between the pauses of a bandwidth-capped response
+
+FAULTS_INJECTED = counter('dfs_faults_injected', 'Faults injected by the fault injection layer, by kind', ('kind',))
+
+
+class FaultRule:
+    """
+    Faults injected into the requests whose path starts with `route` (and
+    whose method is in `methods`, if given). Each matching request is
+    affected with probability `probability`, then:
+
+    - delayed by `latency_ms` plus up to `jitter_ms`
+    - answered with `error_status` with probability `error_rate`
+    - dropped (connection closed, no response) with probability `drop_rate`
+    - hung for `hang_seconds`, or until the faults are changed, with probability `hang_rate`
+    - received and answered at `bandwidth_kbps` at most
+    """
+
+    DEFAULTS = {
+        'route': '',
+        'methods': None,
+        'probability': 1.0,
+        'latency_ms': 0,
+        'jitter_ms': 0,
+        'error_rate': 0,
+        'error_status': 503,
+        'drop_rate': 0,
+        'hang_rate': 0,
+        'hang_seconds': 300,
+        'bandwidth_kbps': 0,
+    }
+    RATES = ('probability', 'error_rate', 'drop_rate', 'hang_rate')
+
+    def __init__(self, spec, seed):
+        unknown = set(spec) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown fault rule fields: {', '.join(sorted(unknown))}")
+        values = dict(self.DEFAULTS, **spec)
+        for name in self.RATES:
+            if not 0 <= values[name] <= 1:
+                raise ValueError(f"{name} must be between 0 and 1")
+        if values['error_rate'] + values['drop_rate'] + values['hang_rate'] > 1:
+            raise ValueError("error_rate, drop_rate and hang_rate must add up to at most 1")
+        for name in ('latency_ms', 'jitter_ms', 'hang_seconds', 'bandwidth_kbps'):
+            if values[name] < 0:
+                raise ValueError(f"{name} must not be negative")
+        if not 400 <= values['error_status'] <= 599:
+            raise ValueError("error_status must be an HTTP error status")
+        self.spec = values
+        self.route = values['route']
+        self.methods = {method.upper() for method in values['methods']} if values['methods'] else None
+        self._random = random.Random(seed)
+
+    def matches(self, method, path):
+        return path.startswith(self.route) and (self.methods is None or method in self.methods)
+
+    def draw(self):
+        """
+        Decides the faults of one request.
+
+        Returns:
+            tuple: (delay in seconds, action: None, 'error', 'drop' or 'hang'), or None if the request is spared.
+        """
+        spec = self.spec
+        if self._random.random() >= spec['probability']:
+            return None
+        delay = (spec['latency_ms'] + self._random.random() * spec['jitter_ms']) / 1000
+        draw = self._random.random()
+        if draw < spec['error_rate']:
+            action = 'error'
+        elif draw < spec['error_rate'] + spec['drop_rate']:
+            action = 'drop'
+        elif draw < spec['error_rate'] + spec['drop_rate'] + spec['hang_rate']:
+            action = 'hang'
+        else:
+            action = None
+        return delay, action
+
+
+class PlannedFaults:
+    """
+    The faults drawn for one request.
+    """
+
+    __slots__ = ('delay', 'action', 'error_status', 'hang_seconds', 'bandwidth', 'released')
+
+    def __init__(self, delay, action, error_status, hang_seconds, bandwidth, released):
+        self.delay = delay
+        self.action = action
+        self.error_status = error_status
+        self.hang_seconds = hang_seconds
+        self.bandwidth = bandwidth  # Bytes per second, 0 for no cap
+        self.released = released  # Set when the fault configuration changes, ending hangs
+
+    def transfer_delay(self, size):
+        return size / self.bandwidth if self.bandwidth and size else 0
+
+
+class FaultInjector:
+    """
+    The faults this process injects into the requests it serves, and whether
+    it suppresses its heartbeats (worker heartbeats to the leader, and the
+    leader's lease renewals on masters).
+
+    The configuration is replaced as a whole at runtime (PUT /admin/faults).
+    Each rule draws from its own generator seeded from `seed` and the rule's
+    position, so the same sequence of requests sees the same faults. Without
+    rules, checking a request costs one attribute lookup.
+    """
+
+    def __init__(self, seed=FAULT_SEED):
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._rules = []
+        self._suppress_heartbeats = False
+        self._released = threading.Event()
+
+    def configure(self, config):
+        """
+        Replaces the fault configuration:
+        {"rules": [{rule fields}, ...], "suppress_heartbeats": bool, "seed": int}.
+        Requests hung by the previous configuration are released.
+
+        Raises:
+            ValueError: If the configuration is malformed.
+        """
+        if not isinstance(config, dict):
+            raise ValueError("The fault configuration must be a JSON object")
+        unknown = set(config) - {'rules', 'suppress_heartbeats', 'seed'}
+        if unknown:
+            raise ValueError(f"Unknown fault configuration fields: {', '.join(sorted(unknown))}")
+        seed = config.get('seed', self.seed)
+        rules = [FaultRule(spec, seed + index) for index, spec in enumerate(config.get('rules', []))]
+        with self._lock:
+            self.seed = seed
+            self._rules = rules
+            self._suppress_heartbeats = bool(config.get('suppress_heartbeats', False))
+            released, self._released = self._released, threading.Event()
+        released.set()
+        return self.snapshot()
+
+    def clear(self):
+        return self.configure({})
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'rules': [rule.spec for rule in self._rules],
+                'suppress_heartbeats': self._suppress_heartbeats,
+                'seed': self.seed,
+            }
+
+    def plan(self, method, path):
+        """
+        Returns the faults to inject into a request, or None.
+        """
+        if not self._rules:
+            return None
+        with self._lock:
+            for rule in self._rules:
+                if rule.matches(method, path):
+                    drawn = rule.draw()
+                    if drawn is None:
+                        return None
+                    delay, action = drawn
+                    spec = rule.spec
+                    planned = PlannedFaults(delay, action, spec['error_status'], spec['hang_seconds'],
+                                            spec['bandwidth_kbps'] * 1024, self._released)
+                    break
+            else:
+                return None
+        if planned.delay:
+            FAULTS_INJECTED.labels('latency').inc()
+        if planned.action:
+            FAULTS_INJECTED.labels(planned.action).inc()
+        if planned.bandwidth:
+            FAULTS_INJECTED.labels('bandwidth').inc()
+        return planned
+
+    def suppress_heartbeat(self):
+        """
+        Returns True if a heartbeat (or lease renewal) must be skipped.
+        """
+        if self._suppress_heartbeats:
+            FAULTS_INJECTED.labels('heartbeat').inc()
+            return True
+        return False
+
+
+# Faults injected by this process
+faults = FaultInjector()
+if FAULTS:
+    faults.configure(json.loads(FAULTS))
+
+
+def _throttled(body, bandwidth):
+    """
+    Yields a response body in blocks, pausing after each so that it is sent
+    at `bandwidth` bytes per second at most.
+    """
+    try:
+        for data in body:
+            for offset in range(0, len(data), THROTTLE_BLOCK_SIZE):
+                block = data[offset:offset + THROTTLE_BLOCK_SIZE]
+                yield block
+                time.sleep(len(block) / bandwidth)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def _configure_from_request(injector, config):
+    if config is None:
+        return {'error': 'Expected the fault configuration as a JSON body'}, 400
+    try:
+        return injector.configure(config), 200
+    except (ValueError, TypeError) as e:
+        return {'error': f"Invalid fault configuration: {e}"}, 400
+
+
+def fault_inject_flask_app(app, injector=faults):
+    """
+    Injects the configured faults into every request of a Flask app (but
+    /admin/*), and serves the configuration:
+
+    - GET /admin/faults returns it.
+    - PUT /admin/faults replaces it (see FaultInjector.configure).
+    - DELETE /admin/faults removes every fault.
+
+    The admin routes require the admin token (see shared/admin.py).
+    """
+    from flask import Response, g, jsonify, request
+
+    @app.before_request
+    def inject_request_faults():
+        if request.path.startswith('/admin/'):
+            return None
+        planned = injector.plan(request.method, request.path)
+        if planned is None:
+            return None
+        time.sleep(planned.delay + planned.transfer_delay(request.content_length))
+        g.fault_bandwidth = planned.bandwidth
+        if planned.action == 'hang':
+            planned.released.wait(planned.hang_seconds)
+        elif planned.action == 'error':
+            return jsonify({'error': 'Injected fault'}), planned.error_status
+        elif planned.action == 'drop':
+            connection = request.environ.get('werkzeug.socket')
+            if connection is None:
+                # Not served by the werkzeug server (e.g. bridged from aiohttp): fail the request instead
+                return jsonify({'error': 'Injected fault (connection drop)'}), 502
+            connection.shutdown(socket.SHUT_RDWR)
+            return Response(status=500)  # Never reaches the client
+        return None
+
+    @app.after_request
+    def throttle_response(response):
+        bandwidth = g.pop('fault_bandwidth', 0)
+        if bandwidth:
+            response.response = _throttled(response.response, bandwidth)
+            response.direct_passthrough = False
+        return response
+
+    @app.route('/admin/faults', methods=['GET'])
+    @admin_required
+    def get_faults():
+        return jsonify(injector.snapshot()), 200
+
+    @app.route('/admin/faults', methods=['PUT'])
+    @admin_required
+    def put_faults():
+        body, status = _configure_from_request(injector, request.get_json(silent=True))
+        return jsonify(body), status
+
+    @app.route('/admin/faults', methods=['DELETE'])
+    @admin_required
+    def delete_faults():
+        return jsonify(injector.clear()), 200
+
+    return app
+
+
+def aiohttp_fault_middleware(injector=faults, skip=()):
+    """
+    Returns an aiohttp middleware injecting faults like
+    `fault_inject_flask_app`. Requests routed to a handler in `skip` are left
+    alone (e.g. ones passed on to a Flask app that injects its own).
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def fault_middleware(request, handler):
+        if request.match_info.handler in skip or request.path.startswith('/admin/'):
+            return await handler(request)
+        planned = injector.plan(request.method, request.path)
+        if planned is None:
+            return await handler(request)
+        await asyncio.sleep(planned.delay + planned.transfer_delay(request.content_length))
+        if planned.action == 'hang':
+            deadline = time.monotonic() + planned.hang_seconds
+            while not planned.released.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+        elif planned.action == 'error':
+            return web.json_response({'error': 'Injected fault'}, status=planned.error_status)
+        elif planned.action == 'drop':
+            request.transport.close()
+            return web.Response(status=500)  # Never reaches the client
+        response = await handler(request)
+        if planned.bandwidth:
+            await asyncio.sleep(planned.transfer_delay(response.content_length or response.body_length))
+        return response
+
+    return fault_middleware
+
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+# Header carrying the leader's fencing token on mutating requests to workers
+FENCING_HEADER = "X-Fencing-Token"
+
+# Header naming the metadata partition whose leader issued the token (0 if absent)
+FENCING_PARTITION_HEADER = "X-Fencing-Partition"
+
+
+class FencingTokenGuard:
+    """
+    Remembers the highest fencing token seen per metadata partition and
+    rejects requests carrying an older one, so a deposed leader cannot write
+    after a new one was elected.
+
+    Each partition has its own leader lease and token sequence, so tokens are
+    only compared within a partition. The highest tokens are persisted to
+    `state_path` (if given) so the guard survives restarts. A state file that
+    exists but cannot be read raises ValueError rather than starting over
+    from no tokens, which would admit a deposed leader again.
+    """
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        self.highest = {}  # partition -> highest token seen
+        self._lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            try:
+                with open(state_path, 'r') as state_file:
+                    state = json.loads(state_file.read().strip() or '{}')
+                # Older versions stored a single token for the only leader
+                self.highest = {'0': state} if isinstance(state, int) else {str(k): int(v) for k, v in state.items()}
+            except (OSError, ValueError, AttributeError, TypeError) as e:
+                raise ValueError(f"Unreadable fencing token state {state_path}: {e}") from e
+
+    def admit(self, token_value, partition_value=None):
+        """
+        Checks a token (and its partition) from request headers.
+
+        Requests without a token are admitted; they do not come from a leader.
+
+        Returns:
+            bool: False if the token is older than one already seen for its partition.
+        """
+        if token_value is None:
+            return True
+        try:
+            token = int(token_value)
+            partition = str(int(partition_value or 0))
+        except (TypeError, ValueError):
+            return False
+
+        with self._lock:
+            highest = self.highest.get(partition, 0)
+            if token < highest:
+                return False
+            if token > highest:
+                self.highest[partition] = token
+                self._persist()
+            return True
+
+    def _persist(self):
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.highest, state_file)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,83 @@
+import bisect
+import hashlib
+import itertools
+
+DEFAULT_VNODES = 64  # Virtual nodes per unit of weight; more vnodes spread keys more evenly
+
+
+def hash_key(key):
+    """
+    Maps a string onto the 64-bit ring. Stable across processes and restarts,
+    unlike Python's built-in hash().
+    """
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+class ConsistentHashRing:
+    """
+    Consistent hash ring with virtual nodes.
+
+    Each node is placed on the ring `vnodes * weight` times; a key belongs to
+    the first node clockwise from its hash. Adding or removing a node only
+    moves the keys of that node's ring segments.
+    """
+
+    def __init__(self, nodes=(), vnodes=DEFAULT_VNODES, weights=None):
+        self.vnodes = vnodes
+        self.weights = {}
+        self._hashes = []  # Sorted vnode positions
+        self._owners = []  # Node owning the vnode at the same index
+        for node in nodes:
+            self.add_node(node, (weights or {}).get(node, 1))
+
+    @property
+    def nodes(self):
+        return list(self.weights)
+
+    def add_node(self, node, weight=1):
+        if node in self.weights:
+            self.remove_node(node)
+        self.weights[node] = weight
+        for replica in range(max(1, int(self.vnodes * weight))):
+            position = hash_key(f"{node}#{replica}")
+            index = bisect.bisect(self._hashes, position)
+            self._hashes.insert(index, position)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node):
+        if self.weights.pop(node, None) is None:
+            return
+        kept = [(position, owner) for position, owner in zip(self._hashes, self._owners) if owner != node]
+        self._hashes = [position for position, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def get_node(self, key):
+        """
+        Returns the node owning a key, or None if the ring is empty.
+        """
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, hash_key(key)) % len(self._hashes)
+        return self._owners[index]
+
+    def walk(self, key):
+        """
+        Yields each node once, in ring order clockwise from the key.
+        """
+        if not self._hashes:
+            return
+        start = bisect.bisect(self._hashes, hash_key(key))
+        seen = set()
+        for offset in range(len(self._hashes)):
+            owner = self._owners[(start + offset) % len(self._hashes)]
+            if owner not in seen:
+                seen.add(owner)
+                yield owner
+                if len(seen) == len(self.weights):
+                    return
+
+    def get_nodes(self, key, count):
+        """
+        Returns up to `count` distinct nodes, walking clockwise from the key.
+        """
+        return list(itertools.islice(self.walk(key), count))
@@ -0,0 +1,290 @@
+import contextvars
+import os
+import threading
+import time
+
+from shared.metrics import counter, gauge, histogram
+
+# Header carrying the I/O priority class of a request to a worker (absent: foreground)
+IO_PRIORITY_HEADER = "X-IO-Priority"
+
+FOREGROUND = "foreground"  # Client reads and writes
+BACKGROUND = "background"  # Re-replication, compaction, garbage collection
+
+IO_FOREGROUND_MAX_INFLIGHT = int(os.getenv("IO_FOREGROUND_MAX_INFLIGHT", 64))  # Concurrent foreground chunk operations (0: no limit)
+IO_FOREGROUND_MAX_QUEUED = int(os.getenv("IO_FOREGROUND_MAX_QUEUED", 256))  # Foreground operations waiting for a slot before 503s (0: no limit)
+IO_FOREGROUND_BANDWIDTH_MBPS = float(os.getenv("IO_FOREGROUND_BANDWIDTH_MBPS", 0))  # Foreground bytes per second, in MB (0: no limit)
+IO_FOREGROUND_IOPS = float(os.getenv("IO_FOREGROUND_IOPS", 0))  # Foreground operations per second (0: no limit)
+IO_BACKGROUND_MAX_INFLIGHT = int(os.getenv("IO_BACKGROUND_MAX_INFLIGHT", 2))  # Concurrent background chunk operations
+IO_BACKGROUND_MAX_QUEUED = int(os.getenv("IO_BACKGROUND_MAX_QUEUED", 64))  # Background operations waiting for a slot before 503s
+IO_BACKGROUND_BANDWIDTH_MBPS = float(os.getenv("IO_BACKGROUND_BANDWIDTH_MBPS", 20))  # Background bytes per second, in MB
+IO_BACKGROUND_IOPS = float(os.getenv("IO_BACKGROUND_IOPS", 100))  # Background operations per second
+IO_YIELD_MAX_SECONDS = float(os.getenv("IO_YIELD_MAX_SECONDS", 2))  # Longest a background operation yields to foreground ones
+IO_BURST_SECONDS = 1  # Unused budget of a class that may be spent at once, in seconds of its rate
+
+IO_QUEUE_WAIT_SECONDS = histogram('dfs_io_queue_wait_seconds', 'Time a chunk operation waited for its I/O slot and budget, by class', ('io_class',))
+IO_INFLIGHT = gauge('dfs_io_inflight', 'Chunk operations holding an I/O slot, by class', ('io_class',))
+IO_QUEUED = gauge('dfs_io_queued', 'Chunk operations waiting for an I/O slot, by class', ('io_class',))
+IO_REJECTED = counter('dfs_io_rejected', 'Chunk operations refused because their I/O queue was full, by class', ('io_class',))
+IO_BYTES = counter('dfs_io_bytes', 'Chunk bytes read and written, by I/O class', ('io_class',))
+
+
+class IOQueueFull(Exception):
+    """
+    Raised when an I/O class already has as many operations waiting as it may queue.
+    """
+
+
+class _Pacer:
+    """
+    Spaces out the operations of a class so that it consumes at most `rate`
+    units (bytes or operations) per second on average, allowing bursts of
+    IO_BURST_SECONDS of unused budget.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._budget_time = 0.0  # When the budget spent so far is paid back
+
+    def reserve(self, amount):
+        """
+        Spends `amount` units of budget.
+
+        Returns:
+            float: Seconds the operation must wait before it starts.
+        """
+        if not self.rate or not amount:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._budget_time = max(self._budget_time, now) + amount / self.rate
+            return max(0, self._budget_time - now - IO_BURST_SECONDS)
+
+
+class IOClass:
+    """
+    A priority class of chunk operations, with its limits. A limit of 0 means none.
+    """
+
+    def __init__(self, name, rank, max_inflight=0, max_queued=0, bandwidth=0, iops=0):
+        self.name = name
+        self.rank = rank  # Lower ranks are served first
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.bandwidth = _Pacer(bandwidth)  # Bytes per second
+        self.iops = _Pacer(iops)
+        self.inflight = 0
+        self.queued = 0
+        self.wait_seconds = IO_QUEUE_WAIT_SECONDS.labels(name)
+        self.inflight_gauge = IO_INFLIGHT.labels(name)
+        self.queued_gauge = IO_QUEUED.labels(name)
+        self.rejected = IO_REJECTED.labels(name)
+        self.bytes = IO_BYTES.labels(name)
+
+
+class IOSlot:
+    """
+    The right of one operation to use the disk, held until released (or the
+    `with` block exits). Releasing twice is harmless.
+    """
+
+    __slots__ = ('_scheduler', '_io_class', '_released')
+
+    def __init__(self, scheduler, io_class):
+        self._scheduler = scheduler
+        self._io_class = io_class
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self._io_class)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _ReleasingBody:
+    """
+    A response body that releases an I/O slot when the server closes it,
+    i.e. once it has been sent or the client went away.
+    """
+
+    def __init__(self, body, slot):
+        self.body = body
+        self.slot = slot
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.slot.release()
+
+
+def release_when_sent(response, slot):
+    """
+    Keeps an I/O slot until a Flask response's body has been sent. Unlike
+    `response.call_on_close`, this also works for send_file() responses,
+    which the server closes directly.
+    """
+    response.response = _ReleasingBody(response.response, slot)
+    return response
+
+
+class IOScheduler:
+    """
+    Orders the chunk operations of a worker by priority class, so background
+    traffic yields to client requests on the disk and network:
+
+    - Each class runs at most `max_inflight` operations at once; at most
+      `max_queued` more wait for a slot, and further ones are refused
+      (IOQueueFull) so callers back off instead of piling up.
+    - An operation does not start while a class of higher priority has
+      operations running or waiting, unless it has yielded for `max_yield`
+      seconds, so background work is slowed down but never starved.
+    - Once it has a slot, an operation waits until its class's bandwidth
+      and IOPS budgets allow its bytes and operation count.
+    """
+
+    def __init__(self, classes, max_yield=IO_YIELD_MAX_SECONDS):
+        self.classes = {io_class.name: io_class for io_class in classes}
+        self.max_yield = max_yield
+        self._condition = threading.Condition()
+
+    def io_class(self, name):
+        """
+        Returns the class of a priority header value (None: foreground).
+
+        Raises:
+            ValueError: If there is no such class.
+        """
+        io_class = self.classes.get(name or FOREGROUND)
+        if io_class is None:
+            raise ValueError(f"Unknown I/O priority {name!r}, expected one of {', '.join(self.classes)}")
+        return io_class
+
+    def acquire(self, io_class, nbytes=0, ops=1):
+        """
+        Waits until an operation of `io_class` moving `nbytes` bytes (and
+        counting as `ops` operations) may start.
+
+        Returns:
+            IOSlot: To release once the operation is done.
+
+        Raises:
+            IOQueueFull: If too many operations of the class are already waiting.
+        """
+        started = time.monotonic()
+        yield_deadline = started + self.max_yield
+        with self._condition:
+            if io_class.max_queued and io_class.queued >= io_class.max_queued:
+                io_class.rejected.inc()
+                raise IOQueueFull(f"Too many queued {io_class.name} I/O operations")
+            io_class.queued += 1
+            io_class.queued_gauge.inc()
+            try:
+                while True:
+                    wait = self._wait_time(io_class, yield_deadline)
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+            finally:
+                io_class.queued -= 1
+                io_class.queued_gauge.dec()
+            io_class.inflight += 1
+            io_class.inflight_gauge.inc()
+        slot = IOSlot(self, io_class)
+        try:
+            delay = max(io_class.bandwidth.reserve(nbytes), io_class.iops.reserve(ops))
+            if delay:
+                time.sleep(delay)
+        except BaseException:
+            slot.release()
+            raise
+        io_class.bytes.inc(nbytes)
+        io_class.wait_seconds.observe(time.monotonic() - started)
+        return slot
+
+    def _wait_time(self, io_class, yield_deadline):
+        """
+        Returns 0 if an operation of `io_class` may start now, else how long
+        to wait before checking again (None: until a slot is released).
+        """
+        if io_class.max_inflight and io_class.inflight >= io_class.max_inflight:
+            return None
+        remaining = yield_deadline - time.monotonic()
+        if remaining <= 0:
+            return 0
+        for other in self.classes.values():
+            if other.rank < io_class.rank and (other.inflight or other.queued):
+                return remaining
+        return 0
+
+    def _release(self, io_class):
+        with self._condition:
+            io_class.inflight -= 1
+            io_class.inflight_gauge.dec()
+            self._condition.notify_all()
+
+
+# Chunk I/O scheduler of this process (workers)
+io_scheduler = IOScheduler([
+    IOClass(FOREGROUND, 0, IO_FOREGROUND_MAX_INFLIGHT, IO_FOREGROUND_MAX_QUEUED,
+            IO_FOREGROUND_BANDWIDTH_MBPS * 1024 * 1024, IO_FOREGROUND_IOPS),
+    IOClass(BACKGROUND, 1, IO_BACKGROUND_MAX_INFLIGHT, IO_BACKGROUND_MAX_QUEUED,
+            IO_BACKGROUND_BANDWIDTH_MBPS * 1024 * 1024, IO_BACKGROUND_IOPS),
+])
+
+# Priority class of the chunk requests made by the current thread (masters)
+_io_priority = contextvars.ContextVar('io_priority', default=FOREGROUND)
+
+
+def set_io_priority(name):
+    """
+    Sets the priority class of the chunk requests the current thread makes
+    from now on, e.g. BACKGROUND at the start of a background job's thread.
+    """
+    _io_priority.set(name)
+
+
+def io_priority_headers(headers=None):
+    """
+    Returns request headers with the priority class of the current thread added.
+    """
+    result = dict(headers or {})
+    priority = _io_priority.get()
+    if priority != FOREGROUND:
+        result[IO_PRIORITY_HEADER] = priority
+    return result
+
+
+def prioritize_flask_app(app, scheduler=io_scheduler):
+    """
+    Resolves the I/O priority class of every request of a Flask app into
+    `g.io_class` (400 for unknown classes), for its handlers to acquire
+    slots with, and answers requests refused by a full queue with a 503
+    and Retry-After.
+    """
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def resolve_io_class():
+        try:
+            g.io_class = scheduler.io_class(request.headers.get(IO_PRIORITY_HEADER))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return None
+
+    @app.errorhandler(IOQueueFull)
+    def io_queue_full(error):
+        return jsonify({'error': str(error)}), 503, {'Retry-After': '1'}
+
+    return app
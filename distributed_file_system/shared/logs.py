@@ -0,0 +1,217 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from shared.metrics import counter
+from shared.tracing import current_span
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_FILE = os.getenv("LOG_FILE")  # Optional file the records are also written to, with rotation
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024))  # The log file is rotated at this size
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))  # Rotated log files kept
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # Records waiting for the writer; more are dropped
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 5))  # Records per second of each rate-limited event (per-chunk logs)
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", 20))  # Records a rate-limited event may log at once after being quiet
+
+LOG_RECORDS_DROPPED = counter('dfs_log_records_dropped', 'Log records dropped because the log queue was full')
+LOG_RECORDS_SUPPRESSED = counter('dfs_log_records_suppressed', 'Rate-limited log records not written, by event', ('event',))
+
+# Attributes of every LogRecord; anything else on a record came from `extra` and is written as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'service', 'trace_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one compact JSON object: time, level, service,
+    logger, message, trace ID (in traced requests), the fields passed in
+    `extra`, and the exception if any.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'service': getattr(record, 'service', _state['service']),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            entry['trace_id'] = trace_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(service)s %(name)s: %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'service'):
+            record.service = _state['service']
+        return super().format(record)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the background writer. The calling thread only merges
+    the message arguments (and renders a traceback, if any); formatting and
+    I/O happen on the writer thread. When the queue is full, records are
+    dropped and counted rather than blocking a request.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.service = _state['service']
+        span = current_span()
+        record.trace_id = span.trace_id if span is not None else None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class RateLimitedLogger:
+    """
+    Logs events that may happen for every chunk (stores, reads, per-chunk
+    failures) at most LOG_RATE_LIMIT times per second each, with bursts of
+    LOG_RATE_BURST. The next record written for an event reports how many
+    were suppressed in between (`suppressed` field).
+    """
+
+    def __init__(self, logger, rate=LOG_RATE_LIMIT, burst=LOG_RATE_BURST):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}  # event -> [tokens, last refill, suppressed since last record]
+
+    def _admit(self, event):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return None
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            return suppressed
+
+    def log(self, level, event, msg, *args, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        suppressed = self._admit(event)
+        if suppressed is None:
+            LOG_RECORDS_SUPPRESSED.labels(event).inc()
+            return
+        fields['event'] = event
+        if suppressed:
+            fields['suppressed'] = suppressed
+        self.logger.log(level, msg, *args, extra=fields)
+
+    def info(self, event, msg, *args, **fields):
+        self.log(logging.INFO, event, msg, *args, **fields)
+
+    def warning(self, event, msg, *args, **fields):
+        self.log(logging.WARNING, event, msg, *args, **fields)
+
+    def error(self, event, msg, *args, **fields):
+        self.log(logging.ERROR, event, msg, *args, **fields)
+
+
+# Logging setup of this process: the queue, its writer thread and the service name
+_state = {'service': 'unknown', 'queue': None, 'listener': None, 'handlers': None}
+_setup_lock = threading.Lock()
+
+
+def _output_handlers():
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        directory = os.path.dirname(LOG_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _start_writer():
+    _state['queue'] = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _state['listener'] = logging.handlers.QueueListener(_state['queue'], *_state['handlers'])
+    _state['listener'].start()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(_state['queue']))
+
+
+def _stop_writer():
+    listener = _state['listener']
+    if listener is not None:
+        _state['listener'] = None
+        listener.stop()  # Writes the records still queued
+
+
+def _restart_writer_after_fork():
+    # The writer thread does not survive a fork; the child gets its own queue and writer
+    if _state['listener'] is not None:
+        _state['listener'] = None
+        _start_writer()
+
+
+def configure_logging(service):
+    """
+    Sends the records of every logger of this process (including Flask's
+    and aiohttp's) through a queue to a background writer, which formats
+    them (LOG_FORMAT) and writes them to stdout and, if LOG_FILE is set, to
+    a rotating file. Safe to call again, e.g. to change the service name.
+
+    Returns:
+        logging.Logger: The logger of the service.
+    """
+    with _setup_lock:
+        _state['service'] = service
+        if _state['listener'] is None:
+            _state['handlers'] = _output_handlers()
+            root = logging.getLogger()
+            root.setLevel(LOG_LEVEL)
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            _start_writer()
+            atexit.register(_stop_writer)
+            if hasattr(os, "register_at_fork"):  # Not on Windows
+                os.register_at_fork(after_in_child=_restart_writer_after_fork)
+    return logging.getLogger('dfs')
+
+
+def get_logger(name=None):
+    """
+    Returns the logger of a component (dfs.<name>), for modules shared by services.
+    """
+    return logging.getLogger(f'dfs.{name}' if name else 'dfs')
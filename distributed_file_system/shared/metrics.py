@@ -0,0 +1,349 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# Default histogram buckets (seconds), from sub-millisecond cache hits to slow chunk transfers
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Content type of the Prometheus text exposition format served on /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Timer:
+    """
+    Context manager observing the elapsed time of its block on a histogram.
+    """
+
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class _InProgress:
+    """
+    Context manager counting its block as in progress on a gauge.
+    """
+
+    __slots__ = ('gauge',)
+
+    def __init__(self, gauge):
+        self.gauge = gauge
+
+    def __enter__(self):
+        self.gauge.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self.gauge.dec()
+
+
+class CounterValue:
+    __slots__ = ('_lock', '_value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def samples(self, name, labels):
+        return [(name + '_total', labels, self._value)]
+
+
+class GaugeValue:
+    __slots__ = ('_lock', '_value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = value
+
+    def track_inprogress(self):
+        return _InProgress(self)
+
+    def samples(self, name, labels):
+        return [(name, labels, self._value)]
+
+
+class HistogramValue:
+    """
+    Bucket counts are allocated once, so an observation is a bisect and two
+    additions under an uncontended lock.
+    """
+
+    __slots__ = ('_lock', '_bounds', '_counts', '_sum')
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)  # The last slot counts values above every bound
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        samples, cumulative = [], 0
+        for bound, count in zip(self._bounds + (float('inf'),), counts):
+            cumulative += count
+            samples.append((name + '_bucket', labels + (('le', _format_value(bound)),), cumulative))
+        samples.append((name + '_sum', labels, total))
+        samples.append((name + '_count', labels, cumulative))
+        return samples
+
+
+class Metric(ABC):
+    """
+    A named metric with one value per combination of label values.
+
+    Resolve the labels of a hot path once (`labels(...)`) and keep the
+    returned value; a metric without labels can be used directly.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    @abstractmethod
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                value = self._values.setdefault(values, self._new_value())
+        return value
+
+    def __getattr__(self, attribute):
+        # inc / dec / set / observe / time / track_inprogress of an unlabelled metric
+        if attribute.startswith('_') or self.labelnames:
+            raise AttributeError(attribute)
+        return getattr(self._default, attribute)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values_by_labels = sorted(self._values.items())
+        for values, value in values_by_labels:
+            for sample_name, labels, sample in value.samples(self.name, tuple(zip(self.labelnames, values))):
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(sample)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_value(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_value(self):
+        return HistogramValue(self.buckets)
+
+
+class MetricsRegistry:
+    """
+    The metrics of one process, rendered together on /metrics.
+
+    Registering a name twice returns the existing metric, so modules shared
+    by several servers can declare the metrics they record at import time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+# Metrics of this process
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+HTTP_REQUESTS = counter('dfs_http_requests', 'HTTP requests served, by route and status', ('method', 'route', 'status'))
+HTTP_REQUEST_SECONDS = histogram('dfs_http_request_seconds', 'Time to serve an HTTP request, by route', ('route',))
+HTTP_IN_FLIGHT = gauge('dfs_http_requests_in_flight', 'HTTP requests being served')
+HTTP_RECEIVED_BYTES = counter('dfs_http_received_bytes', 'Bytes of HTTP request bodies received')
+HTTP_SENT_BYTES = counter('dfs_http_sent_bytes', 'Bytes of HTTP response bodies sent (when their length is known)')
+
+
+def render():
+    """
+    Returns the metrics of this process in the Prometheus text format.
+    """
+    return REGISTRY.render()
+
+
+def record_request(method, route, status, started, received_bytes, sent_bytes):
+    HTTP_REQUESTS.labels(method, route, status).inc()
+    HTTP_REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started)
+    if received_bytes:
+        HTTP_RECEIVED_BYTES.inc(received_bytes)
+    if sent_bytes:
+        HTTP_SENT_BYTES.inc(sent_bytes)
+
+
+def instrument_flask_app(app):
+    """
+    Records every request of a Flask app (count, latency, in flight, bytes)
+    and serves this process's metrics on GET /metrics. Call it right after
+    creating the app, so its hooks run before the app's own.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            record_request(request.method, route, response.status_code, started,
+                           request.content_length, response.content_length)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('metrics_started', None) is not None:
+            HTTP_IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    return app
+
+
+def aiohttp_metrics_middleware(skip=()):
+    """
+    Returns an aiohttp middleware recording every request like
+    `instrument_flask_app`. Requests routed to a handler in `skip` are not
+    recorded (e.g. ones passed on to an instrumented Flask app).
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def metrics_middleware(request, handler):
+        if request.match_info.handler in skip:
+            return await handler(request)
+        started = time.perf_counter()
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        status, sent_bytes = 500, 0
+        HTTP_IN_FLIGHT.inc()
+        try:
+            response = await handler(request)
+            status = response.status
+            sent_bytes = response.content_length if response.content_length is not None else response.body_length
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            record_request(request.method, route, status, started, request.content_length, sent_bytes)
+
+    return metrics_middleware
+
+
+async def aiohttp_metrics_handler(request):
+    from aiohttp import web
+    return web.Response(body=render().encode(), headers={'Content-Type': CONTENT_TYPE})
@@ -0,0 +1,38 @@
+import os
+from functools import lru_cache
+
+from shared.hash_ring import ConsistentHashRing
+
+# Number of metadata partitions; every master and the gateway must use the same value
+METADATA_PARTITIONS = max(1, int(os.getenv("METADATA_PARTITIONS", 1)))
+
+# Partition whose leader also runs the cluster-wide jobs (worker liveness, orphan purge)
+CLUSTER_PARTITION = 0
+
+PARTITION_VNODES = 512  # Few partitions need many virtual nodes each to split the namespace evenly
+
+
+@lru_cache(maxsize=None)
+def _partition_ring(partition_count):
+    return ConsistentHashRing(range(partition_count), vnodes=PARTITION_VNODES)
+
+
+def partition_for(file_id, partition_count=METADATA_PARTITIONS):
+    """
+    Returns the metadata partition owning a file, by consistent hashing of its ID.
+    """
+    if partition_count == 1:
+        return 0
+    return _partition_ring(partition_count).get_node(file_id)
+
+
+def partition_priority(master_ids, partition):
+    """
+    Orders masters by Bully priority for a partition, lowest first.
+
+    The order is rotated per partition, so with as many partitions as masters
+    each master is the preferred leader of a different partition.
+    """
+    ranked = sorted(master_ids)
+    shift = partition % len(ranked)
+    return ranked[shift:] + ranked[:shift]
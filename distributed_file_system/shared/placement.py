@@ -0,0 +1,61 @@
+import os
+import random
+
+from shared.hash_ring import ConsistentHashRing
+
+# "random" samples replica workers per chunk; "hash" derives them from the chunk ID on a consistent hash ring
+PLACEMENT_MODE = os.getenv("PLACEMENT_MODE", "random")
+
+PLACEMENT_VNODES = int(os.getenv("PLACEMENT_VNODES", 128))  # Virtual nodes per worker of weight 1
+
+
+def parse_weights(value):
+    """
+    Parses "worker_1=2,worker_4=0.5" into {"worker_1": 2.0, "worker_4": 0.5}.
+    Workers that are not listed have weight 1.
+    """
+    weights = {}
+    for entry in (value or "").split(","):
+        if entry.strip():
+            worker_id, weight = entry.split("=")
+            weights[worker_id.strip()] = float(weight)
+    return weights
+
+
+# Relative capacity of workers on the ring; every master and the gateway must use the same value
+PLACEMENT_WEIGHTS = parse_weights(os.getenv("PLACEMENT_WEIGHTS"))
+
+
+def build_worker_ring(worker_ids, weights=None, vnodes=PLACEMENT_VNODES):
+    """
+    Builds the placement ring over a set of workers.
+
+    The ring only depends on the worker IDs, weights and vnode count, so
+    every process with the same membership computes the same placements.
+    """
+    weights = PLACEMENT_WEIGHTS if weights is None else weights
+    return ConsistentHashRing(sorted(worker_ids), vnodes=vnodes, weights=weights)
+
+
+def hash_placement(ring, chunk_id, count, eligible=None, exclude=()):
+    """
+    Returns up to `count` workers for a chunk, walking the ring clockwise
+    from the chunk ID and skipping workers that are not eligible (e.g.
+    inactive or suspected) or excluded (e.g. already holding the chunk).
+    """
+    placement = []
+    for worker_id in ring.walk(chunk_id):
+        if worker_id in exclude or (eligible is not None and worker_id not in eligible):
+            continue
+        placement.append(worker_id)
+        if len(placement) == count:
+            break
+    return placement
+
+
+def random_placement(candidates, count, exclude=()):
+    """
+    Returns `count` distinct workers sampled from the candidates.
+    """
+    candidates = [worker_id for worker_id in candidates if worker_id not in exclude]
+    return random.sample(candidates, min(count, len(candidates)))
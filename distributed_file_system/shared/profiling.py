@@ -0,0 +1,541 @@
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from shared.admin import admin_error, admin_required
+
+PROFILE_DEFAULT_SECONDS = float(os.getenv("PROFILE_DEFAULT_SECONDS", 10))  # Length of a profiling window by default
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 120))  # Longest window that can be requested
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))  # Seconds between stack samples
+PROFILE_MIN_SAMPLE_INTERVAL = 0.001  # Faster sampling would cost more than the code being profiled
+PROFILE_MAX_DEPTH = 64  # Innermost frames kept per sampled stack
+PROFILE_REQUEST_BUFFER = 20  # Profiles of single requests kept for GET /admin/profile/requests/<id>
+MEMORY_MAX_FRAMES = 25  # Deepest traceback tracemalloc may record per allocation
+
+# Before Python 3.12, cProfile traces the thread that enables it; since, it traces every thread
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+
+# Request header asking for the request to be profiled (with the admin token)
+PROFILE_HEADER = "X-Profile"
+
+# Response header with the ID of the request's profile
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Innermost frames of threads blocked waiting (not using the CPU), skipped by the sampler unless idle=1
+IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'),
+    ('selectors.py', 'select'), ('socket.py', 'accept'), ('socket.py', 'readinto'),
+    ('socketserver.py', 'serve_forever'), ('ssl.py', 'read'), ('base_events.py', '_run_once'),
+    ('connection.py', 'recv_bytes'), ('connection.py', '_recv'), ('thread.py', '_worker'),
+}
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread of the process from a background
+    thread. Each sample is a dictionary update per thread, so the profiled
+    code does not slow down beyond the sampler's share of the GIL.
+    """
+
+    def __init__(self, interval, include_idle=False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = 0
+        self.self_counts = collections.Counter()  # Innermost function -> samples
+        self.total_counts = collections.Counter()  # Function anywhere on the stack -> samples
+        self.stacks = collections.Counter()  # Collapsed stack (outermost first, ';'-separated) -> samples
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        stack = []
+        while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        if not stack:
+            return
+        leaf_file, _, leaf_name = stack[0]
+        if not self.include_idle and (os.path.basename(leaf_file), leaf_name) in IDLE_FRAMES:
+            return
+        functions = [_function_label(*entry) for entry in reversed(stack)]
+        self.samples += 1
+        self.self_counts[functions[-1]] += 1
+        self.total_counts.update(set(functions))
+        self.stacks[';'.join(functions)] += 1
+
+    def result(self, limit):
+        def share(count):
+            return round(count / self.samples, 4) if self.samples else 0
+
+        return {
+            'samples': self.samples,
+            'interval_seconds': self.interval,
+            'functions': [
+                {'function': function, 'self_samples': self.self_counts[function], 'self_share': share(self.self_counts[function]),
+                 'total_samples': count, 'total_share': share(count)}
+                for function, count in self.total_counts.most_common(limit)
+            ],
+            'hottest': [
+                {'function': function, 'self_samples': count, 'self_share': share(count)}
+                for function, count in self.self_counts.most_common(limit)
+            ],
+            # Collapsed stacks, e.g. for flamegraph.pl or speedscope
+            'stacks': [f"{stack} {count}" for stack, count in self.stacks.most_common(limit)],
+        }
+
+
+def _function_label(filename, line, name):
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def cprofile_stats(profiles, limit, sort='cumulative'):
+    """
+    Merges cProfile profiles and returns their most expensive functions.
+    """
+    if not profiles:
+        return {'total_seconds': 0, 'functions': []}
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    column = {'cumulative': 3, 'self': 2, 'calls': 1}[sort]
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)[:limit]
+    return {
+        'total_seconds': round(stats.total_tt, 6),
+        'functions': [
+            {'function': _function_label(*function), 'calls': calls, 'primitive_calls': primitive_calls,
+             'self_seconds': round(self_time, 6), 'cumulative_seconds': round(cumulative_time, 6)}
+            for function, (primitive_calls, calls, self_time, cumulative_time, _) in rows
+        ],
+    }
+
+
+class Profiler:
+    """
+    On-demand profiling of this process, one window at a time:
+
+    - "sampling" samples the stacks of every thread (cheap, statistical).
+    - "cprofile" traces every function call of the requests served during
+      the window (exact, but several times slower while it runs). On an
+      asyncio server it profiles the event loop thread instead, and on
+      Python 3.12+ every thread.
+
+    A window stops by itself after at most PROFILE_MAX_SECONDS; its result
+    is kept until the next one starts. Single requests can also be profiled
+    with cProfile (see `wants_request_profile`).
+    """
+
+    MODES = ('sampling', 'cprofile')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.session = None
+        self.last_result = None
+        self._request_profiles = collections.OrderedDict()  # profile ID -> result
+
+    @property
+    def profiling_requests(self):
+        session = self.session
+        return session is not None and session['mode'] == 'cprofile' and session['global_profile'] is None
+
+    def start(self, mode='sampling', seconds=PROFILE_DEFAULT_SECONDS, interval=PROFILE_SAMPLE_INTERVAL,
+              include_idle=False, limit=50, sort='cumulative', loop=None):
+        """
+        Starts a profiling window. With an asyncio `loop` (and called from
+        it), "cprofile" profiles the loop thread rather than single requests.
+
+        Raises:
+            ValueError: If a parameter is invalid.
+            RuntimeError: If a window is already running.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {', '.join(self.MODES)}")
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+        if interval < PROFILE_MIN_SAMPLE_INTERVAL:
+            raise ValueError(f"interval must be at least {PROFILE_MIN_SAMPLE_INTERVAL}")
+        if sort not in ('cumulative', 'self', 'calls'):
+            raise ValueError("sort must be cumulative, self or calls")
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("A profiling window is already running")
+            session = {
+                'id': uuid.uuid4().hex, 'mode': mode, 'started': time.time(), 'seconds': seconds,
+                'limit': limit, 'sort': sort, 'profiles': [], 'sampler': None, 'global_profile': None,
+            }
+            if mode == 'sampling':
+                session['sampler'] = SamplingProfiler(interval, include_idle)
+                session['sampler'].start()
+            elif loop is not None or not PER_THREAD_CPROFILE:
+                session['global_profile'] = cProfile.Profile()
+                try:
+                    session['global_profile'].enable()
+                except ValueError as e:  # Another profiler is active (Python 3.12+)
+                    raise RuntimeError(str(e))
+            self.session = session
+
+        if loop is not None:
+            loop.call_later(seconds, self.stop, session['id'])
+        else:
+            timer = threading.Timer(seconds, self.stop, args=(session['id'],))
+            timer.daemon = True
+            timer.start()
+        return self.status()
+
+    def stop(self, session_id=None):
+        """
+        Stops the running window (only if it is `session_id`, when given)
+        and returns its result, or None if no window was running.
+        """
+        with self._lock:
+            session = self.session
+            if session is None or (session_id is not None and session['id'] != session_id):
+                return None
+            self.session = None
+        if session['sampler'] is not None:
+            session['sampler'].stop()
+            stats = session['sampler'].result(session['limit'])
+        else:
+            if session['global_profile'] is not None:
+                session['global_profile'].disable()
+                session['profiles'].append(session['global_profile'])
+            stats = cprofile_stats(session['profiles'], session['limit'], session['sort'])
+            if session['global_profile'] is None:
+                stats['requests'] = len(session['profiles'])
+        self.last_result = {
+            'id': session['id'], 'mode': session['mode'], 'started': session['started'],
+            'seconds': round(time.time() - session['started'], 3), 'stats': stats,
+        }
+        return self.last_result
+
+    def status(self):
+        session = self.session
+        if session is not None:
+            return {'running': True, 'id': session['id'], 'mode': session['mode'], 'started': session['started'],
+                    'seconds': session['seconds']}
+        return {'running': False, 'last_result': self.last_result}
+
+    def add_request_profile(self, profile):
+        """
+        Adds the profile of a request served during a "cprofile" window.
+        """
+        with self._lock:
+            if self.session is not None and self.session['mode'] == 'cprofile':
+                self.session['profiles'].append(profile)
+
+    def store_request_profile(self, profile, description, limit=50, profile_id=None):
+        """
+        Keeps the profile of a single request.
+
+        Returns:
+            str: The profile ID.
+        """
+        profile_id = profile_id or uuid.uuid4().hex
+        result = {'id': profile_id, 'request': description, 'stats': cprofile_stats([profile], limit)}
+        with self._lock:
+            self._request_profiles[profile_id] = result
+            while len(self._request_profiles) > PROFILE_REQUEST_BUFFER:
+                self._request_profiles.popitem(last=False)
+        return profile_id
+
+    def request_profile(self, profile_id):
+        return self._request_profiles.get(profile_id)
+
+
+# Profiling of this process
+profiler = Profiler()
+
+
+def wants_request_profile(headers):
+    """
+    Returns True if a request asks to be profiled (PROFILE_HEADER set to 1)
+    and carries the admin token.
+    """
+    return headers.get(PROFILE_HEADER) == '1' and admin_error(headers) is None
+
+
+def start_from_params(params, loop=None):
+    """
+    Starts a window from request parameters (mode, seconds, interval, idle, limit, sort).
+
+    Returns:
+        tuple: (response body, status)
+    """
+    try:
+        status = profiler.start(
+            mode=params.get('mode', 'sampling'),
+            seconds=float(params.get('seconds', PROFILE_DEFAULT_SECONDS)),
+            interval=float(params.get('interval', PROFILE_SAMPLE_INTERVAL)),
+            include_idle=str(params.get('idle', '0')) == '1',
+            limit=int(params.get('limit', 50)),
+            sort=params.get('sort', 'cumulative'),
+            loop=loop,
+        )
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}, 400
+    except RuntimeError as e:
+        return {'error': str(e), 'status': profiler.status()}, 409
+    return status, 202
+
+
+def memory_start(params):
+    """
+    Starts tracing allocations with tracemalloc.
+
+    Returns:
+        tuple: (response body, status)
+    """
+    if tracemalloc.is_tracing():
+        return {'error': 'Memory tracing is already running'}, 409
+    try:
+        frames = int(params.get('frames', 1))
+    except (TypeError, ValueError):
+        return {'error': 'frames must be an integer'}, 400
+    if not 1 <= frames <= MEMORY_MAX_FRAMES:
+        return {'error': f"frames must be between 1 and {MEMORY_MAX_FRAMES}"}, 400
+    tracemalloc.start(frames)
+    _memory['previous'] = None
+    return {'tracing': True, 'frames': frames}, 202
+
+
+def memory_snapshot(params):
+    """
+    Returns the biggest allocation sites traced so far, and how they changed
+    since the previous snapshot.
+
+    Returns:
+        tuple: (response body, status)
+    """
+    if not tracemalloc.is_tracing():
+        return {'error': 'Memory tracing is not running (POST /admin/memory starts it)'}, 400
+    group_by = params.get('group_by', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return {'error': 'group_by must be lineno, filename or traceback'}, 400
+    try:
+        limit = int(params.get('limit', 20))
+    except (TypeError, ValueError):
+        return {'error': 'limit must be an integer'}, 400
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    body = {
+        'traced_bytes': current,
+        'peak_bytes': peak,
+        'top': [
+            {'where': [str(frame) for frame in stat.traceback], 'bytes': stat.size, 'blocks': stat.count}
+            for stat in snapshot.statistics(group_by)[:limit]
+        ],
+    }
+    previous = _memory['previous']
+    if previous is not None:
+        body['growth'] = [
+            {'where': [str(frame) for frame in stat.traceback], 'bytes': stat.size, 'bytes_change': stat.size_diff,
+             'blocks_change': stat.count_diff}
+            for stat in snapshot.compare_to(previous, group_by)[:limit]
+        ]
+    _memory['previous'] = snapshot
+    return body, 200
+
+
+def memory_stop():
+    if not tracemalloc.is_tracing():
+        return {'error': 'Memory tracing is not running'}, 400
+    tracemalloc.stop()
+    _memory['previous'] = None
+    return {'tracing': False}, 200
+
+
+# Last tracemalloc snapshot, compared with the next one
+_memory = {'previous': None}
+
+
+def profile_flask_app(app):
+    """
+    Adds on-demand profiling to a Flask app. All routes require the admin
+    token (see shared/admin.py):
+
+    - POST /admin/profile starts a window (query parameters: mode, seconds,
+      interval, idle, limit, sort). GET returns its status, or the result of
+      the last one; DELETE stops it early and returns its result.
+    - A request sent with "X-Profile: 1" and the admin token is profiled on
+      its own; its response carries X-Profile-Id, and GET
+      /admin/profile/requests/<id> returns the profile.
+    - POST /admin/memory starts tracemalloc (frames), GET takes a snapshot
+      (limit, group_by) compared with the previous one, DELETE stops it.
+    """
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def start_request_profile():
+        profile_request = wants_request_profile(request.headers)
+        if profile_request or profiler.profiling_requests:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # Another profiler is active (Python 3.12+)
+                return
+            g.request_profile = profile
+            g.profile_request = profile_request
+
+    @app.after_request
+    def finish_request_profile(response):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profile.disable()
+            profiler.add_request_profile(profile)
+            if g.pop('profile_request', False):
+                response.headers[PROFILE_ID_HEADER] = profiler.store_request_profile(
+                    profile, f"{request.method} {request.full_path.rstrip('?')}")
+        return response
+
+    @app.teardown_request
+    def discard_request_profile(exc):
+        profile = g.pop('request_profile', None)  # Still set if the request failed before after_request
+        if profile is not None:
+            profile.disable()
+
+    @app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+    @admin_required
+    def admin_profile():
+        if request.method == 'POST':
+            body, status = start_from_params(request.args)
+            return jsonify(body), status
+        if request.method == 'DELETE':
+            result = profiler.stop()
+            return (jsonify(result), 200) if result else (jsonify({'error': 'No profiling window is running'}), 400)
+        return jsonify(profiler.status()), 200
+
+    @app.route('/admin/profile/requests/<profile_id>', methods=['GET'])
+    @admin_required
+    def admin_request_profile(profile_id):
+        result = profiler.request_profile(profile_id)
+        return (jsonify(result), 200) if result else (jsonify({'error': 'Unknown or expired profile'}), 404)
+
+    @app.route('/admin/memory', methods=['GET', 'POST', 'DELETE'])
+    @admin_required
+    def admin_memory():
+        if request.method == 'POST':
+            body, status = memory_start(request.args)
+        elif request.method == 'DELETE':
+            body, status = memory_stop()
+        else:
+            body, status = memory_snapshot(request.args)
+        return jsonify(body), status
+
+    return app
+
+
+def aiohttp_profiling_middleware(skip=()):
+    """
+    Returns an aiohttp middleware profiling the requests that ask for it
+    like `profile_flask_app`. On the event loop, the profile of a request
+    also contains the tasks that ran while it was waiting. Needs
+    `add_aiohttp_profiling_routes` for the X-Profile-Id header.
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def profiling_middleware(request, handler):
+        if (request.match_info.handler in skip or profiler.session is not None
+                or not wants_request_profile(request.headers)):
+            return await handler(request)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active (Python 3.12+)
+            return await handler(request)
+        request['profile_id'] = uuid.uuid4().hex  # Sent by add_profile_id_header, also on streamed responses
+        try:
+            return await handler(request)
+        finally:
+            profile.disable()
+            profiler.store_request_profile(profile, f"{request.method} {request.path_qs}",
+                                           profile_id=request['profile_id'])
+
+    return profiling_middleware
+
+
+def add_aiohttp_profiling_routes(app):
+    """
+    Adds the /admin/profile and /admin/memory routes of `profile_flask_app`
+    to an aiohttp app.
+    """
+    import asyncio
+    from aiohttp import web
+
+    async def add_profile_id_header(request, response):
+        profile_id = request.get('profile_id')
+        if profile_id:
+            response.headers[PROFILE_ID_HEADER] = profile_id
+
+    def refuse(request):
+        error = admin_error(request.headers)
+        if error is None:
+            return None
+        status, message = error
+        return web.json_response({'error': message}, status=status)
+
+    async def admin_profile(request):
+        refused = refuse(request)
+        if refused:
+            return refused
+        if request.method == 'POST':
+            body, status = start_from_params(request.query, loop=asyncio.get_running_loop())
+            return web.json_response(body, status=status)
+        if request.method == 'DELETE':
+            result = profiler.stop()
+            if result is None:
+                return web.json_response({'error': 'No profiling window is running'}, status=400)
+            return web.json_response(result)
+        return web.json_response(profiler.status())
+
+    async def admin_request_profile(request):
+        refused = refuse(request)
+        if refused:
+            return refused
+        result = profiler.request_profile(request.match_info['profile_id'])
+        if result is None:
+            return web.json_response({'error': 'Unknown or expired profile'}, status=404)
+        return web.json_response(result)
+
+    async def admin_memory(request):
+        refused = refuse(request)
+        if refused:
+            return refused
+        if request.method == 'POST':
+            body, status = memory_start(request.query)
+        elif request.method == 'DELETE':
+            body, status = memory_stop()
+        else:
+            # Snapshots walk every traced block; keep the loop serving meanwhile
+            body, status = await asyncio.to_thread(memory_snapshot, dict(request.query))
+        return web.json_response(body, status=status)
+
+    for method in ('GET', 'POST', 'DELETE'):
+        app.router.add_route(method, '/admin/profile', admin_profile)
+        app.router.add_route(method, '/admin/memory', admin_memory)
+    app.router.add_get('/admin/profile/requests/{profile_id}', admin_request_profile)
+    app.on_response_prepare.append(add_profile_id_header)
@@ -0,0 +1,200 @@
+import asyncio
+import functools
+import os
+import re
+import threading
+
+# Header naming the tenant an upload is stored for (absent: DEFAULT_OWNER)
+OWNER_HEADER = "X-Owner"
+
+DEFAULT_OWNER = os.getenv("DEFAULT_OWNER", "default")  # Owner of uploads without an X-Owner header
+QUOTA_BYTES = int(os.getenv("QUOTA_BYTES", 0))  # Bytes an owner may store unless given its own quota (0: no limit)
+QUOTA_FILES = int(os.getenv("QUOTA_FILES", 0))  # Files an owner may store unless given its own quota (0: no limit)
+
+OWNER_PATTERN = re.compile(r"[A-Za-z0-9._@-]{1,128}")
+
+LOCK_STRIPES = 64  # Owners hash onto this many locks, so lookups for different owners rarely wait on each other
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when an upload would take its owner past one of its quotas.
+    """
+
+
+def check_owner(owner):
+    """
+    Returns an owner name if it is valid.
+
+    Raises:
+        ValueError: If the owner is not 1 to 128 letters, digits or "._@-".
+    """
+    if not OWNER_PATTERN.fullmatch(owner):
+        raise ValueError("Owners must be 1 to 128 letters, digits or '._@-'")
+    return owner
+
+
+def owner_of(headers):
+    """
+    Returns the owner named by a request's X-Owner header, else DEFAULT_OWNER.
+
+    Raises:
+        ValueError: If the owner is not valid (see `check_owner`).
+    """
+    return check_owner(headers.get(OWNER_HEADER) or DEFAULT_OWNER)
+
+
+def effective_quotas(usage):
+    """
+    Returns the (bytes, files) quotas of an owner's usage record (None: no
+    record), falling back to QUOTA_BYTES and QUOTA_FILES. 0 means no limit.
+    """
+    usage = usage or {}
+    quota_bytes = usage.get('quota_bytes')
+    quota_files = usage.get('quota_files')
+    return (QUOTA_BYTES if quota_bytes is None else quota_bytes,
+            QUOTA_FILES if quota_files is None else quota_files)
+
+
+class QuotaReservation:
+    """
+    The share of its owner's quota an upload holds until its file is
+    committed (or the upload fails). Releasing twice is harmless.
+    """
+
+    __slots__ = ('_reservations', 'owner', 'nbytes', '_released')
+
+    def __init__(self, reservations, owner, nbytes):
+        self._reservations = reservations
+        self.owner = owner
+        self.nbytes = nbytes
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._reservations._release(self.owner, self.nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class QuotaReservations:
+    """
+    Checks uploads against their owner's quotas before their body is read.
+
+    An owner's stored bytes and files come from its usage record, which the
+    metadata store updates on every upload and delete, so a check is one key
+    lookup (`fetch_usage`) instead of a scan of the owner's files. Uploads in
+    progress on this node are counted too, by their Content-Length, so
+    concurrent uploads cannot overshoot a quota together. Uploads to other
+    partition leaders are only seen once committed.
+
+    Owners are spread over LOCK_STRIPES stripes, each a lock and the uploads
+    in progress of its owners. A stripe's lock is held across the lookup, so
+    a commit and its release are never seen half done, but a slow lookup
+    only holds up the owners of its own stripe.
+    """
+
+    def __init__(self, fetch_usage):
+        self._fetch_usage = fetch_usage
+        # Each stripe: (lock, {owner: (bytes, files) of its uploads in progress})
+        self._stripes = [(threading.Lock(), {}) for _ in range(LOCK_STRIPES)]
+
+    def _stripe(self, owner):
+        return self._stripes[hash(owner) % LOCK_STRIPES]
+
+    def reserve(self, owner, nbytes):
+        """
+        Reserves room for an upload of `nbytes` bytes (None: unknown) by `owner`.
+
+        Returns:
+            QuotaReservation: To release once the file is committed or the upload failed.
+
+        Raises:
+            QuotaExceeded: If the upload would exceed the owner's byte or file quota.
+            ValueError: If the size is unknown and the owner has a byte quota.
+        """
+        lock, reserved = self._stripe(owner)
+        with lock:
+            usage = self._fetch_usage(owner) or {}
+            quota_bytes, quota_files = effective_quotas(usage)
+            reserved_bytes, reserved_files = reserved.get(owner, (0, 0))
+            if quota_bytes:
+                if nbytes is None:
+                    raise ValueError("Uploads subject to a byte quota need a Content-Length")
+                if usage.get('bytes', 0) + reserved_bytes + nbytes > quota_bytes:
+                    raise QuotaExceeded(f"Owner {owner} would exceed its quota of {quota_bytes} bytes")
+            if quota_files and usage.get('files', 0) + reserved_files + 1 > quota_files:
+                raise QuotaExceeded(f"Owner {owner} would exceed its quota of {quota_files} files")
+            nbytes = nbytes or 0
+            reserved[owner] = (reserved_bytes + nbytes, reserved_files + 1)
+        return QuotaReservation(self, owner, nbytes)
+
+    def _release(self, owner, nbytes):
+        lock, reserved = self._stripe(owner)
+        with lock:
+            reserved_bytes, reserved_files = reserved[owner]
+            if reserved_files == 1:
+                del reserved[owner]
+            else:
+                reserved[owner] = (reserved_bytes - nbytes, reserved_files - 1)
+
+
+def quota_required(reservations):
+    """
+    Returns a decorator that checks requests to a Flask upload view against
+    their owner's quotas, holding a reservation while the view runs (413
+    when a quota would be exceeded). The view finds the owner in `g.owner`.
+    """
+    from flask import g, jsonify, request
+
+    def decorator(view):
+        @functools.wraps(view)
+        def reserved(*args, **kwargs):
+            try:
+                owner = owner_of(request.headers)
+                reservation = reservations.reserve(owner, request.content_length)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except QuotaExceeded as e:
+                return jsonify({'error': str(e)}), 413
+            with reservation:
+                g.owner = owner
+                return view(*args, **kwargs)
+        return reserved
+    return decorator
+
+
+def aiohttp_quota_required(reservations, run):
+    """
+    Like `quota_required`, for an aiohttp handler: the usage lookup is made
+    through `run` (e.g. the async store's thread pool), and the owner is
+    stored in `request['owner']`.
+    """
+    from aiohttp import web
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def reserved(request):
+            try:
+                owner = owner_of(request.headers)
+                lookup = asyncio.ensure_future(run(reservations.reserve, owner, request.content_length))
+                try:
+                    reservation = await asyncio.shield(lookup)
+                except asyncio.CancelledError:
+                    # The client went away: release the reservation once the lookup returns it
+                    lookup.add_done_callback(lambda done: done.cancelled() or done.exception() or done.result().release())
+                    raise
+            except ValueError as e:
+                return web.json_response({'error': str(e)}, status=400)
+            except QuotaExceeded as e:
+                return web.json_response({'error': str(e)}, status=413)
+            with reservation:
+                request['owner'] = owner
+                return await handler(request)
+        return reserved
+    return decorator
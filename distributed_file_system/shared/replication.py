@@ -0,0 +1,126 @@
+import threading
+import requests
+
+from shared.fencing import FENCING_HEADER, FENCING_PARTITION_HEADER
+from shared.io_scheduler import IO_PRIORITY_HEADER
+from shared.tracing import in_current_trace, inject, span
+
+# Header carrying the downstream replicas a worker should forward a chunk to
+CHAIN_HEADER = "X-Replica-Chain"
+
+# Header asking a worker to write the data at a byte offset of an existing chunk
+OFFSET_HEADER = "X-Chunk-Offset"
+
+# Request headers a worker passes on when forwarding a chunk down the chain
+FORWARDED_HEADERS = (OFFSET_HEADER, FENCING_HEADER, FENCING_PARTITION_HEADER, IO_PRIORITY_HEADER)
+
+# Seconds each hop of the chain may take (scaled by the remaining chain length)
+CHAIN_HOP_TIMEOUT = 30
+
+
+def encode_chain(worker_urls):
+    """
+    Encodes a list of worker base URLs into the chain header value.
+    """
+    return ",".join(worker_urls)
+
+
+def decode_chain(header_value):
+    """
+    Decodes the chain header value into a list of worker base URLs.
+    """
+    if not header_value:
+        return []
+    return [url.strip() for url in header_value.split(",") if url.strip()]
+
+
+def send_chunk_along_chain(chunk_id, chunk_data, chain_urls, headers=None):
+    """
+    Sends a chunk to the head of a replica chain.
+
+    The head stores the chunk and forwards it to the rest of the chain, so the
+    caller only uploads the chunk once. A head that cannot be reached (or
+    fails without any replica acknowledging) is skipped: the next worker
+    becomes the head of the rest of the chain, so one dead hop does not lose
+    the replicas after it.
+
+    Args:
+        chunk_id (str): ID of the chunk being written.
+        chunk_data (bytes): Chunk contents.
+        chain_urls (list): Worker base URLs, head first.
+        headers (dict): Extra headers to send with the chunk.
+
+    Returns:
+        list: IDs of the workers that acknowledged the write, in chain order.
+
+    Raises:
+        requests.exceptions.RequestException: If no worker of the chain
+        could be reached and acknowledged the write.
+    """
+    error = None
+    for index, head_url in enumerate(chain_urls):
+        downstream = chain_urls[index + 1:]
+        request_headers = dict(headers or {})
+        if downstream:
+            request_headers[CHAIN_HEADER] = encode_chain(downstream)
+
+        try:
+            with span("chunk.chain_send", chunk_id=chunk_id, head=head_url, chain_length=len(chain_urls) - index):
+                response = requests.post(
+                    f"{head_url}/chunks/{chunk_id}",
+                    data=chunk_data,
+                    headers=inject(request_headers),
+                    timeout=CHAIN_HOP_TIMEOUT * (len(chain_urls) - index)
+                )
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            # A failed hop still reports which replicas further down the chain succeeded
+            if not response.ok and not body.get('stored_on'):
+                response.raise_for_status()
+            return body.get('stored_on', [])
+        except requests.exceptions.RequestException as e:
+            error = e
+    if error is not None:
+        raise error
+    return []
+
+
+class ChainForwarder:
+    """
+    Forwards a chunk to the next replica in the background while the local
+    copy is being written.
+    """
+
+    def __init__(self, chunk_id, chunk_data, chain_urls, headers=None):
+        self.chunk_id = chunk_id
+        self.chunk_data = chunk_data
+        self.chain_urls = chain_urls
+        self.headers = headers
+        self.stored_on = []
+        self.error = None
+        # Runs under the span of the request that received the chunk
+        self._thread = threading.Thread(target=in_current_trace(self._forward), daemon=True)
+
+    def _forward(self):
+        try:
+            self.stored_on = send_chunk_along_chain(
+                self.chunk_id, self.chunk_data, self.chain_urls, headers=self.headers
+            )
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.error = e
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wait(self):
+        """
+        Waits for the downstream acknowledgements.
+
+        Returns:
+            list: IDs of the downstream workers that stored the chunk.
+        """
+        self._thread.join()
+        return self.stored_on
@@ -0,0 +1,66 @@
+import atexit
+import os
+import secrets
+import shutil
+import tempfile
+from multiprocessing.managers import BaseManager
+
+from shared.ttl_cache import TTLCache
+
+# Set by the process that starts the cache server; read by the processes that share it
+SHARED_CACHE_ADDRESS_ENV = "DFS_SHARED_CACHE_ADDRESS"
+SHARED_CACHE_AUTHKEY_ENV = "DFS_SHARED_CACHE_AUTHKEY"
+
+# Caches living in the cache server process, by name
+_caches = {}
+
+
+def _named_cache(name, ttl_seconds):
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches[name] = TTLCache(ttl_seconds)
+    return cache
+
+
+class CacheManager(BaseManager):
+    """
+    Serves named TTLCaches from one process to the processes that connect to it.
+    """
+
+
+CacheManager.register('named_cache', callable=_named_cache, exposed=('get', 'set', 'invalidate'))
+
+
+def start_cache_server():
+    """
+    Starts a cache server process on a local socket and exports its address
+    to the environment, so that processes started (or forked) afterwards
+    share its caches through `create_cache`.
+
+    Returns:
+        CacheManager: The running server; call shutdown() to stop it.
+    """
+    directory = tempfile.mkdtemp(prefix="dfs_cache_")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    address = os.path.join(directory, "cache.sock")
+    authkey = secrets.token_bytes(16)
+    manager = CacheManager(address=address, authkey=authkey)
+    manager.start()
+    os.environ[SHARED_CACHE_ADDRESS_ENV] = address
+    os.environ[SHARED_CACHE_AUTHKEY_ENV] = authkey.hex()
+    return manager
+
+
+def create_cache(name, ttl_seconds):
+    """
+    Returns the cache called `name`: shared with the other processes of a
+    cache server if one was started (see start_cache_server), otherwise a
+    private TTLCache. Both have the same get / set / invalidate interface;
+    values of a shared cache are copied (pickled) in and out.
+    """
+    address = os.getenv(SHARED_CACHE_ADDRESS_ENV)
+    if not address:
+        return TTLCache(ttl_seconds)
+    manager = CacheManager(address=address, authkey=bytes.fromhex(os.environ[SHARED_CACHE_AUTHKEY_ENV]))
+    manager.connect()
+    return manager.named_cache(name, ttl_seconds)
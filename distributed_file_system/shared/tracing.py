@@ -0,0 +1,313 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# W3C trace context header, propagated on every call between gateway, masters and workers
+TRACE_HEADER = "traceparent"
+
+# Response header telling clients the trace ID (request ID) of a traced request
+REQUEST_ID_HEADER = "X-Request-Id"
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))  # Fraction of gateway requests that start a trace
+TRACE_BUFFER_SPANS = int(os.getenv("TRACE_BUFFER_SPANS", 10000))  # Finished spans kept in memory per process
+TRACE_FILE = os.getenv("TRACE_FILE")  # Optional JSON lines file every finished span is appended to
+
+# Span of the request or job the current thread (or asyncio task) is working on
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class SpanRecorder:
+    """
+    Keeps the most recent finished spans of this process in a ring buffer,
+    and optionally appends them to a JSON lines file.
+    """
+
+    def __init__(self, max_spans=TRACE_BUFFER_SPANS, path=TRACE_FILE):
+        self._spans = deque(maxlen=max_spans)
+        self._path = path
+        self._file_lock = threading.Lock()
+
+    def record(self, span_record):
+        self._spans.append(span_record)  # deque appends are thread-safe
+        if self._path:
+            line = json.dumps(span_record) + "\n"
+            with self._file_lock, open(self._path, 'a') as trace_file:
+                trace_file.write(line)
+
+    def spans(self, trace_id):
+        """
+        Returns the buffered spans of one trace, oldest first.
+        """
+        return [span for span in list(self._spans) if span['trace_id'] == trace_id]
+
+    def recent_traces(self, limit=100):
+        """
+        Returns the most recent root spans (requests that started a trace
+        here, and background jobs such as elections), newest first.
+        """
+        roots = [span for span in list(self._spans) if span['parent_id'] is None]
+        return roots[::-1][:limit]
+
+
+recorder = SpanRecorder()
+
+# Name of this process in its spans (gateway, master_1, worker_3, ...)
+service_name = "unknown"
+
+
+def set_service_name(name):
+    global service_name
+    service_name = name
+
+
+class Span:
+    """
+    One timed operation of a trace. Used as a context manager, it becomes
+    the parent of the spans started inside it (in the same thread or task)
+    and is recorded when it exits.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'error', '_started', '_start_time', '_token')
+
+    recording = True
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._start_time = time.time()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        if exc is not None and self.error is None:
+            self.error = repr(exc)
+        recorder.record({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': service_name,
+            'start': self._start_time,
+            'duration_ms': round(duration * 1e3, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        })
+
+
+class _NoopSpan:
+    """
+    Stands in for a span outside of a sampled trace, at the cost of a
+    context variable lookup.
+    """
+
+    recording = False
+    trace_id = None
+    error = None
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def span(name, **attributes):
+    """
+    Returns a child span of the current span, or a no-op span if the
+    current request or job is not traced.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def parse_traceparent(header_value):
+    """
+    Parses a traceparent header.
+
+    Returns:
+        tuple: (trace_id, parent span_id, sampled), or None if the header is missing or malformed.
+    """
+    if not header_value:
+        return None
+    parts = header_value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_trace(name, traceparent=None, root=False, sample_rate=TRACE_SAMPLE_RATE, **attributes):
+    """
+    Returns the span of an incoming request or a background job.
+
+    A request carrying a sampled traceparent joins that trace. Otherwise a
+    new trace is started with probability `sample_rate` if `root` is set
+    (the gateway, where client requests enter, and jobs like elections);
+    anything else is not traced.
+    """
+    context = parse_traceparent(traceparent)
+    if context is not None:
+        trace_id, parent_id, sampled = context
+        return Span(name, trace_id, parent_id, attributes) if sampled else NOOP_SPAN
+    if root and random.random() < sample_rate:
+        return Span(name, f"{random.getrandbits(128):032x}", None, attributes)
+    return NOOP_SPAN
+
+
+def inject(headers=None):
+    """
+    Adds the trace context of the current span to outgoing request headers.
+
+    Returns:
+        dict: The headers (a new dict if None was given).
+    """
+    headers = {} if headers is None else headers
+    current = _current_span.get()
+    if current is not None:
+        headers[TRACE_HEADER] = f"00-{current.trace_id}-{current.span_id}-01"
+    return headers
+
+
+def response_headers(headers=None):
+    """
+    Adds the request ID of the current trace to response headers, for
+    streamed responses that are sent before the tracing hooks see them.
+    """
+    headers = {} if headers is None else headers
+    current = _current_span.get()
+    if current is not None:
+        headers[REQUEST_ID_HEADER] = current.trace_id
+    return headers
+
+
+def in_current_trace(function):
+    """
+    Wraps a function so that it runs under the current span, for work handed
+    to another thread (executors and threads start without a current span).
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return function
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run
+
+
+def trace_flask_app(app, service, root=False, collect=None):
+    """
+    Traces every request of a Flask app and serves the buffered spans:
+
+    - GET /traces lists the most recent traces started in this process.
+    - GET /traces/<trace_id> returns the spans of a trace, including the
+      ones `collect(trace_id)` gathers from other nodes unless `local=1`
+      is passed.
+
+    Call it right after creating the app, so its hooks run before the app's own.
+    """
+    from flask import g, jsonify, request
+
+    set_service_name(service)
+
+    @app.before_request
+    def start_request_span():
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_span = start_trace(f"{request.method} {route}", request.headers.get(TRACE_HEADER), root=root)
+        g.trace_span = request_span.__enter__()
+
+    @app.after_request
+    def finish_request_span(response):
+        # Finished before the response is sent, so the caller can query the trace right away
+        request_span = g.pop('trace_span', None)
+        if request_span is not None:
+            if request_span.recording:
+                request_span.set('status', response.status_code)
+                response.headers[REQUEST_ID_HEADER] = request_span.trace_id
+            request_span.__exit__(None, None, None)
+        return response
+
+    @app.teardown_request
+    def finish_failed_request_span(exc):
+        request_span = g.pop('trace_span', None)  # Still set if the request failed before after_request
+        if request_span is not None:
+            request_span.__exit__(type(exc) if exc else None, exc, None)
+
+    @app.route('/traces', methods=['GET'])
+    def list_traces():
+        return jsonify({'service': service, 'traces': recorder.recent_traces()}), 200
+
+    @app.route('/traces/<trace_id>', methods=['GET'])
+    def get_trace(trace_id):
+        spans = recorder.spans(trace_id)
+        if collect and request.args.get('local') != '1':
+            spans += collect(trace_id)
+        spans.sort(key=lambda s: s['start'])
+        return jsonify({'trace_id': trace_id, 'spans': spans}), 200
+
+    return app
+
+
+def aiohttp_tracing_middleware(root=False, skip=()):
+    """
+    Returns an aiohttp middleware tracing every request like
+    `trace_flask_app`. Requests routed to a handler in `skip` are not traced
+    here (e.g. ones passed on to a traced Flask app).
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def tracing_middleware(request, handler):
+        if request.match_info.handler in skip:
+            return await handler(request)
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        with start_trace(f"{request.method} {route}", request.headers.get(TRACE_HEADER), root=root) as request_span:
+            try:
+                response = await handler(request)
+            except web.HTTPException as e:
+                request_span.set('status', e.status)
+                raise
+            request_span.set('status', response.status)
+            if request_span.recording and not response.prepared:
+                response.headers[REQUEST_ID_HEADER] = request_span.trace_id
+            return response
+
+    return tracing_middleware
@@ -1,24 +1,15 @@
 import os
-import logging
 import math
-import json
 import sqlite3
-from datetime import datetime
 import random
 import requests
 
-# Logger setup
-LOG_FILE = 'logs/api_gateway.log'
+from shared.chunking import choose_chunk_size
 
+from shared.logs import get_logger
 
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-logging.basicConfig(
-    filename=os.path.join(LOG_FILE),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# API calls are written as one-line JSON records by the process's log writer (see shared/logs.py)
+api_log = get_logger('api')
 
 # Worker storage directories (update as needed)
 WORKER_STORAGE_PATHS = {
@@ -43,21 +34,13 @@ def log_api_call(action, file_id, details):
         file_id (str): ID of the file the action was performed on.
         details (dict): Additional details of the action.
     """
-    log_entry = {
-        'timestamp': datetime.now().isoformat(),
-        'action': action,
-        'file_id': file_id,
-        'details': details
-    }
-    logging.info(json.dumps(log_entry, indent=2))
+    api_log.info('API call', extra={'action': action, 'file_id': file_id, 'details': details})
 
 
 # Function to divide a file into chunks and store in worker directories
-def divide_file_into_chunks(file_path, file_id, master_node_id,chunk_size_mb=2, replication_factor=3):
+def divide_file_into_chunks(file_path, file_id, master_node_id,chunk_size_mb=None, replication_factor=3):
     DB_FILE = f"database/{master_node_id}_metadata.db"
-    chunk_size = chunk_size_mb * 1024 * 1024
     file_size = os.path.getsize(file_path)
-    num_chunks = math.ceil(file_size / chunk_size)
     chunks_info = []
 
     # Fetch active workers
@@ -70,6 +53,9 @@ def divide_file_into_chunks(file_path, file_id, master_node_id,chunk_size_mb=2,
     if len(active_workers) < replication_factor:
         raise Exception("Not enough active workers to replicate chunks")
 
+    chunk_size = choose_chunk_size(file_size, len(active_workers), hint_mb=chunk_size_mb)
+    num_chunks = math.ceil(file_size / chunk_size)
+
     with open(file_path, 'rb') as file:
         for i in range(num_chunks):
             chunk_data = file.read(chunk_size)
@@ -1,28 +1,49 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 import os
+import sys
 import requests
 import threading
 import time
 import json
-from datetime import datetime
 from dotenv import load_dotenv
 
 # Load environment variables from .env
 load_dotenv()
 
+# Make the shared project packages importable when running this file as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from shared.replication import CHAIN_HEADER, OFFSET_HEADER, FORWARDED_HEADERS, ChainForwarder, decode_chain
+from shared.fencing import FENCING_HEADER, FENCING_PARTITION_HEADER, FencingTokenGuard
+from shared.chunk_naming import is_chunk_id
+from shared.metrics import counter, histogram, instrument_flask_app
+from shared.tracing import span, trace_flask_app
+from shared.fault_injection import faults, fault_inject_flask_app
+from shared.profiling import profile_flask_app
+from shared.logs import RateLimitedLogger, configure_logging
+from shared.chunk_writer import ChunkWriter
+from shared.io_scheduler import io_scheduler, prioritize_flask_app, release_when_sent
+
 app = Flask(__name__)
+instrument_flask_app(app)  # Request metrics and GET /metrics
 
 # Worker Configuration
 WORKER_ID = "worker_3"  # Change this for each worker instance
 PORT = os.getenv("WORKER_3_PORT")  # Change this for each worker instance
 STORAGE_DIR = os.path.abspath(f"storage/{WORKER_ID}")
+log = configure_logging(WORKER_ID)  # One-line JSON records, written by a background thread
+chunk_log = RateLimitedLogger(log)  # For events logged per chunk
+trace_flask_app(app, WORKER_ID)  # Spans of traced requests and GET /traces
+fault_inject_flask_app(app)  # Faults injected for testing, configured on /admin/faults
+profile_flask_app(app)  # On-demand profiling on /admin/profile and /admin/memory
+prioritize_flask_app(app)  # Background chunk traffic (X-IO-Priority) yields to client requests
 
 # Get Worker IP - For EC2 instances, you can get the public IP dynamically
 # For local testing, set WORKER_IP to '127.0.0.1'
 WORKER_IP = os.getenv("WORKER_3_IP")
 
-# Master Node Configuration
-CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'config.json')
+# Master Node Configuration (DFS_CONFIG overrides the path, e.g. for local test clusters)
+CONFIG_FILE = os.getenv("DFS_CONFIG") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'config.json')
 with open(CONFIG_FILE, "r") as file:
     MASTER_NODES = json.load(file)
 
@@ -30,9 +51,27 @@ HEARTBEAT_INTERVAL = 5  # In seconds
 LEADER_CHECK_INTERVAL = 10  # In seconds
 MASTER_NODE_URL = ""  # This will be dynamically updated
 
+# Hot path metrics served on /metrics, next to the request metrics of every route
+CHUNK_STORE_SECONDS = histogram('dfs_chunk_store_seconds', 'Time to write a chunk to local storage')
+CHUNK_FORWARD_WAIT_SECONDS = histogram('dfs_chunk_forward_wait_seconds', 'Time waiting on the rest of the replica chain after the local write')
+CHUNK_RETRIEVE_SECONDS = histogram('dfs_chunk_retrieve_seconds', 'Time to open a stored chunk for sending')
+CHUNK_BYTES = counter('dfs_chunk_bytes', 'Chunk bytes stored and served, by direction (in, out)', ('direction',))
+HEARTBEATS_SENT = counter('dfs_heartbeats_sent', 'Heartbeats sent to the leader, by result', ('result',))
+LEADER_LOOKUPS = counter('dfs_leader_lookups', 'Leader lookups, by result (discovered, failed)', ('result',))
+
 # Ensure storage directory exists
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+# Highest fencing tokens, kept next to the chunk directory rather than in it, where a chunk write could replace them
+FENCING_STATE_PATH = os.path.abspath(f"storage/{WORKER_ID}.fencing_token")
+LEGACY_FENCING_STATE_PATH = os.path.join(STORAGE_DIR, '.fencing_token')  # Where older versions kept them
+if os.path.exists(LEGACY_FENCING_STATE_PATH) and not os.path.exists(FENCING_STATE_PATH):
+    os.replace(LEGACY_FENCING_STATE_PATH, FENCING_STATE_PATH)
+
+# Rejects writes from deposed leaders (highest fencing token survives restarts)
+fencing_guard = FencingTokenGuard(FENCING_STATE_PATH)
+chunk_writer = ChunkWriter(STORAGE_DIR)  # Atomic chunk writes, durable as set by WORKER_DURABILITY
+
 def get_current_leader():
     """
     Queries the master nodes to get the current leader's URL.
@@ -42,7 +81,7 @@ def get_current_leader():
     for master_id, master_info in MASTER_NODES.items():
         master_ip = master_info['ip']
         master_port = master_info['port']
-        print(f"Querying {master_id} at {master_ip}:{master_port} for leader...")
+        log.debug(f"Querying {master_id} at {master_ip}:{master_port} for leader")
         try:
             response = requests.get(f"http://{master_ip}:{master_port}/current_leader", timeout=2)
             if response.status_code == 200:
@@ -53,14 +92,16 @@ def get_current_leader():
                         leader_ip = leader_info['ip']
                         leader_port = leader_info['port']
                         MASTER_NODE_URL = f"http://{leader_ip}:{leader_port}"
-                        print(f"Current leader is: {leader_id}")
+                        log.debug(f"Current leader is {leader_id}")
+                        LEADER_LOOKUPS.labels('discovered').inc()
                         return MASTER_NODE_URL
                     else:
-                        print(f"Leader {leader_id} not found in MASTER_NODES")
+                        log.warning(f"Leader {leader_id} not found in MASTER_NODES")
         except requests.exceptions.RequestException as e:
-            print(f"Error querying {master_id}: {e}")
+            log.warning(f"Error querying {master_id}: {e}")
 
-    print("No leader found among master nodes.")
+    log.warning("No leader found among master nodes")
+    LEADER_LOOKUPS.labels('failed').inc()
     return None
 
 def send_heartbeat():
@@ -68,6 +109,10 @@ def send_heartbeat():
     Periodically sends heartbeats to the current leader.
     """
     while True:
+        if faults.suppress_heartbeat():
+            log.info("Heartbeat suppressed by fault injection")
+            time.sleep(HEARTBEAT_INTERVAL)
+            continue
         leader_url = get_current_leader()
         if leader_url:
             try:
@@ -78,17 +123,33 @@ def send_heartbeat():
 
                 response = requests.post(f"{leader_url}/heartbeat/{WORKER_ID}", json=heartbeat_data, timeout=2)
                 if response.status_code == 200:
-                    print(f"[{datetime.now()}] Heartbeat sent successfully to {leader_url}")
+                    HEARTBEATS_SENT.labels('ok').inc()
+                    log.debug(f"Heartbeat sent to {leader_url}")
                 else:
-                    print(f"[{datetime.now()}] Heartbeat failed with status code: {response.status_code}")
+                    HEARTBEATS_SENT.labels('failed').inc()
+                    log.warning(f"Heartbeat to {leader_url} failed with status code {response.status_code}")
             except requests.exceptions.RequestException as e:
-                print(f"Error sending heartbeat to {leader_url}: {e}")
+                HEARTBEATS_SENT.labels('failed').inc()
+                log.warning(f"Error sending heartbeat to {leader_url}: {e}")
         else:
-            print("No leader found. Retrying...")
+            log.warning("No leader found for heartbeat; retrying")
 
         time.sleep(HEARTBEAT_INTERVAL)
 
 
+@app.before_request
+def reject_stale_leader():
+    """
+    Rejects chunk writes and deletes carrying an older fencing token than one
+    already seen for the same metadata partition, i.e. requests from a master
+    that has lost leadership of that partition.
+    """
+    if request.method == 'POST' and request.path.startswith('/chunks'):
+        if not fencing_guard.admit(request.headers.get(FENCING_HEADER), request.headers.get(FENCING_PARTITION_HEADER)):
+            chunk_log.warning("chunk.stale_fencing_token", "Rejected request with stale fencing token %s",
+                              request.headers.get(FENCING_HEADER), path=request.path)
+            return jsonify({'error': 'Stale fencing token'}), 409
+
 @app.route('/health',methods = ['GET'])
 def health():
     return jsonify({'status': 'ok'}), 200
@@ -97,35 +158,83 @@ def health():
 def store_chunk(chunk_id):
     """
     Stores a received chunk in the worker's storage.
+
+    If the request carries a replica chain, the chunk is forwarded to the next
+    worker while the local copy is written. The response lists every worker
+    in the chain that acknowledged the write.
+
+    If the request carries an offset, the data is written at that offset of
+    the chunk instead of replacing it (used to append to container chunks).
     """
+    if not is_chunk_id(chunk_id):
+        return jsonify({'error': 'Invalid chunk ID'}), 400
     chunk_data = request.data
     if not chunk_data:
         return jsonify({'error': 'No chunk data provided'}), 400
 
-    chunk_path = os.path.join(STORAGE_DIR, chunk_id)
+    offset = request.headers.get(OFFSET_HEADER)
+    if offset is not None and not offset.isdigit():
+        return jsonify({'error': 'Invalid chunk offset'}), 400
+
+    # Waits (or is refused with a 503) before forwarding, so the rest of the chain is paced alike
+    io_slot = io_scheduler.acquire(g.io_class, nbytes=len(chunk_data))
+    downstream = decode_chain(request.headers.get(CHAIN_HEADER))
+    forward_headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    forwarder = ChainForwarder(chunk_id, chunk_data, downstream, headers=forward_headers).start() if downstream else None
+
+    started = time.perf_counter()
     try:
-        with open(chunk_path, 'wb') as chunk_file:
-            chunk_file.write(chunk_data)
-        print(f"Chunk {chunk_id} stored at {chunk_path}")
-        return jsonify({'message': f'Chunk {chunk_id} stored successfully'}), 200
+        with io_slot, span("chunk.disk_write", chunk_id=chunk_id, size=len(chunk_data), offset=offset,
+                           durability=chunk_writer.mode):
+            if offset is None:
+                chunk_writer.write(chunk_id, chunk_data)
+            else:
+                chunk_writer.write_at(chunk_id, chunk_data, int(offset))
+        chunk_log.info("chunk.stored", "Chunk stored", chunk_id=chunk_id, size=len(chunk_data))
+        stored_locally = True
+        CHUNK_BYTES.labels('in').inc(len(chunk_data))
     except Exception as e:
-        print(f"Error storing chunk {chunk_id}: {e}")
-        return jsonify({'error': f'Failed to store chunk {chunk_id}'}), 500
+        chunk_log.error("chunk.store_failed", "Error storing chunk %s: %s", chunk_id, e, chunk_id=chunk_id)
+        stored_locally = False
+    CHUNK_STORE_SECONDS.observe(time.perf_counter() - started)
+
+    stored_on = [WORKER_ID] if stored_locally else []
+    if forwarder:
+        with CHUNK_FORWARD_WAIT_SECONDS.time():
+            stored_on += forwarder.wait()
+        if forwarder.error:
+            chunk_log.warning("chunk.forward_failed", "Error forwarding chunk %s down the chain: %s", chunk_id,
+                              forwarder.error, chunk_id=chunk_id)
+
+    if not stored_locally:
+        return jsonify({'error': f'Failed to store chunk {chunk_id}', 'stored_on': stored_on}), 500
+    return jsonify({'message': f'Chunk {chunk_id} stored successfully', 'stored_on': stored_on}), 200
 
 @app.route('/chunks/<chunk_id>', methods=['GET'])
 def retrieve_chunk(chunk_id):
     """
-    Retrieves a stored chunk.
+    Retrieves a stored chunk. HTTP Range requests are honoured, which is how
+    packed files are read out of container chunks.
     """
+    if not is_chunk_id(chunk_id):
+        return jsonify({'error': 'Invalid chunk ID'}), 400
     chunk_path = os.path.abspath(os.path.join(STORAGE_DIR, chunk_id))
     if not os.path.exists(chunk_path):
-        print(f"Chunk {chunk_id} not found at {chunk_path}")
+        chunk_log.info("chunk.not_found", "Chunk not found", chunk_id=chunk_id)
         return jsonify({'error': 'Chunk not found'}), 404
 
+    # The slot is held until the response is sent, and only the requested range counts against the budget
+    size = os.path.getsize(chunk_path)
+    byte_range = request.range.range_for_length(size) if request.range else None
+    io_slot = io_scheduler.acquire(g.io_class, nbytes=byte_range[1] - byte_range[0] if byte_range else size)
     try:
-        return send_file(chunk_path, as_attachment=True)
+        with CHUNK_RETRIEVE_SECONDS.time():
+            response = send_file(chunk_path, as_attachment=True)
+        CHUNK_BYTES.labels('out').inc(response.content_length or 0)
+        return release_when_sent(response, io_slot)
     except Exception as e:
-        print(f"Error retrieving chunk {chunk_id}: {e}")
+        io_slot.release()
+        chunk_log.error("chunk.retrieve_failed", "Error retrieving chunk %s: %s", chunk_id, e, chunk_id=chunk_id)
         return jsonify({'error': f'Failed to retrieve chunk {chunk_id}'}), 500
 
 @app.route('/chunks/<chunk_id>/delete', methods=['POST'])
@@ -133,19 +242,69 @@ def delete_chunk(chunk_id):
     """
     Deletes a stored chunk.
     """
+    if not is_chunk_id(chunk_id):
+        return jsonify({'error': 'Invalid chunk ID'}), 400
     chunk_path = os.path.join(STORAGE_DIR, chunk_id)
     if os.path.exists(chunk_path):
         try:
-            os.remove(chunk_path)
-            print(f"Chunk {chunk_id} deleted from {chunk_path}")
+            with io_scheduler.acquire(g.io_class):
+                os.remove(chunk_path)
+            chunk_log.info("chunk.deleted", "Chunk deleted", chunk_id=chunk_id)
             return jsonify({'message': f'Chunk {chunk_id} deleted successfully'}), 200
         except Exception as e:
-            print(f"Error deleting chunk {chunk_id}: {e}")
+            chunk_log.error("chunk.delete_failed", "Error deleting chunk %s: %s", chunk_id, e, chunk_id=chunk_id)
             return jsonify({'error': f'Failed to delete chunk {chunk_id}'}), 500
     else:
-        print(f"Chunk {chunk_id} not found for deletion at {chunk_path}")
+        chunk_log.info("chunk.not_found", "Chunk not found for deletion", chunk_id=chunk_id)
         return jsonify({'error': f'Chunk {chunk_id} not found'}), 404
 
+@app.route('/chunks', methods=['GET'])
+def list_chunks():
+    """
+    Lists the chunks stored on this worker, used by the master to find orphans.
+    """
+    chunks = []
+    now = time.time()
+    with io_scheduler.acquire(g.io_class):
+        for entry in os.scandir(STORAGE_DIR):
+            if entry.is_file() and is_chunk_id(entry.name):
+                stat = entry.stat()
+                chunks.append({
+                    'chunk_id': entry.name,
+                    'size': stat.st_size,
+                    'age_seconds': now - stat.st_mtime
+                })
+    return jsonify({'worker_id': WORKER_ID, 'chunks': chunks}), 200
+
+@app.route('/chunks/bulk_delete', methods=['POST'])
+def bulk_delete_chunks():
+    """
+    Deletes a batch of stored chunks in one request.
+    """
+    data = request.get_json(silent=True) or {}
+    chunk_ids = data.get('chunk_ids')
+    if not isinstance(chunk_ids, list):
+        return jsonify({'error': 'chunk_ids must be a list'}), 400
+
+    deleted, missing, failed = [], [], []
+    with io_scheduler.acquire(g.io_class, ops=len(chunk_ids)):
+        for chunk_id in chunk_ids:
+            if not isinstance(chunk_id, str) or not is_chunk_id(chunk_id):
+                failed.append(chunk_id)
+                continue
+            chunk_path = os.path.join(STORAGE_DIR, chunk_id)
+            try:
+                os.remove(chunk_path)
+                deleted.append(chunk_id)
+            except FileNotFoundError:
+                missing.append(chunk_id)
+            except OSError as e:
+                chunk_log.error("chunk.delete_failed", "Error deleting chunk %s: %s", chunk_id, e, chunk_id=chunk_id)
+                failed.append(chunk_id)
+
+    log.info(f"Bulk delete: {len(deleted)} deleted, {len(missing)} missing, {len(failed)} failed")
+    return jsonify({'deleted': deleted, 'missing': missing, 'failed': failed}), 200
+
 def leader_check():
     """
     Periodically checks for the current leader.
@@ -158,4 +317,4 @@ if __name__ == '__main__':
     # Start Heartbeat and Leader Check Threads
     threading.Thread(target=leader_check, daemon=True).start()
     threading.Thread(target=send_heartbeat, daemon=True).start()
-    app.run(debug=True, port=PORT, host='0.0.0.0')
+    app.run(debug=True, port=PORT, host='0.0.0.0', use_reloader=False)  # The reloader's parent would send heartbeats too
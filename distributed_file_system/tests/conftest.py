@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the services the way they run: from the distributed_file_system directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+os.environ.setdefault("DFS_CONFIG", os.path.join(PROJECT_ROOT, "config.json"))
+os.environ.setdefault("METADATA_BACKEND", "memory")
+
+
+@pytest.fixture(scope="session")
+def master():
+    """
+    The Flask master module, imported as master_1.
+    """
+    argv = sys.argv
+    sys.argv = ["master.py", "master_1"]
+    try:
+        from master_node import master
+    finally:
+        sys.argv = argv
+    return master
@@ -0,0 +1,72 @@
+from flask import Flask
+
+import shared.admin
+import shared.admission
+from shared.admin import ADMIN_TOKEN_HEADER
+from shared.admission import CLIENT_ID_HEADER, AdmissionController, admission_required, client_id
+
+
+app = Flask(__name__)
+
+
+def upload_view(controller):
+    return admission_required(lambda: {'message': 'ok'}, controller)
+
+
+def post(upload, remote_addr="10.0.0.1", headers=None):
+    with app.test_request_context('/upload', method='POST', data=b"x" * 100, headers=headers,
+                                  environ_base={'REMOTE_ADDR': remote_addr}):
+        return app.make_response(upload())
+
+
+def test_full_queue_gets_429_with_retry_after():
+    controller = AdmissionController(max_bytes=0, max_requests=1, max_queued=0)
+    upload = upload_view(controller)
+    with controller.acquire("10.0.0.2", 100):
+        response = post(upload)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == "1"
+    assert response.get_json()['reason'] == 'queue_full'
+    assert post(upload).status_code == 200  # Admitted once the other upload is done
+
+
+def test_upload_not_admitted_in_time_gets_429():
+    controller = AdmissionController(max_bytes=0, max_requests=1, max_queued=1, queue_timeout=0.05)
+    upload = upload_view(controller)
+    with controller.acquire("10.0.0.2", 100):
+        response = post(upload)
+    assert response.status_code == 429
+    assert response.get_json()['reason'] == 'timeout'
+    assert controller.queued == 0
+
+
+def test_rate_limited_client_is_told_when_to_retry():
+    controller = AdmissionController(rate=0.25, burst=1)
+    upload = upload_view(controller)
+    assert post(upload).status_code == 200
+    response = post(upload)
+    assert response.status_code == 429
+    assert response.get_json()['reason'] == 'rate_limited'
+    assert 3 <= int(response.headers['Retry-After']) <= 4
+    assert post(upload, remote_addr="10.0.0.2").status_code == 200  # Other clients have their own rate
+
+
+def test_clients_cannot_pick_their_own_client_id():
+    controller = AdmissionController(rate=0.25, burst=1)
+    upload = upload_view(controller)
+    assert post(upload, headers={CLIENT_ID_HEADER: "client-1"}).status_code == 200
+    assert post(upload, headers={CLIENT_ID_HEADER: "client-2"}).status_code == 429
+
+
+def test_client_ids_relayed_by_trusted_proxies_are_honored(monkeypatch):
+    monkeypatch.setattr(shared.admission, "TRUSTED_PROXIES", frozenset({"10.0.0.9"}))
+    assert client_id({CLIENT_ID_HEADER: "client-1"}, "10.0.0.9") == "client-1"
+    assert client_id({CLIENT_ID_HEADER: "client-1"}, "10.0.0.1") == "10.0.0.1"
+    assert client_id({}, "10.0.0.9") == "10.0.0.9"
+
+
+def test_client_ids_relayed_with_the_admin_token_are_honored(monkeypatch):
+    monkeypatch.setattr(shared.admin, "ADMIN_TOKEN", "secret")
+    assert client_id({CLIENT_ID_HEADER: "client-1", ADMIN_TOKEN_HEADER: "secret"}, "10.0.0.1") == "client-1"
+    assert client_id({CLIENT_ID_HEADER: "client-1", ADMIN_TOKEN_HEADER: "guess"}, "10.0.0.1") == "10.0.0.1"
+
@@ -0,0 +1,44 @@
+import pytest
+
+from shared.chunking import MAX_CHUNK_SIZE, MB, MIN_CHUNK_SIZE, choose_chunk_size, split_ranges
+
+GB = 1024 * MB
+
+
+@pytest.mark.parametrize("file_size", [0, 1, MB, 100 * MB, 10 * GB, 1024 * GB])
+@pytest.mark.parametrize("num_workers", [0, 1, 5, 100])
+def test_chunk_size_is_a_power_of_two_within_bounds(file_size, num_workers):
+    chunk_size = choose_chunk_size(file_size, num_workers)
+    assert MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE
+    assert chunk_size & (chunk_size - 1) == 0
+
+
+def test_small_files_get_the_smallest_chunks():
+    assert choose_chunk_size(10 * 1024, 5) == MIN_CHUNK_SIZE
+
+
+def test_large_files_get_the_largest_chunks():
+    assert choose_chunk_size(1024 * GB, 5) == MAX_CHUNK_SIZE
+
+
+def test_chunk_size_spreads_a_file_over_the_workers():
+    # 5 workers aim for 20 chunks: 320 MB in 16 MB chunks
+    assert choose_chunk_size(320 * MB, 5) == 16 * MB
+
+
+@pytest.mark.parametrize("hint_mb, expected", [
+    (8, 8 * MB),
+    ("2", 2 * MB),
+    (0.001, MIN_CHUNK_SIZE),
+    (10 ** 6, MAX_CHUNK_SIZE),
+    (3, 4 * MB),
+    (9.5, 16 * MB),
+])
+def test_hint_takes_precedence_but_is_clamped_to_a_power_of_two(hint_mb, expected):
+    assert choose_chunk_size(320 * MB, 5, hint_mb=hint_mb) == expected
+
+
+def test_ranges_cover_the_file():
+    ranges = split_ranges(10 * MB + 1, 4 * MB)
+    assert ranges == [(0, 4 * MB), (4 * MB, 8 * MB), (8 * MB, 10 * MB + 1)]
+    assert split_ranges(0, 4 * MB) == []
@@ -0,0 +1,55 @@
+import pytest
+
+from database.sqlite_store import SQLiteMetadataStore
+
+
+@pytest.fixture
+def packing(master, monkeypatch):
+    """
+    The master of partition 0, appending small files to containers on three
+    workers that accept every write.
+    """
+    from database.db_operations import update_worker
+
+    for i in range(1, 4):
+        update_worker(f"worker_{i}", f"http://worker-{i}")
+    monkeypatch.setattr(master, "store_chunk_replicas", lambda *args, **kwargs: None)
+    monkeypatch.setattr(master, "open_containers", {})
+    return master
+
+
+def test_appends_are_only_recorded_to_open_containers():
+    store = SQLiteMetadataStore(":memory:")
+    store.create_container("container-1", ["worker_1"])
+    assert store.record_container_append("container-1", 100, 100)
+    store.seal_containers(["container-1"])
+    assert not store.record_container_append("container-1", 200, 100)
+    assert not store.record_container_append("missing", 100, 100)
+    [container] = store.fetch_containers_to_compact(1.0)
+    assert container["size"] == 100 and container["live_bytes"] == 100
+
+
+def test_stepping_down_forgets_the_open_container(packing):
+    packing.pack_small_file(b"x" * 10, partition=0)
+    assert 0 in packing.open_containers
+    packing.step_down(0, "test")
+    assert 0 not in packing.open_containers
+
+
+def test_pack_fails_once_another_leader_sealed_the_container(packing):
+    first = packing.pack_small_file(b"x" * 10, partition=0)
+    packing.seal_containers([first["chunk_id"]])  # As the interim leader of the partition would
+    with pytest.raises(Exception, match="no longer open"):
+        packing.pack_small_file(b"y" * 10, partition=0)
+    assert 0 not in packing.open_containers
+    assert packing.pack_small_file(b"z" * 10, partition=0)["chunk_id"] != first["chunk_id"]
+
+
+def test_full_container_is_sealed_after_its_last_append(packing, monkeypatch):
+    monkeypatch.setattr(packing, "CONTAINER_MAX_SIZE", 15)
+    first = packing.pack_small_file(b"x" * 10, partition=0)
+    container = packing.open_containers[0]
+    container["appending"] += 1  # An append still writing its replicas
+    second = packing.pack_small_file(b"y" * 10, partition=0)
+    assert second["chunk_id"] != first["chunk_id"]
+    assert packing.record_container_append(first["chunk_id"], 20, 10)  # Still open for the append in flight
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from shared.fencing import FencingTokenGuard
+
+
+def test_rejects_tokens_older_than_the_highest_seen():
+    guard = FencingTokenGuard()
+    assert guard.admit("5")
+    assert guard.admit("5")  # The current leader keeps writing
+    assert guard.admit("6")
+    assert not guard.admit("5")  # The deposed leader is fenced off
+
+
+def test_partitions_have_their_own_token_sequences():
+    guard = FencingTokenGuard()
+    assert guard.admit("7", "1")
+    assert guard.admit("2", "0")
+    assert guard.admit("2")  # No partition header: partition 0
+    assert not guard.admit("6", "1")
+
+
+def test_requests_without_a_token_are_admitted():
+    guard = FencingTokenGuard()
+    guard.admit("9")
+    assert guard.admit(None)
+
+
+def test_malformed_tokens_are_rejected():
+    guard = FencingTokenGuard()
+    assert not guard.admit("abc")
+    assert not guard.admit("3", "partition")
+
+
+def test_highest_tokens_survive_a_restart(tmp_path):
+    state_path = str(tmp_path / "fencing.json")
+    FencingTokenGuard(state_path).admit("4", "2")
+    guard = FencingTokenGuard(state_path)
+    assert not guard.admit("3", "2")
+    assert guard.admit("4", "2")
+
+
+def test_reads_the_single_token_of_older_versions(tmp_path):
+    state_path = tmp_path / "fencing.json"
+    state_path.write_text(json.dumps(12))
+    guard = FencingTokenGuard(str(state_path))
+    assert not guard.admit("11")
+    assert guard.admit("1", "1")
+
+
+def test_unreadable_state_is_not_mistaken_for_no_tokens(tmp_path):
+    state_path = tmp_path / "fencing.json"
+    state_path.write_bytes(b"\x00 not a token")
+    with pytest.raises(ValueError, match="Unreadable fencing token state"):
+        FencingTokenGuard(str(state_path))
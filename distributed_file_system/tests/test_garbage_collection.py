@@ -0,0 +1,61 @@
+import contextvars
+import json
+
+import pytest
+import requests
+
+from shared.io_scheduler import BACKGROUND, IO_PRIORITY_HEADER, set_io_priority
+
+
+def json_response(body):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(body).encode()
+    return response
+
+
+@pytest.fixture
+def worker_requests(master, monkeypatch):
+    """
+    Records the headers of the requests the master makes to a worker.
+    """
+    sent = []
+
+    def post(url, json=None, headers=None, timeout=None):
+        sent.append((url, headers or {}))
+        return json_response({'failed': []})
+
+    def get(url, headers=None, timeout=None):
+        sent.append((url, headers or {}))
+        return json_response({'chunks': []})
+
+    monkeypatch.setattr(requests, "post", post)
+    monkeypatch.setattr(requests, "get", get)
+    monkeypatch.setattr(master, "get_live_workers", lambda: [{'worker_id': 'worker_1', 'url': 'http://worker-1'}])
+    return sent
+
+
+def in_background_job(function, *args):
+    """
+    Runs a function the way the garbage collector thread does, without
+    leaving the background priority set on the test thread.
+    """
+    def job():
+        set_io_priority(BACKGROUND)
+        return function(*args)
+    return contextvars.copy_context().run(job)
+
+
+def test_deletes_on_the_gc_pool_keep_the_background_priority(master, worker_requests, monkeypatch):
+    pending = [{'file_id': 'f', 'chunks': [{'chunk_id': 'c', 'worker_ids': ['worker_1']}]}]
+    monkeypatch.setattr(master, "fetch_files_pending_gc", lambda limit, partition: pending)
+    monkeypatch.setattr(master, "mark_files_collected", lambda file_ids: None)
+    in_background_job(master.collect_deleted_files, 0)
+    assert [headers.get(IO_PRIORITY_HEADER) for url, headers in worker_requests] == [BACKGROUND]
+
+
+def test_inventory_scans_on_the_gc_pool_keep_the_background_priority(master, worker_requests, monkeypatch):
+    monkeypatch.setattr(master, "fetch_chunk_placements", lambda: [])
+    monkeypatch.setattr(master, "fetch_live_containers", lambda: [])
+    in_background_job(master.reconcile_worker_inventories)
+    assert [headers.get(IO_PRIORITY_HEADER) for url, headers in worker_requests] == [BACKGROUND]
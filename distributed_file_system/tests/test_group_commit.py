@@ -0,0 +1,155 @@
+import threading
+
+import pytest
+
+from database.group_commit import GroupCommitWriter
+from database.metadata_store import usage_deltas
+from database.sqlite_store import SQLiteMetadataStore
+
+
+class PartialWriteStore:
+    """
+    Stands in for a store without transactions (like MongoMetadataStore):
+    files and usage counters are separate writes, and files carry the usage
+    they have yet to count. Bulk writes can be made to fail half way.
+    """
+
+    def __init__(self):
+        self.files = {}  # File ID -> document (with usage_pending)
+        self.usage = {}  # Owner -> [bytes, files, chunks]
+        self.fail_bulk_after = None  # Documents a bulk write applies before failing, without counting them
+        self.bad_file_ids = set()  # Files every insert of fails
+
+    def _add_usage(self, file_docs, sign):
+        for owner, delta in usage_deltas(file_docs, sign).items():
+            counters = self.usage.setdefault(owner, [0, 0, 0])
+            for index, value in enumerate(delta):
+                counters[index] += value
+        for file_doc in file_docs:
+            self.files[file_doc["file_id"]]["usage_pending"] -= sign
+
+    def _insert(self, file_doc):
+        if file_doc["file_id"] in self.bad_file_ids or file_doc["file_id"] in self.files:
+            raise ValueError(f"Cannot insert {file_doc['file_id']}")
+        self.files[file_doc["file_id"]] = dict(file_doc, usage_pending=1)
+
+    def _tombstone(self, file_id):
+        file_doc = self.files.get(file_id)
+        if file_doc is None or file_doc["status"] != "active":
+            return None
+        file_doc["status"] = "deleted"
+        file_doc["usage_pending"] -= 1
+        return file_doc
+
+    def store_file_metadata(self, file_doc):
+        self._insert(file_doc)
+        self._add_usage([file_doc], 1)
+
+    def store_files_metadata(self, file_docs):
+        if self.fail_bulk_after is not None:
+            for file_doc in file_docs[:self.fail_bulk_after]:
+                self._insert(file_doc)
+            raise ConnectionError("Connection lost during the bulk insert")
+        for file_doc in file_docs:
+            self._insert(file_doc)
+        self._add_usage(file_docs, 1)
+
+    def fetch_file_metadata(self, file_id):
+        return self.files.get(file_id)
+
+    def tombstone_file(self, file_id):
+        file_doc = self._tombstone(file_id)
+        if file_doc is None:
+            return False
+        self._add_usage([file_doc], -1)
+        return True
+
+    def tombstone_files(self, file_ids):
+        if self.fail_bulk_after is not None:
+            for file_id in file_ids[:self.fail_bulk_after]:
+                self._tombstone(file_id)
+            raise ConnectionError("Connection lost during the bulk tombstone")
+        tombstoned = [file_doc for file_doc in map(self._tombstone, file_ids) if file_doc is not None]
+        self._add_usage(tombstoned, -1)
+        return [file_doc["file_id"] for file_doc in tombstoned]
+
+    def settle_usage(self, file_ids):
+        pending = [self.files[file_id] for file_id in file_ids if self.files.get(file_id, {}).get("usage_pending")]
+        for file_doc in pending:
+            self._add_usage([file_doc], file_doc["usage_pending"])
+        return [file_doc["file_id"] for file_doc in pending]
+
+
+def file_doc(file_id, owner="acme", size=100):
+    return {"file_id": file_id, "owner": owner, "size": size, "chunks": [{"chunk_id": f"{file_id}-0"}],
+            "status": "active"}
+
+
+def commit_together(writer, calls):
+    """
+    Makes the calls from one thread each, so that they are committed as one
+    batch (the writer's max_batch), and returns their results or errors.
+    """
+    outcomes = [None] * len(calls)
+
+    def call(index, method, value):
+        try:
+            outcomes[index] = getattr(writer, method)(value)
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=call, args=(index, *args)) for index, args in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return outcomes
+
+
+@pytest.fixture
+def store():
+    return PartialWriteStore()
+
+
+def writer_for(store, batch_size):
+    return GroupCommitWriter(store, window=10, max_batch=batch_size)
+
+
+def test_partial_bulk_insert_is_retried_and_counted_once(store):
+    store.fail_bulk_after = 2
+    outcomes = commit_together(writer_for(store, 4), [("insert_file", file_doc(f"f{i}")) for i in range(4)])
+    assert outcomes == [None] * 4
+    assert sorted(store.files) == ["f0", "f1", "f2", "f3"]
+    assert store.usage == {"acme": [400, 4, 4]}
+    assert all(doc["usage_pending"] == 0 for doc in store.files.values())
+
+
+def test_bad_record_only_fails_its_own_caller(store):
+    store.bad_file_ids = {"f1"}
+    outcomes = commit_together(writer_for(store, 3), [("insert_file", file_doc(f"f{i}")) for i in range(3)])
+    assert outcomes[0] is None and outcomes[2] is None
+    assert isinstance(outcomes[1], ValueError)
+    assert store.usage == {"acme": [200, 2, 2]}
+
+
+def test_partial_bulk_tombstone_is_retried_and_counted_once(store):
+    for i in range(3):
+        store.store_file_metadata(file_doc(f"f{i}"))
+    store.fail_bulk_after = 1
+    commit_together(writer_for(store, 3), [("tombstone_file", f"f{i}") for i in range(3)])
+    assert store.usage == {"acme": [0, 0, 0]}
+    assert all(doc["status"] == "deleted" and doc["usage_pending"] == 0 for doc in store.files.values())
+
+
+def test_usage_follows_batched_inserts_and_tombstones():
+    store = SQLiteMetadataStore(":memory:")
+    writer = writer_for(store, 3)
+    commit_together(writer, [("insert_file", file_doc("f0")), ("insert_file", file_doc("f1", size=50)),
+                             ("insert_file", file_doc("f2", owner="other"))])
+    assert store.fetch_usage("acme")["bytes"] == 150 and store.fetch_usage("acme")["files"] == 2
+    # A duplicate delete in the same batch finds the file already deleted
+    outcomes = commit_together(writer, [("tombstone_file", "f0"), ("tombstone_file", "f0"), ("tombstone_file", "f2")])
+    assert sorted(outcomes[:2]) == [False, True] and outcomes[2] is True
+    assert {key: store.fetch_usage("acme")[key] for key in ("bytes", "files", "chunks")} == \
+        {"bytes": 50, "files": 1, "chunks": 1}
+    assert store.fetch_usage("other")["files"] == 0
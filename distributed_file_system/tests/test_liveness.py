@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from master_node.liveness import WorkerLivenessTable
+
+
+def test_leader_detects_dead_workers_before_any_request_seeds_the_table(master, monkeypatch):
+    now = datetime.utcnow()
+    persisted = [
+        {'worker_id': 'worker_1', 'url': 'http://worker-1', 'status': 'active', 'last_heartbeat': now - timedelta(minutes=5)},
+        {'worker_id': 'worker_2', 'url': 'http://worker-2', 'status': 'active', 'last_heartbeat': now},
+    ]
+    liveness = WorkerLivenessTable(10)
+    monkeypatch.setattr(master, "liveness", liveness)
+    monkeypatch.setattr(master, "is_leader", lambda partition=0: True)
+    monkeypatch.setattr(master, "fetch_workers", lambda: persisted)
+
+    liveness.record_heartbeat('worker_2', 'http://worker-2')  # The leader only receives heartbeats
+    assert master.detect_inactive_workers() == ['worker_1']
+    assert [worker['worker_id'] for worker in liveness.active_workers()] == ['worker_2']
+
+
+def test_followers_leave_detection_to_the_leader(master, monkeypatch):
+    monkeypatch.setattr(master, "liveness", WorkerLivenessTable(10))
+    monkeypatch.setattr(master, "is_leader", lambda partition=0: False)
+    assert master.detect_inactive_workers() == []
+    assert not master.liveness.seeded
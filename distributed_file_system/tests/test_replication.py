@@ -0,0 +1,94 @@
+import json
+
+import pytest
+import requests
+
+from shared.replication import CHAIN_HEADER, decode_chain, send_chunk_along_chain
+
+WORKER_URLS = {f"worker_{i}": f"http://worker-{i}" for i in range(1, 4)}
+
+
+class FakeWorkers:
+    """
+    Stands in for the workers' POST /chunks/<id>: stores the chunk and
+    forwards it down the rest of the chain, like store_chunk does.
+    """
+
+    def __init__(self, down=()):
+        self.down = {WORKER_URLS[worker_id] for worker_id in down}
+        self.stored = {}  # Worker ID -> chunk IDs
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        worker_url, _, chunk_id = url.partition("/chunks/")
+        if worker_url in self.down:
+            raise requests.exceptions.ConnectionError(f"{worker_url} is down")
+        worker_id = next(worker_id for worker_id, known in WORKER_URLS.items() if known == worker_url)
+        self.stored.setdefault(worker_id, set()).add(chunk_id)
+        stored_on = [worker_id]
+        downstream = decode_chain((headers or {}).get(CHAIN_HEADER))
+        if downstream:
+            forward_headers = {name: value for name, value in headers.items() if name != CHAIN_HEADER}
+            try:
+                stored_on += send_chunk_along_chain(chunk_id, data, downstream, headers=forward_headers)
+            except requests.exceptions.RequestException:
+                pass
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({'stored_on': stored_on}).encode()
+        return response
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    def install(down=()):
+        fake = FakeWorkers(down)
+        monkeypatch.setattr(requests, "post", fake.post)
+        return fake
+    return install
+
+
+def test_chain_reaches_every_replica(workers):
+    workers()
+    assert send_chunk_along_chain("c", b"data", list(WORKER_URLS.values())) == ["worker_1", "worker_2", "worker_3"]
+
+
+def test_chain_skips_unreachable_head(workers):
+    fake = workers(down=["worker_1"])
+    assert send_chunk_along_chain("c", b"data", list(WORKER_URLS.values())) == ["worker_2", "worker_3"]
+    assert "worker_1" not in fake.stored
+
+
+def test_chain_skips_unreachable_middle_hop(workers):
+    workers(down=["worker_2"])
+    assert send_chunk_along_chain("c", b"data", list(WORKER_URLS.values())) == ["worker_1", "worker_3"]
+
+
+def test_chain_raises_when_every_hop_is_down(workers):
+    workers(down=list(WORKER_URLS))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        send_chunk_along_chain("c", b"data", list(WORKER_URLS.values()))
+
+
+@pytest.mark.parametrize("down", [["worker_1"], ["worker_2"], ["worker_3"]])
+def test_store_reaches_quorum_with_one_replica_down(master, workers, monkeypatch, down):
+    monkeypatch.setattr(master, "REPLICATION_MODE", "chain")
+    workers(down=down)
+    durable = master.store_chunk_replicas("c", b"data", list(WORKER_URLS), WORKER_URLS, quorum=2)
+    assert sorted(durable) == sorted(set(WORKER_URLS) - set(down))
+
+
+def test_store_writes_missing_replicas_directly_when_chain_falls_short(master, workers, monkeypatch):
+    monkeypatch.setattr(master, "REPLICATION_MODE", "chain")
+    fake = workers()
+    # The head stores the chunk but loses the rest of the chain
+    monkeypatch.setattr(master, "send_chunk_along_chain", lambda chunk_id, data, urls, headers=None: ["worker_1"])
+    durable = master.store_chunk_replicas("c", b"data", list(WORKER_URLS), WORKER_URLS, quorum=3)
+    assert sorted(durable) == ["worker_1", "worker_2", "worker_3"]
+    assert "worker_1" not in fake.stored  # Only the missing replicas were written directly
+
+
+def test_store_fails_below_quorum(master, workers, monkeypatch):
+    monkeypatch.setattr(master, "REPLICATION_MODE", "chain")
+    workers(down=["worker_1", "worker_3"])
+    with pytest.raises(Exception, match="only 1 of 2 required replicas are durable"):
+        master.store_chunk_replicas("c", b"data", list(WORKER_URLS), WORKER_URLS, quorum=2)